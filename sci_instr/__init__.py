@@ -0,0 +1,55 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+the drivers and helpers are imported from their modules on first access
+(import sci_instr stays cheap, sci_instr.AQ6370C imports sci_instr.osa)
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import importlib
+
+
+
+# name: module of the drivers and helper classes
+_LAZY = {'Instrument':'generic',
+         'AQ6370C':'osa',
+         'HP71451B':'osa',
+         'N9000A':'rfsa',
+         'SSA3000X':'rfsa',
+         'MS2721':'rfsa',
+         'RS_RTO1044':'oscilloscope',
+         'Tktx_DP7254':'oscilloscope',
+         'Katana':'misc',
+         'Manson_HSC3202':'misc',
+         'TL_PM100':'misc',
+         'TL_TSP01':'misc',
+         'APE_PulseCheck_LR':'misc',
+         'AsyncInstrument':'asynchronous',
+         'InstrumentPool':'pool',
+         'TraceStream':'stream',
+         'Trace':'trace',
+         'Sweep':'sweep',
+         'TraceRecorder':'recorder',
+         'TraceStore':'recorder',
+         'TelemetryPoller':'telemetry',
+         'Scheduler':'scheduler',
+         'Fleet':'fleet',
+         'IOStats':'iostats',
+         'SerialLink':'serial_link',
+         'SimResourceManager':'sim'}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError('module {} has no attribute {}'.format(__name__,name))
+    value = getattr(importlib.import_module('.' + module,__name__),name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
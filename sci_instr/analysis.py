@@ -0,0 +1,248 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+analysis of spectra on the host (peak, FWHM, centroid, SMSR, band power,
+noise floor), vectorized over batches of traces
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import numpy as np
+
+from sci_instr.trace import Trace
+
+
+
+# compiled edge search (numba) or False if numba is not available
+_compiled = None
+
+
+def _edge_kernel():
+    """The numba compiled _edges_loop, or None without numba"""
+    global _compiled
+    if _compiled is None:
+        try:
+            import numba
+            _compiled = numba.njit(cache=True)(_edges_loop)
+        except ImportError:
+            _compiled = False
+    return _compiled or None
+
+
+def _edges_loop(y,peaks,thresholds,left,right):
+    """Fractional indices where the rows of y fall below thresholds,
+    searched outward from peaks (nan if not within the trace)"""
+    rows, points = y.shape
+    for row in range(rows):
+        p = peaks[row]
+        level = thresholds[row]
+        left[row] = np.nan
+        j = p
+        while j > 0:
+            if y[row,j-1] < level:
+                left[row] = j - (y[row,j] - level)/(y[row,j] - y[row,j-1])
+                break
+            j -= 1
+        right[row] = np.nan
+        j = p
+        while j < points - 1:
+            if y[row,j+1] < level:
+                right[row] = j + (y[row,j] - level)/(y[row,j] - y[row,j+1])
+                break
+            j += 1
+
+
+def _edges_numpy(y,peaks,thresholds):
+    """Vectorized version of _edges_loop"""
+    rows, points = y.shape
+    index = np.arange(points)
+    below = y < thresholds[:,None]
+    outer = np.where(below & (index <= peaks[:,None]),index,-1).max(axis=1)
+    inner = np.minimum(outer + 1,points - 1)
+    left = _crossing(y,outer,inner,thresholds,outer >= 0)
+
+    outer = np.where(below & (index >= peaks[:,None]),index,points).min(axis=1)
+    inner = np.maximum(outer - 1,0)
+    right = _crossing(y,outer,inner,thresholds,outer < points)
+    return left, right
+
+
+def _crossing(y,outer,inner,thresholds,found):
+    """Fractional index between inner (above) and outer (below) where the
+    linear interpolation of y crosses thresholds"""
+    rows = np.arange(len(y))
+    outer = np.clip(outer,0,y.shape[1] - 1)
+    y_outer = y[rows,outer]
+    y_inner = y[rows,inner]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        position = inner + (outer - inner)*(y_inner - thresholds)/(y_inner - y_outer)
+    return np.where(found,position,np.nan)
+
+
+def _prepare(trace,x,db):
+    """x (1-D), y as 2-D float array (one trace per row), whether the
+    input was one trace and whether y is logarithmic
+
+    trace: Trace or array (1-D or 2-D); x: the x axis (default: x of the
+    Trace or the index); db: y in dB (None: from the y unit of a Trace,
+    True for arrays as the spectra of the drivers are in dB)"""
+
+    if isinstance(trace,Trace):
+        if x is None:
+            x = trace.x
+        if db is None:
+            db = 'db' in trace.y_unit.lower()
+        trace = trace.data
+    y = np.asarray(trace,dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    if not y.ndim == 2:
+        raise AttributeError('Expected one trace or a 2-D array of traces; got shape {}'.format(y.shape))
+    x = np.arange(y.shape[1],dtype=float) if x is None else np.asarray(x,dtype=float)
+    if not x.shape == (y.shape[1],):
+        raise AttributeError('x has shape {}; expected: {}'.format(x.shape,(y.shape[1],)))
+    return x, y, single, True if db is None else db
+
+
+def _result(values,single):
+    return values[0] if single else values
+
+
+def _linear(y,db):
+    """Power in linear units (mW for dBm)"""
+    return 10**(y/10) if db else y
+
+
+def _x_at(x,position):
+    """x at fractional indices"""
+    return np.interp(position,np.arange(len(x)),x,left=np.nan,right=np.nan)
+
+
+
+def peak(trace,x=None,interpolate=False):
+    """(x, y) of the maximum of each trace; with interpolate the maximum of
+    the parabola through the highest point and its neighbours"""
+
+    x, y, single, _ = _prepare(trace,x,True)
+    rows = np.arange(len(y))
+    index = y.argmax(axis=1)
+    position = index.astype(float)
+    level = y[rows,index]
+    if interpolate and y.shape[1] > 2:
+        inner = np.clip(index,1,y.shape[1] - 2)
+        y0, y1, y2 = y[rows,inner-1], y[rows,inner], y[rows,inner+1]
+        curvature = y0 - 2*y1 + y2
+        with np.errstate(divide='ignore',invalid='ignore'):
+            shift = np.where((inner == index) & (curvature < 0),0.5*(y0 - y2)/curvature,0.0)
+        position = index + shift
+        level = y1 - 0.25*(y0 - y2)*shift
+    return _result(_x_at(x,position),single), _result(level,single)
+
+
+def fwhm(trace,x=None,level=3.0,db=None,fast=None):
+    """(width, center) of the peak of each trace at level dB below the
+    maximum (the 3 dB bandwidth; linear traces: factor 10**(-level/10) of
+    the maximum, about one half); center is the middle of the two edges,
+    nan if an edge is outside the trace
+
+    fast: use the numba compiled edge search (None: if numba is
+    installed), which only walks from the peak to the edges"""
+
+    x, y, single, db = _prepare(trace,x,db)
+    peaks = y.argmax(axis=1)
+    maxima = y[np.arange(len(y)),peaks]
+    thresholds = maxima - level if db else maxima*10**(-level/10)
+
+    kernel = _edge_kernel() if fast is None or fast else None
+    if fast and kernel is None:
+        raise AttributeError('fast analysis needs numba')
+    if kernel is not None:
+        left = np.empty(len(y))
+        right = np.empty(len(y))
+        kernel(np.ascontiguousarray(y),peaks,thresholds,left,right)
+    else:
+        left, right = _edges_numpy(y,peaks,thresholds)
+
+    x_left, x_right = _x_at(x,left), _x_at(x,right)
+    return _result(x_right - x_left,single), _result(0.5*(x_left + x_right),single)
+
+
+def centroid(trace,x=None,threshold=20.0,db=None):
+    """Power weighted mean x of each trace (center wavelength), using only
+    points at most threshold dB below the maximum (None: all points)"""
+
+    x, y, single, db = _prepare(trace,x,db)
+    power = _linear(y,db)
+    if threshold is not None:
+        maxima = power.max(axis=1,keepdims=True)
+        power = np.where(power >= maxima*10**(-threshold/10),power,0.0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        values = (power @ x)/power.sum(axis=1)
+    return _result(values,single)
+
+
+def smsr(trace,x=None,exclude=None,db=None):
+    """Side mode suppression ratio in dB of each trace: the maximum minus
+    the highest local maximum outside the main mode, which is the range
+    of +-exclude/2 around the peak (None: the falling flanks of the peak
+    down to their first local minimum); nan without side mode"""
+
+    x, y, single, db = _prepare(trace,x,db)
+    level = y if db else 10*np.log10(np.maximum(y,np.finfo(float).tiny))
+    points = level.shape[1]
+    index = np.arange(points)
+    peaks = level.argmax(axis=1)
+    maxima = level[np.arange(len(level)),peaks]
+
+    if exclude is not None:
+        x_peak = x[peaks]
+        main = np.abs(x[None,:] - x_peak[:,None]) <= exclude/2
+    else:
+        # flanks: falling from the peak while stepping away from it
+        rising = np.zeros(level.shape,dtype=bool)
+        rising[:,1:] = level[:,1:] > level[:,:-1]
+        falling = np.zeros(level.shape,dtype=bool)
+        falling[:,:-1] = level[:,:-1] > level[:,1:]
+        left = np.where(~rising & (index <= peaks[:,None]),index,0).max(axis=1)
+        right = np.where(~falling & (index >= peaks[:,None]),index,points - 1).min(axis=1)
+        main = (index >= left[:,None]) & (index <= right[:,None])
+
+    local = np.zeros(level.shape,dtype=bool)
+    local[:,1:-1] = (level[:,1:-1] >= level[:,:-2]) & (level[:,1:-1] > level[:,2:])
+    side = np.where(local & ~main,level,-np.inf).max(axis=1)
+    values = np.where(np.isfinite(side),maxima - side,np.nan)
+    return _result(values,single)
+
+
+def band_power(trace,x=None,start=None,stop=None,resolution_bandwidth=None,db=None):
+    """Power in the band start <= x <= stop (default: whole trace) of each
+    trace, in dBm for dB traces
+
+    Without resolution_bandwidth the points are summed (OSA: power per
+    point); with it the sum is scaled by point spacing /
+    resolution_bandwidth (spectrum analyzer channel power)."""
+
+    x, y, single, db = _prepare(trace,x,db)
+    inside = np.ones(len(x),dtype=bool)
+    if start is not None:
+        inside &= x >= start
+    if stop is not None:
+        inside &= x <= stop
+    power = _linear(y[:,inside],db).sum(axis=1)
+    if resolution_bandwidth is not None and len(x) > 1:
+        power = power*abs(x[-1] - x[0])/(len(x) - 1)/resolution_bandwidth
+    if db:
+        with np.errstate(divide='ignore'):
+            power = 10*np.log10(power)
+    return _result(power,single)
+
+
+def noise_floor(trace,x=None,percentile=10.0,db=None):
+    """Noise floor of each trace: the percentile of the points (robust
+    against the signal as long as it covers less of the trace), in the
+    unit of the trace"""
+
+    x, y, single, db = _prepare(trace,x,db)
+    return _result(np.percentile(y,percentile,axis=1),single)
@@ -0,0 +1,118 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+asyncio front-end for instruments: the blocking VISA I/O of every
+resource runs on its own worker thread, so different instruments work
+concurrently while the commands to one instrument stay in order
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import asyncio
+import concurrent.futures
+import functools
+import threading
+import time
+
+
+
+# one single thread executor per VISA resource name
+_executors = {}
+_executorLock = threading.Lock()
+
+
+def resource_executor(instrument):
+    """Returns the single thread executor of the VISA resource of
+    instrument (created on first use)"""
+
+    name = getattr(instrument,'_resourceKey',None) or getattr(instrument._visa,'resource_name',None) or id(instrument)
+    with _executorLock:
+        if not name in _executors:
+            _executors[name] = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                     thread_name_prefix='sci_instr {}'.format(name))
+        return _executors[name]
+
+
+
+class AsyncInstrument():
+    """Wraps an Instrument for use with asyncio
+
+    Properties, traces and methods are available as coroutines:
+
+        osa = AsyncInstrument(AQ6370C(rm,address))
+        await osa.set('centerwl',1550e-9)
+        data = await osa.get('data')       # or: await osa.async_data
+        await osa.call('start_sweep')      # or: await osa.async_start_sweep()
+    """
+
+    def __init__(self,instrument,executor=None):
+        self.instrument = instrument
+        self._executor = executor if executor is not None else resource_executor(instrument)
+
+    async def run(self,func,*args,**kwargs):
+        """Run func(*args,**kwargs) on the worker thread of the resource"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor,functools.partial(func,*args,**kwargs))
+
+    async def get(self,prop):
+        """Value of a property or trace"""
+        return await self.run(getattr,self.instrument,prop)
+
+    async def set(self,prop,value):
+        """Set a read write property"""
+        await self.run(setattr,self.instrument,prop,value)
+
+    async def get_many(self,props,cached=True):
+        """See Instrument.get_many"""
+        return await self.run(self.instrument.get_many,props,cached)
+
+    async def set_many(self,values):
+        """See Instrument.set_many"""
+        await self.run(self.instrument.set_many,values)
+
+    async def call(self,method,*args,**kwargs):
+        """Call a method of the instrument, e.g. 'start_sweep'"""
+        return await self.run(getattr(self.instrument,method),*args,**kwargs)
+
+    def __getattr__(self,name):
+        """async_<name> twins: coroutine for properties and traces,
+        coroutine function for methods"""
+
+        if not name.startswith('async_'):
+            raise AttributeError(name)
+        name = name[len('async_'):]
+
+        attribute = getattr(type(self.instrument),name,None)
+        if callable(attribute):
+            async def method(*args,**kwargs):
+                return await self.call(name,*args,**kwargs)
+            return method
+        if attribute is None:
+            raise AttributeError('Unknown property ' + name)
+        return self.get(name)
+
+
+
+async def snapshot(rack):
+    """Read properties of many instruments concurrently
+
+    rack is a dict name: (instrument, [props]) where instrument is an
+    Instrument or AsyncInstrument. Returns a dict name: {prop: value}
+    and the start and end time of the snapshot under '_time'"""
+
+    names = list(rack)
+    instruments = []
+    for name in names:
+        instrument = rack[name][0]
+        if not isinstance(instrument,AsyncInstrument):
+            instrument = AsyncInstrument(instrument)
+        instruments.append(instrument)
+
+    start = time.time()
+    values = await asyncio.gather(*[instrument.get_many(rack[name][1])
+                                    for name,instrument in zip(names,instruments)])
+    result = dict(zip(names,values))
+    result['_time'] = (start,time.time())
+    return result
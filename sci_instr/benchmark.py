@@ -0,0 +1,179 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+benchmarks of the driver stack on simulated instruments (sci_instr.sim)
+
+    python -m sci_instr.benchmark --latency 0.0005 --save bench.json
+    python -m sci_instr.benchmark --baseline bench.json --tolerance 0.2
+
+Metrics ending in _s are seconds (lower is better), metrics ending in
+_MBps are transfer rates (higher is better). With --baseline the exit
+code is 1 if a metric got worse than the tolerance allows.
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import argparse
+import json
+import sys
+import time
+
+from sci_instr.sim import SimResourceManager
+from sci_instr import misc, osa, oscilloscope, rfsa
+
+
+
+# driver, trace, options of the simulated instrument
+DRIVERS = (('AQ6370C',osa.AQ6370C,'data',{'operations':{':init':0.01}}),
+           ('HP71451B',osa.HP71451B,'data',{'values':{'points':801},
+                                                'units':{'span':1e-9,'centerwl':1e-9,'bandwidth':1e-9}}),
+           ('N9000A',rfsa.N9000A,'data1',{'values':{'points':1001}}),
+           ('SSA3000X',rfsa.SSA3000X,'data1',{'values':{'points':751},'header':'empty'}),
+           ('MS2721',rfsa.MS2721,'data1',{}),
+           ('RS_RTO1044',oscilloscope.RS_RTO1044,'ch1_data',{'points':100000}),
+           ('Tktx_DP7254',oscilloscope.Tktx_DP7254,'curve',{'values':{'points':100000}}),
+           ('TL_PM100',misc.TL_PM100,None,{}),
+           ('TL_TSP01',misc.TL_TSP01,None,{}),
+           ('Katana',misc.Katana,None,{}))
+
+
+def timed(func,repeat):
+    """Seconds per call of func, averaged over repeat calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start)/repeat
+
+
+def _set_value(options):
+    """A value every check of the property accepts"""
+    if options['allowed_values']:
+        return options['allowed_values'][-1]
+    if options['min_value'] is not None and options['max_value'] is not None:
+        return (options['min_value'] + options['max_value'])/2
+    if options['min_value'] is not None:
+        return options['min_value'] + 1
+    if options['max_value'] is not None:
+        return options['max_value'] - 1
+    return 1
+
+
+def bench_instrument(name,cls,trace,options,latency=0.0,repeat=100):
+    """Construction, get/set and trace transfer times of one driver"""
+
+    rm = SimResourceManager()
+    address = 'SIM::{}::INSTR'.format(name)
+    sim = rm.add(address,cls,latency=latency,**options)
+    initial = dict(sim.state)
+    results = {}
+
+    results[name+'/construct_s'] = timed(lambda: cls(rm,address),max(repeat//10,1))
+    instr = cls(rm,address)
+
+    props = [prop for prop,(_,_,prop_options) in sorted(instr._rwCommands.items())
+             if not prop_options['value_type'] == 'string'][:4]
+    if props:
+        results[name+'/get_s'] = timed(lambda: [getattr(instr,prop) for prop in props],repeat)
+        results[name+'/get_many_s'] = timed(lambda: instr.get_many(props,cached=False),repeat)
+
+        values = dict((prop,_set_value(instr._rwCommands[prop][2])) for prop in props)
+        def set_single():
+            for prop in values:
+                setattr(instr,prop,values[prop])
+        results[name+'/set_s'] = timed(set_single,repeat)
+        results[name+'/set_many_s'] = timed(lambda: instr.set_many(values),repeat)
+
+        instr.verify_mode = 'never'
+        results[name+'/set_noverify_s'] = timed(set_single,repeat)
+        instr.verify_mode = 'always'
+
+        instr.enable_cache()
+        instr.get_many(props)
+        results[name+'/get_cached_s'] = timed(lambda: [getattr(instr,prop) for prop in props],repeat)
+        instr.disable_cache()
+
+    if trace is not None:
+        # the sets above may have changed the number of points
+        sim.state.update(initial)
+        instr.invalidate_cache(static=True)
+        nbytes = instr.read_trace_into(trace).nbytes
+        seconds = timed(lambda: getattr(instr,trace),max(repeat//10,1))
+        results[name+'/trace_MBps'] = nbytes/seconds/1e6
+        seconds = timed(lambda: instr.read_trace_into(trace),max(repeat//10,1))
+        results[name+'/trace_into_MBps'] = nbytes/seconds/1e6
+
+    return results
+
+
+def bench_sweep(latency=0.0,steps=20):
+    """Set, sweep, wait and read a trace per step (AQ6370C)"""
+
+    rm = SimResourceManager()
+    rm.add('SIM::sweep::INSTR',osa.AQ6370C,latency=latency,operations={':init':0.005})
+    instr = osa.AQ6370C(rm,'SIM::sweep::INSTR')
+    instr.enable_cache()
+
+    def step():
+        for i in range(steps):
+            instr.centerwl = 1500e-9 + i*1e-9
+            instr.start_sweep()
+            instr.wait_until_ready()
+            instr.get_trace('data')
+    return {'AQ6370C/sweep_step_s':timed(step,1)/steps}
+
+
+def run(latency=0.0,repeat=100,drivers=DRIVERS):
+    """Run all benchmarks; returns a dict metric: value"""
+    results = {}
+    for name, cls, trace, options in drivers:
+        results.update(bench_instrument(name,cls,trace,options,latency,repeat))
+    results.update(bench_sweep(latency))
+    return results
+
+
+def compare(results,baseline,tolerance=0.2):
+    """Metrics of results worse than baseline by more than tolerance
+    (relative); returns a list of (metric, baseline, result)"""
+    worse = []
+    for metric, value in results.items():
+        if not metric in baseline:
+            continue
+        reference = baseline[metric]
+        if metric.endswith('_MBps'):
+            if value < reference*(1 - tolerance):
+                worse.append((metric,reference,value))
+        elif value > reference*(1 + tolerance):
+            worse.append((metric,reference,value))
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark sci_instr drivers on simulated instruments')
+    parser.add_argument('--latency',type=float,default=0.0,help='seconds per simulated I/O operation')
+    parser.add_argument('--repeat',type=int,default=100)
+    parser.add_argument('--save',help='write the results as json')
+    parser.add_argument('--baseline',help='json file of earlier results to compare with')
+    parser.add_argument('--tolerance',type=float,default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.latency,args.repeat)
+    for metric in sorted(results):
+        print('{:40s} {:12.6g}'.format(metric,results[metric]))
+
+    if args.save:
+        with open(args.save,'w') as jsonfile:
+            json.dump(results,jsonfile,indent=1,sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as jsonfile:
+            worse = compare(results,json.load(jsonfile),args.tolerance)
+        for metric, reference, value in worse:
+            print('REGRESSION {}: {:.6g} -> {:.6g}'.format(metric,reference,value))
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
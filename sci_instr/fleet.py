@@ -0,0 +1,345 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+instruments spread over worker processes, each with its own
+ResourceManager, controlled through proxies from one process
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import concurrent.futures
+import copy
+import functools
+import multiprocessing
+import threading
+import numpy as np
+
+from multiprocessing import shared_memory
+from sci_instr.trace import Trace
+
+
+
+# arrays from this size on are passed through shared memory
+SHARED_MIN_BYTES = 4096
+
+
+class _SharedArray():
+    """Reference to an array in a shared memory block of a worker"""
+
+    def __init__(self,name,dtype,shape):
+        self.name = name
+        self.dtype = dtype
+        self.shape = shape
+
+
+
+def _describe(instrument):
+    """Properties (settable or not) and public methods of instrument"""
+
+    props, settable, methods = [], [], []
+    for name in dir(type(instrument)):
+        if name.startswith('_'):
+            continue
+        attribute = getattr(type(instrument),name)
+        if isinstance(attribute,property):
+            props.append(name)
+            if attribute.fset is not None:
+                settable.append(name)
+        elif callable(attribute):
+            methods.append(name)
+    return {'class':type(instrument).__name__,'props':props,'settable':settable,'methods':methods}
+
+
+def _pack(value,key,buffers,counter,released):
+    """Replace large arrays in value (also in tuples, lists and Trace
+    objects) by _SharedArray references to shared memory of the worker;
+    the names of blocks replaced by larger ones are added to released"""
+
+    if isinstance(value,np.ndarray):
+        if value.nbytes < SHARED_MIN_BYTES or value.dtype.hasobject:
+            return value
+        slot = (key,counter[0])
+        counter[0] += 1
+        block = buffers.get(slot)
+        if block is None or block.size < value.nbytes:
+            if block is not None:
+                released.append(block.name)
+                block.close()
+                block.unlink()
+            block = buffers[slot] = shared_memory.SharedMemory(create=True,size=max(value.nbytes,1))
+        np.ndarray(value.shape,dtype=value.dtype,buffer=block.buf)[...] = value
+        return _SharedArray(block.name,value.dtype.str,value.shape)
+    if isinstance(value,(tuple,list)):
+        return type(value)(_pack(item,key,buffers,counter,released) for item in value)
+    if isinstance(value,Trace) and isinstance(value.data,np.ndarray):
+        # the axis is computed again on the other side
+        value = copy.copy(value)
+        value.data = _pack(value.data,key,buffers,counter,released)
+        if value.axis is not None:
+            value._x = None
+        else:
+            value._x = _pack(value._x,key,buffers,counter,released)
+        return value
+    return value
+
+
+def _worker(connection,resource_manager):
+    """Main loop of a worker process: executes the requests (name,
+    operation, arguments) of the fleet on its instruments and answers
+    (ok, result or error, names of released shared memory blocks)"""
+
+    if callable(resource_manager):
+        rm = resource_manager()
+    else:
+        import pyvisa as visa
+        rm = visa.ResourceManager(resource_manager)
+    instruments = {}
+    buffers = {}
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            name, operation, args = request
+            try:
+                if operation == 'add':
+                    cls, address, kwargs = args
+                    instruments[name] = cls(rm,address,**kwargs)
+                    result = _describe(instruments[name])
+                elif operation == 'get':
+                    result = getattr(instruments[name],args)
+                elif operation == 'set':
+                    setattr(instruments[name],args[0],args[1])
+                    result = None
+                elif operation == 'call':
+                    method, call_args, call_kwargs = args
+                    result = getattr(instruments[name],method)(*call_args,**call_kwargs)
+                else:
+                    raise AttributeError('Unknown operation ' + operation)
+                released = []
+                result = _pack(result,name,buffers,[0],released)
+                connection.send((True,result,released))
+            except Exception as error:
+                try:
+                    connection.send((False,error,[]))
+                except Exception:
+                    connection.send((False,AttributeError(repr(error)),[]))
+    finally:
+        for block in buffers.values():
+            block.close()
+            block.unlink()
+        instruments.clear()
+
+
+
+class _WorkerHandle():
+    """Process, pipe and attached shared memory of one worker"""
+
+    def __init__(self,context,resource_manager,number):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_worker,args=(child,resource_manager),
+                                       name='sci_instr fleet {}'.format(number),daemon=True)
+        self.process.start()
+        child.close()
+        self.lock = threading.Lock()
+        self.shared = {}
+        self.names = []
+
+    def request(self,name,operation,args,copy=True):
+        with self.lock:
+            try:
+                self.connection.send((name,operation,args))
+                ok, result, released = self.connection.recv()
+            except (EOFError,OSError):
+                raise AttributeError('Worker process {} stopped'.format(self.process.name))
+            self._release(released)
+            if not ok:
+                raise result
+            return self._unpack(result,copy)
+
+    def _attach(self,name):
+        block = self.shared.get(name)
+        if block is None:
+            # the worker owns the block and unlinks it when it stops
+            block = self.shared[name] = shared_memory.SharedMemory(name=name)
+        return block
+
+    def _release(self,names):
+        """Close the mappings of blocks the worker has replaced (views
+        returned with copy=False keep their memory until dropped)"""
+        for name in names:
+            block = self.shared.pop(name,None)
+            if block is not None:
+                try:
+                    block.close()
+                except BufferError:
+                    pass
+
+    def _unpack(self,value,copy):
+        if isinstance(value,_SharedArray):
+            array = np.ndarray(value.shape,dtype=value.dtype,buffer=self._attach(value.name).buf)
+            return array.copy() if copy else array
+        if isinstance(value,(tuple,list)):
+            return type(value)(self._unpack(item,copy) for item in value)
+        if isinstance(value,Trace) and isinstance(value.data,_SharedArray):
+            value.data = self._unpack(value.data,copy)
+            value._x = self._unpack(value._x,copy)
+        return value
+
+    def close(self):
+        with self.lock:
+            if self.process.is_alive():
+                try:
+                    self.connection.send(None)
+                except (OSError,EOFError):
+                    pass
+                self.process.join(5)
+                if self.process.is_alive():
+                    self.process.terminate()
+            for block in self.shared.values():
+                block.close()
+            self.shared = {}
+            self.connection.close()
+
+
+
+class InstrumentProxy():
+    """Stands for an instrument in a worker process: its properties,
+    traces and methods are used as on the instrument itself
+
+        osa.centerwl = 1550e-9
+        osa.start_sweep()
+        data = osa.data         # copied out of shared memory
+
+    Traces are copied from the shared memory of the worker; with
+    copy=False they are views that are overwritten by the next request
+    to the same worker."""
+
+    def __init__(self,worker,name,description,copy=True):
+        object.__setattr__(self,'_worker',worker)
+        object.__setattr__(self,'_name',name)
+        object.__setattr__(self,'_description',description)
+        object.__setattr__(self,'_copy',copy)
+
+    def __getattr__(self,name):
+        description = self._description
+        if name in description['props']:
+            return self._worker.request(self._name,'get',name,self._copy)
+        if name in description['methods']:
+            return functools.partial(self.call,name)
+        raise AttributeError('{} has no attribute {}'.format(description['class'],name))
+
+    def __setattr__(self,name,value):
+        if not name in self._description['settable']:
+            raise AttributeError('{} has no settable property {}'.format(self._description['class'],name))
+        self._worker.request(self._name,'set',(name,value))
+
+    def call(self,method,*args,**kwargs):
+        """Call method of the instrument in its worker"""
+        return self._worker.request(self._name,'call',(method,args,kwargs),self._copy)
+
+    def __dir__(self):
+        return sorted(set(self._description['props']) | set(self._description['methods']))
+
+    def __repr__(self):
+        return '<InstrumentProxy {} {}>'.format(self._description['class'],self._name)
+
+
+
+class Fleet():
+    """Instruments sharded over worker processes, each owning its own
+    ResourceManager, so setup, VISA I/O and post-processing of different
+    workers run in parallel instead of sharing one interpreter
+
+        with Fleet(workers=4) as fleet:
+            osa = fleet.add('osa','TCPIP::192.168.0.20::INSTR',AQ6370C)
+            laser = fleet.add('laser','ASRL3::INSTR',Katana,worker=1)
+            laser.laser = 1
+            osa.start_sweep()
+            spectra = fleet.gather([lambda: osa.data, lambda: rfsa.data1])
+
+    resource_manager: backend of pyvisa.ResourceManager or a picklable
+    function returning a ResourceManager, called in every worker;
+    start_method: of multiprocessing ('spawn' does not inherit VISA
+    sessions or threads of the control process).
+
+    Requests to one worker are handled one after another; use gather
+    (or own threads) to keep several workers busy at the same time.
+    """
+
+    def __init__(self,workers=2,resource_manager='',start_method='spawn',copy=True):
+        if workers < 1:
+            raise AttributeError('Tried to set workers: {}; allowed only values >= 1'.format(workers))
+        self._context = multiprocessing.get_context(start_method)
+        self._resourceManager = resource_manager
+        self._copy = copy
+        self._workers = [None]*workers
+        self._proxies = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _worker(self,number):
+        with self._lock:
+            if self._workers[number] is None:
+                self._workers[number] = _WorkerHandle(self._context,self._resourceManager,number)
+            return self._workers[number]
+
+    def start(self):
+        """Start all worker processes (otherwise started on first use)"""
+        for number in range(len(self._workers)):
+            self._worker(number)
+
+    def add(self,name,address,cls,worker=None,**kwargs):
+        """Create cls(visa_rm,address,**kwargs) in a worker process
+        (default: the one with the fewest instruments) and return its
+        InstrumentProxy; instruments on one bus should share a worker"""
+
+        if name in self._proxies:
+            raise AttributeError('Instrument {} already exists'.format(name))
+        if worker is None:
+            worker = min(range(len(self._workers)),
+                         key=lambda number: len(self._workers[number].names) if self._workers[number] else 0)
+        handle = self._worker(worker)
+        description = handle.request(name,'add',(cls,address,kwargs))
+        handle.names.append(name)
+        self._proxies[name] = InstrumentProxy(handle,name,description,self._copy)
+        return self._proxies[name]
+
+    def __getitem__(self,name):
+        return self._proxies[name]
+
+    def __contains__(self,name):
+        return name in self._proxies
+
+    @property
+    def instruments(self):
+        return dict(self._proxies)
+
+    def gather(self,calls):
+        """Run the functions in calls concurrently (e.g. lambda: osa.data)
+        and return their results in order"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(2*len(self._workers),4),
+                                                                   thread_name_prefix='sci_instr fleet')
+        futures = [self._executor.submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Stop the workers (closing their instruments)"""
+        for handle in self._workers:
+            if handle is not None:
+                handle.close()
+        self._workers = [None]*len(self._workers)
+        self._proxies = {}
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
@@ -4,11 +4,470 @@
 
 __author__ = 'Tim Hellwig'
 
-import pyvisa as visa 
 import numpy as np
 import os
-import yaml
+import math
+import time
+import contextlib
+import functools
+import hashlib
+import inspect
+import json
+import pickle
+import threading
+from sci_instr.trace import Trace, make_axis, axis_parameters, scaling_parameters
+from sci_instr.iostats import IOStats, TracedResource
 
+VERIFY_MODES = ('always','never','deferred','opc')
+CACHE_MODES = ('volatile','static')
+COMPLETION_STRATEGIES = ('poll','opc','srq')
+TRANSFER_POLICIES = ('fastest','lossless')
+
+# allowed content of the yaml files
+_SECTIONS = ('spec','readOnlyProps','readWriteProps','readBinaryTraces','completion','axis','transfer','sources',
+             'segmented')
+_COMPLETION_OPTIONS = ('strategy','poll_interval','max_interval')
+_RW_OPTIONS = ('command','doc_string','suffix','value_type','allowed_values','min_value','max_value',
+               'value_unit','verify','rel_tol','abs_tol','cache')
+_AXIS_OPTIONS = ('x_start','x_stop','x_step','x_span','x_position','x_reference','x_endpoint','x_points',
+                 'x_unit','y_scale','y_offset','y_position','y_unit')
+_TRACE_OPTIONS = ('command','suffix') + _AXIS_OPTIONS
+_TRANSFER_OPTIONS = ('default','points','encodings')
+_ENCODING_OPTIONS = ('command','datatype','big_endian','header','bits','bytes','y_scale','y_offset')
+_SOURCES_OPTIONS = ('select','trace','names')
+_SEGMENTED_OPTIONS = ('enable','disable','count','length','select','trace','timestamps')
+
+# significant bits and bytes per point of the wire formats ('ascii': text
+# separated by _asciiSeparator; bits and bytes depend on the instrument)
+_DATATYPE_BITS = {'b':8,'B':8,'h':16,'H':16,'i':32,'I':32,'f':24,'d':53,'ascii':53}
+_DATATYPE_BYTES = {'b':1,'B':1,'h':2,'H':2,'i':4,'I':4,'f':4,'d':8,'ascii':16}
+
+# marker for values that are not in the cache (None is a valid value)
+_NOT_CACHED = object()
+
+# parsed yaml files and compiled classes of this process
+_definitions = {}
+_compiled = {}
+_compileLock = threading.RLock()
+
+# folder for pickled definitions, keyed by path and modification time
+_definitionCache = os.environ.get('SCI_INSTR_DEFINITION_CACHE')
+
+
+# one reentrant lock per VISA resource, shared by all objects using it
+_resourceLocks = {}
+_resourceLocksLock = threading.Lock()
+
+
+def resource_key(address):
+    """Canonical name of a VISA address (e.g. 'GPIB::23' ->
+    'GPIB0::23::INSTR'), so all objects of one resource share its lock
+    and worker thread; the address itself if pyvisa does not know it"""
+    try:
+        from pyvisa import rname
+        return rname.to_canonical_name(address)
+    except Exception:
+        return address
+
+
+def resource_lock(name):
+    """Returns the reentrant lock serializing the transactions with the
+    VISA resource name (created on first use)"""
+    with _resourceLocksLock:
+        if not name in _resourceLocks:
+            _resourceLocks[name] = threading.RLock()
+        return _resourceLocks[name]
+
+
+def synchronized(method):
+    """Decorator running method with the resource lock of the instrument
+    held, so its commands and answers are not interleaved with those of
+    other threads"""
+    @functools.wraps(method)
+    def wrapper(self,*args,**kwargs):
+        with self._lock:
+            return method(self,*args,**kwargs)
+    return wrapper
+
+
+def set_definition_cache(folder):
+    """Store parsed yaml definitions as pickle files in folder so new
+    processes do not have to parse and check them again (None: off)"""
+    global _definitionCache
+    if folder is not None:
+        os.makedirs(folder,exist_ok=True)
+    _definitionCache = folder
+
+
+def _definition_cache_file(cfg_path):
+    name = hashlib.sha1(cfg_path.encode('utf-8')).hexdigest()
+    return os.path.join(_definitionCache,name+'.pickle')
+
+
+def load_definition(conffile):
+    """Returns the checked content of a yaml file in the config folder
+    (or an absolute path); every file is parsed once per process"""
+    
+    cfg_path = os.path.abspath(os.path.join(os.path.dirname(__file__), 'config',conffile))
+    with _compileLock:
+        if cfg_path in _definitions:
+            return _definitions[cfg_path]
+        
+        stat = os.stat(cfg_path)
+        key = (cfg_path,stat.st_mtime_ns,stat.st_size)
+        cfg = None
+        if _definitionCache is not None:
+            try:
+                with open(_definition_cache_file(cfg_path),'rb') as cachefile:
+                    cached_key, cached_cfg = pickle.load(cachefile)
+                if cached_key == key:
+                    cfg = cached_cfg
+            except Exception:
+                cfg = None
+        
+        if cfg is None:
+            # imported here: definitions from the pickle cache need no yaml
+            import yaml
+            with open(cfg_path, 'r') as ymlfile:
+                cfg = check_definition(yaml.safe_load(ymlfile),cfg_path)
+            if _definitionCache is not None:
+                tmp_file = _definition_cache_file(cfg_path)+'.{}.tmp'.format(os.getpid())
+                try:
+                    with open(tmp_file,'wb') as cachefile:
+                        pickle.dump((key,cfg),cachefile,pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_file,_definition_cache_file(cfg_path))
+                except OSError:
+                    pass
+        
+        _definitions[cfg_path] = cfg
+        return cfg
+
+
+def check_definition(cfg,name=''):
+    """Check an instrument definition against the known sections and
+    options; returns it with empty sections as empty dicts"""
+    
+    if not isinstance(cfg,dict):
+        raise AttributeError('Definition {} is not a mapping'.format(name))
+    for section in cfg:
+        if not section in _SECTIONS:
+            raise AttributeError('Unknown section {} in {}'.format(section,name))
+    cfg = dict(cfg)
+    for section in ('readOnlyProps','readWriteProps','readBinaryTraces'):
+        cfg[section] = dict(cfg.get(section) or {})
+    
+    for prop, command in cfg['readOnlyProps'].items():
+        if not isinstance(command,str):
+            raise AttributeError('Command of {} in {} is not a string'.format(prop,name))
+    
+    for prop, command in cfg['readWriteProps'].items():
+        if isinstance(command,dict):
+            if not 'command' in command:
+                raise AttributeError('No Command specified for property ' + prop)
+            for option in command:
+                if not option in _RW_OPTIONS:
+                    raise AttributeError('Unknown option {} of {} in {}'.format(option,prop,name))
+            if command.get('verify') is not None and not command['verify'] in VERIFY_MODES:
+                raise AttributeError('Unknown verify mode {} of {} in {}'.format(command['verify'],prop,name))
+            if command.get('cache') is not None and not command['cache'] in CACHE_MODES:
+                raise AttributeError('Unknown cache mode {} of {} in {}'.format(command['cache'],prop,name))
+        elif not isinstance(command,str):
+            raise AttributeError('Command of {} in {} is not a string'.format(prop,name))
+    
+    cfg['completion'] = dict(cfg.get('completion') or {})
+    for option in cfg['completion']:
+        if not option in _COMPLETION_OPTIONS:
+            raise AttributeError('Unknown completion option {} in {}'.format(option,name))
+    if cfg['completion'].get('strategy') is not None and not cfg['completion']['strategy'] in COMPLETION_STRATEGIES:
+        raise AttributeError('Unknown completion strategy {} in {}'.format(cfg['completion']['strategy'],name))
+    
+    cfg['axis'] = dict(cfg.get('axis') or {})
+    for option in cfg['axis']:
+        if not option in _AXIS_OPTIONS:
+            raise AttributeError('Unknown axis option {} in {}'.format(option,name))
+    
+    cfg['transfer'] = check_transfer(cfg.get('transfer') or {},name)
+    cfg['sources'] = check_sources(cfg.get('sources') or {},cfg,name)
+    cfg['segmented'] = check_segmented(cfg.get('segmented') or {},cfg,name)
+    
+    for prop, command in cfg['readBinaryTraces'].items():
+        if isinstance(command,dict):
+            if not 'command' in command:
+                raise AttributeError('No Command specified for trace ' + prop)
+            for option in command:
+                if not option in _TRACE_OPTIONS:
+                    raise AttributeError('Unknown option {} of {} in {}'.format(option,prop,name))
+        elif not isinstance(command,str):
+            raise AttributeError('Command of {} in {} is not a string'.format(prop,name))
+    
+    return cfg
+
+
+def check_transfer(transfer,name=''):
+    """Check the transfer section; returns it with all encoding options
+    filled in (bits and bytes from the datatype if not given)"""
+    
+    for option in transfer:
+        if not option in _TRANSFER_OPTIONS:
+            raise AttributeError('Unknown transfer option {} in {}'.format(option,name))
+    encodings = {}
+    for encoding, options in (transfer.get('encodings') or {}).items():
+        if not isinstance(options,dict) or not 'command' in options or not 'datatype' in options:
+            raise AttributeError('Encoding {} in {} needs command and datatype'.format(encoding,name))
+        for option in options:
+            if not option in _ENCODING_OPTIONS:
+                raise AttributeError('Unknown option {} of encoding {} in {}'.format(option,encoding,name))
+        if not options['datatype'] in _DATATYPE_BITS:
+            raise AttributeError('Unknown datatype {} of encoding {} in {}'.format(options['datatype'],encoding,name))
+        encodings[encoding] = {'command':options['command'],
+                               'datatype':options['datatype'],
+                               'big_endian':bool(options.get('big_endian',False)),
+                               'header':options.get('header','ieee'),
+                               'bits':options.get('bits',_DATATYPE_BITS[options['datatype']]),
+                               'bytes':options.get('bytes',_DATATYPE_BYTES[options['datatype']]),
+                               'y_scale':options.get('y_scale'),
+                               'y_offset':options.get('y_offset')}
+    
+    default = transfer.get('default')
+    if encodings and default is None:
+        default = 'lossless'
+    if default is not None:
+        choose_encoding(encodings,default)
+    return {'default':default,'points':transfer.get('points'),'encodings':encodings}
+
+
+def check_sources(sources,cfg,name=''):
+    """Check the sources section (sources read by one trace command after
+    selecting them with a read write property, e.g. DATA:SOURCE CH1,CH2)"""
+    
+    for option in sources:
+        if not option in _SOURCES_OPTIONS:
+            raise AttributeError('Unknown sources option {} in {}'.format(option,name))
+    if not sources:
+        return {'select':None,'trace':None,'names':{}}
+    if not sources.get('select') in cfg['readWriteProps']:
+        raise AttributeError('Sources in {} need select: a read write property'.format(name))
+    if not sources.get('trace') in cfg['readBinaryTraces']:
+        raise AttributeError('Sources in {} need trace: a binary trace'.format(name))
+    names = dict(sources.get('names') or {})
+    for source in names:
+        if source in cfg['readBinaryTraces']:
+            raise AttributeError('Source {} in {} has the name of a trace'.format(source,name))
+    return {'select':sources['select'],'trace':sources['trace'],'names':names}
+
+
+def check_segmented(segmented,cfg,name=''):
+    """Check the segmented section (segmented memory, e.g. FastFrame);
+    returns it with all options filled in"""
+    
+    for option in segmented:
+        if not option in _SEGMENTED_OPTIONS:
+            raise AttributeError('Unknown segmented option {} in {}'.format(option,name))
+    result = dict((option,segmented.get(option)) for option in _SEGMENTED_OPTIONS)
+    if not segmented:
+        return result
+    if not isinstance(segmented.get('enable'),str):
+        raise AttributeError('Segmented in {} needs enable: a command'.format(name))
+    if not segmented.get('count') in cfg['readWriteProps']:
+        raise AttributeError('Segmented in {} needs count: a read write property'.format(name))
+    if segmented.get('length') is not None and not segmented['length'] in cfg['readWriteProps']:
+        raise AttributeError('Segmented length in {} is no read write property'.format(name))
+    if not segmented.get('trace') in cfg['readBinaryTraces']:
+        raise AttributeError('Segmented in {} needs trace: a binary trace'.format(name))
+    return result
+
+
+def choose_encoding(encodings,policy):
+    """Name of the encoding for policy: the name of an encoding,
+    'fastest' (fewest bytes per point), 'lossless' (most significant bits,
+    then fewest bytes) or a number of bits (fewest bytes with at least
+    these bits)"""
+    
+    if not encodings:
+        raise AttributeError('No transfer encodings defined')
+    if isinstance(policy,str) and policy in encodings:
+        return policy
+    if policy == 'fastest':
+        key = lambda name: (encodings[name]['bytes'],-encodings[name]['bits'])
+    elif policy == 'lossless':
+        key = lambda name: (-encodings[name]['bits'],encodings[name]['bytes'])
+    elif isinstance(policy,int) and not isinstance(policy,bool):
+        candidates = [name for name in encodings if encodings[name]['bits'] >= policy]
+        if not candidates:
+            msg = 'Tried to use: {} bits; encodings have at most {}'.format(policy,max(e['bits'] for e in encodings.values()))
+            raise AttributeError(msg)
+        return min(candidates,key=lambda name: (encodings[name]['bytes'],-encodings[name]['bits']))
+    else:
+        msg = 'Tried to use: {}; allowed only: {}, {} or a number of bits'.format(policy,list(encodings),TRANSFER_POLICIES)
+        raise AttributeError(msg)
+    return min(encodings,key=key)
+
+
+def compile_instrument(cls,conffile=None):
+    """Returns the subclass of cls with the properties defined in
+    conffile (or the _readOnlyProps etc. of cls if None)
+    
+    The yaml file is loaded, command strings are built with the
+    _getString/_setString/_formatString of cls and the properties are
+    attached to the new class. The result is kept, so this happens once
+    per class and configuration."""
+    
+    with _compileLock:
+        if (cls,conffile) in _compiled:
+            return _compiled[(cls,conffile)]
+        
+        if conffile is None:
+            cfg = check_definition({'readOnlyProps':cls._readOnlyProps,
+                                    'readWriteProps':cls._readWriteProps,
+                                    'readBinaryTraces':cls._readBinaryTraces},cls.__name__)
+        else:
+            cfg = load_definition(conffile)
+        
+        namespace = {'__module__':cls.__module__,
+                     '__qualname__':cls.__qualname__,
+                     '__doc__':cls.__doc__,
+                     '_compiledFrom':cls,
+                     '_conffile':conffile,
+                     '_readOnlyProps':cfg['readOnlyProps'],
+                     '_readWriteProps':cfg['readWriteProps'],
+                     '_readBinaryTraces':cfg['readBinaryTraces'],
+                     '_roCommands':{},
+                     '_rwCommands':{},
+                     '_traceCommands':{},
+                     '_traceAxes':{},
+                     '_completion':dict(cls._completion,**cfg['completion']),
+                     '_transfer':cfg['transfer'],
+                     '_sources':cfg['sources'],
+                     '_segmented':cfg['segmented']}
+        
+        for prop in cfg['readOnlyProps']:
+            namespace[prop] = _make_read_only_instr_prop(cls,prop,cfg['readOnlyProps'][prop],namespace['_roCommands'])
+        for prop in cfg['readWriteProps']:
+            namespace[prop] = _make_instr_prop(cls,prop,cfg['readWriteProps'][prop],namespace['_rwCommands'])
+        for prop in cfg['readBinaryTraces']:
+            namespace[prop] = _make_read_binary_instr_data(cls,prop,cfg['readBinaryTraces'][prop],namespace['_traceCommands'])
+            
+            # axis and scaling: axis section, updated by the trace options
+            axis = dict(cfg['axis'])
+            if type(cfg['readBinaryTraces'][prop]) is dict:
+                axis.update((option,value) for option,value in cfg['readBinaryTraces'][prop].items() if option in _AXIS_OPTIONS)
+            namespace['_traceAxes'][prop] = axis
+        
+        compiled = type(cls.__name__,(cls,),namespace)
+        _compiled[(cls,conffile)] = compiled
+        return compiled
+
+
+def _make_instr_prop(cls,prop,definition,commands):
+    """Getter and setter dynamically for read write
+    properties"""
+    
+    options = {}
+    options['doc_string'] = ''
+    options['suffix']  = ''
+    options['value_unit']=''
+    options['min_value'] = None
+    options['max_value'] = None
+    options['allowed_values'] = None
+    options['value_type'] = 'float'
+    options['verify'] = None
+    options['rel_tol'] = None
+    options['abs_tol'] = None
+    options['cache'] = None
+    
+    
+    #Simple format for this property?
+    if not(type(definition) is dict):
+        
+        visa_string_get = definition+cls._getString
+        visa_string_set = definition+cls._setString+cls._formatString
+        
+    # Complex format: definition is a dictionary with additional information
+    else:
+        command = definition['command']
+        
+        #Check if any other known option is present
+        for value in _RW_OPTIONS:
+            if value in definition and not value == 'command':
+                options[value] = definition[value]
+        
+        visa_string_get = command+cls._getString + ' ' + options['suffix']
+        visa_string_set = command+cls._setString + ' ' + options['suffix'] + cls._formatString + options['value_unit']
+    
+    # keep the command strings for batched access (get_many/set_many)
+    commands[prop] = (visa_string_get, visa_string_set, options)
+    
+    @synchronized
+    def getter( self ):
+        value = self._cache_lookup(prop)
+        if value is _NOT_CACHED:
+            value = self._read_prop(prop)
+            self._cache_store(prop,value)
+        return value
+        
+    @synchronized
+    def setter( self,value ):
+        self._check_value(value,options)
+        
+        self._visa.write(visa_string_set.format(value))
+        self._check_response()
+        self._cache_after_set(prop)
+        
+        mode = self._get_verify_mode(prop)
+        if mode == 'always':
+            retvalue = self._read_prop(prop)
+            if not self._values_match(value,retvalue,options):
+                msg = 'Set value: {}; returned value: {}'.format(value,retvalue)
+                raise AttributeError(msg)
+            value = retvalue
+        elif mode == 'deferred':
+            self._pendingVerify[prop] = value
+        elif mode == 'opc':
+            self._visa.query('*OPC?')
+        self._cache_store(prop,value)
+        
+    return property(getter,setter,doc = options['doc_string'])
+
+
+def _make_read_only_instr_prop(cls,prop,definition,commands):
+    """ Getter for read only properties"""
+    
+    visa_string_get = definition+cls._getString
+    commands[prop] = visa_string_get
+    
+    @synchronized
+    def getter( self ):
+        return self._visa.query(visa_string_get)
+    return property(getter)
+
+
+def _make_read_binary_instr_data(cls,prop,definition,commands):
+    """ Getter for binary arrays"""
+    
+    #Sometimes we need a suffix to address the different traces
+    if type(definition) is dict:
+        visa_string_get = definition['command']+cls._getString+' '+definition.get('suffix','')
+    else:
+        visa_string_get = definition+cls._getString
+    commands[prop] = visa_string_get
+    
+    @synchronized
+    def getter( self ):
+        if self._binary_datatype == 'ascii':
+            return self._visa.query_ascii_values(visa_string_get,
+                                                 separator = self._asciiSeparator,
+                                                 container = self._binary_container)
+        if self._binary_header_fmt == 'empty':
+            data_points = self._block_points()
+        else:
+            data_points = self._binary_data_points or self._transfer_points()
+        return self._visa.query_binary_values(visa_string_get,
+                                              datatype = self._binary_datatype,
+                                              is_big_endian = self._binary_big_endian,
+                                              container = self._binary_container,
+                                              data_points = data_points,
+                                              header_fmt = self._binary_header_fmt)
+    return property(getter)
 
 
 class Instrument:
@@ -24,159 +483,164 @@ class Instrument:
     _readWriteProps={'voltage':':VOLT:IMM:AMPL'} 
     _readBinaryTraces={'wavelength':'TRACEX'}
     
-    _visa = None
+    _session = None
     _getString = '?'
     _setString = ' '
     _expctResponse = None
     _formatString = '{}'
     
+    # Can several commands be sent in one message (SCPI: ':CMD1?;:CMD2?')
+    _compoundCommands = True
+    _compoundSeparator = ';'
+    
+    # How a set is verified: 'always' (read back), 'never', 'deferred'
+    # (read back all pending sets with verify_pending) or 'opc' (*OPC?)
+    _verifyMode = 'always'
+    _verifyRelTol = 1e-6
+    _verifyAbsTol = 0.0
+    
+    # Optional cache of read write properties (see enable_cache). Settings
+    # are often coupled (span and start/stop wavelength, data source and
+    # waveform scaling), so a set drops all other non static cache entries
+    _cacheTTL = None
+    _cacheInvalidateOnSet = True
+    
     
-    def __init__(self,visa_rm,address,conffile=None):
-        """Connects to the Instrument and prepares properties"""
+    # How wait_until_ready waits, updated by the completion section of the
+    # yaml file: 'poll' (is_ready with growing interval), 'opc' (blocking
+    # *OPC? query) or 'srq' (service request raised by *OPC)
+    _completion = {'strategy':'poll','poll_interval':0.001,'max_interval':0.5}
+    
+    # Wire formats of the traces, from the transfer section of the yaml
+    # file: {'default': policy, 'points': property or number of points of
+    # blocks without header, 'encodings': {name: options}}
+    _transfer = {'default':None,'points':None,'encodings':{}}
+    _transferPolicy = None
+    _asciiSeparator = ','
+    
+    # Sources read together by one trace command, from the sources section
+    # of the yaml file: {'select': property selecting them, 'trace': trace
+    # read, 'names': {name: source}}
+    _sources = {'select':None,'trace':None,'names':{}}
+    
+    # Segmented memory (FastFrame, ultra segmentation) from the segmented
+    # section of the yaml file: commands, count and length properties and
+    # the trace returning all segments in one block
+    _segmented = dict((option,None) for option in _SEGMENTED_OPTIONS)
+    
+    # yaml file (relative to the config folder) the properties are read from
+    _conffile = None
+    
+    # lock of the VISA resource (see resource_lock and transaction)
+    _lock = None
+    
+    # IOStats of enable_io_stats, recorded again after a reconnect
+    _ioStats = None
+    
+    # query answered by the instrument in any state, for ping
+    _pingCommand = '*IDN?'
+    
+    
+    def __new__(cls,*args,**kwargs):
+        """Instances are created from the subclass of cls compiled for its
+        yaml file (see compile_instrument), so the properties are built
+        only once per class and configuration"""
         
+        if '_compiledFrom' in cls.__dict__:
+            return object.__new__(cls)
         
-        if conffile is not None:
-            cfg_path = os.path.join(os.path.dirname(__file__), 'config',conffile)
-            with open(cfg_path, 'r') as ymlfile:
-                cfg = yaml.load(ymlfile)
-            
-            self._readOnlyProps=cfg['readOnlyProps']
-            self._readWriteProps=cfg['readWriteProps']
-            self._readBinaryTraces=cfg['readBinaryTraces']        
+        try:
+            arguments = inspect.signature(cls.__init__).bind(None,*args,**kwargs).arguments
+        except TypeError:
+            arguments = {}
+        conffile = arguments.get('conffile') or cls._conffile
+        return object.__new__(compile_instrument(cls,conffile))
+    
+    def __init__(self,visa_rm,address,conffile=None,lazy=False):
+        """Connects to the Instrument and runs _setup; the properties of
+        conffile (or _conffile of the class) were already created by
+        __new__. With lazy the session is opened and set up on the first
+        I/O instead.
+        
+        __new__ only sees conffile as argument of the class instantiated;
+        a subclass passing it to super().__init__ gets an AttributeError
+        and sets _conffile instead."""
         
-        _rm = visa_rm
-        self._visa = _rm.open_resource(address)
+        if conffile is not None and not conffile == self._conffile:
+            msg = ('{} was built from {} instead of conffile {}; set _conffile = {!r} in the class'
+                   .format(type(self).__name__,self._conffile,conffile,conffile))
+            raise AttributeError(msg)
+        self._rm = visa_rm
+        self._address = address
+        self._resourceKey = resource_key(address)
+        self._lock = resource_lock(self._resourceKey)
         self._binary_datatype = 'f'
         self._binary_big_endian = False
         self._binary_container = np.array
         self._binary_data_points = 0
         self._binary_header_fmt = 'ieee'
-        
-
-        def make_instr_prop(prop):
-            """Getter and setter dynamically for read write
-            properties"""
-            
-            options = {}
-            options['doc_string'] = ''
-            options['suffix']  = ''
-            options['value_unit']=''
-            options['min_value'] = None
-            options['max_value'] = None
-            options['allowed_values'] = None
-            options['value_type'] = 'float'
-            
-            
-            #Simple format for this property?
-            if not(type(self._readWriteProps[prop]) is dict):
-                
-                visa_string_get = self._readWriteProps[prop]+self._getString
-                visa_string_set = self._readWriteProps[prop]+self._setString+self._formatString
-                
-                def getter( self ):
-                    return self._process_read_values(self._visa.query(visa_string_get),options['value_type'])
-                def setter( self,value ):
-                    self._visa.write(visa_string_set.format(value))
-                    if self._expctResponse is not None:
-                        response = self._visa.read()
-                        if not response == self._expctResponse:
-                            msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
-                            raise AttributeError(msg)
-                
-                    retvalue = self.__getattribute__(prop)
-                    if not value == retvalue:
-                        msg = 'Set value: {}; returned value: {}'.format(value,retvalue)
-                        raise AttributeError(msg)
-                
-            # Complex format readWriteProps[prop] is a dictionary with additional information
-            else:
-                prop_dict = self._readWriteProps[prop]
-                
-                # First check for command as this is needed
-                if 'command' in prop_dict:
-                    command = prop_dict['command']
-                else:
-                    raise AttributeError('No Command specified for property ' + prop)
-                
-                #Check if any other known option is present
-                for value in (('doc_string','suffix','value_type','allowed_values','min_value','max_value','value_unit')):
-                    if  value in prop_dict:
-                     options[value] = prop_dict[value]
-                
-                visa_string_get = command+self._getString + ' ' + options['suffix']
-                visa_string_set = command+self._setString + ' ' + options['suffix'] + self._formatString + options['value_unit']
-                
-                def getter( self ):
-                    return self._process_read_values(self._visa.query(visa_string_get),options['value_type'])
-                    
-                def setter( self,value ):
-                    #first check if value is within allowed values
-                    if not(options['allowed_values'] is None):
-                        if not(value in options['allowed_values']):
-                            msg = 'Tried to set: {}; allowed only: {}'.format(value,options['allowed_values'])
-                            raise AttributeError(msg)
-                    
-                    #check if value is within min/max
-                    if not(options['min_value'] is None):
-                        if value <= options['min_value']:
-                            msg = 'Tried to set: {}; allowed only values >= {}'.format(value,options['min_value'])
-                            raise AttributeError(msg)
-                    if not(options['max_value'] is None):
-                        if value >= options['max_value']:
-                            msg = 'Tried to set: {}; allowed only values <= {}'.format(value,options['max_value'])
-                            raise AttributeError(msg)
-                    
-                    self._visa.write(visa_string_set.format(value))
-                    if self._expctResponse is not None:
-                        response = self._visa.read()
-                        if not response == self._expctResponse:
-                            msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
-                            raise AttributeError(msg)
-                
-                    retvalue = self.__getattribute__(prop)
-                    if not value == retvalue:
-                        msg = 'Set value: {}; returned value: {}'.format(value,retvalue)
-                        raise AttributeError(msg)
-                
-                
-            return property(getter,setter,doc = options['doc_string'])
-            
-        def make_read_only_instr_prop(prop):
-            """ Getter for read only properties"""
-            
-            def getter( self ):
-                return self._visa.query(self._readOnlyProps[prop]+self._getString)
-            return property(getter)
-            
-        def make_read_binary_instr_data(prop):
-            """ Getter for binary arrays"""
-            
-            #Sometimes we need a suffix to address the different traces
-            if type(self._readBinaryTraces[prop]) is dict:
-                def getter( self ):
-                    return self._visa.query_binary_values(self._readBinaryTraces[prop]['command']+self._getString+' '+self._readBinaryTraces[prop]['suffix'],
-                                                          datatype = self._binary_datatype,
-                                                          is_big_endian = self._binary_big_endian,
-                                                          container = self._binary_container,
-                                                          data_points = self._binary_data_points,
-                                                          header_fmt = self._binary_header_fmt)
-            else:
-                def getter( self ):
-                    return self._visa.query_binary_values(self._readBinaryTraces[prop]+self._getString,
-                                                          datatype = self._binary_datatype,
-                                                          is_big_endian = self._binary_big_endian,
-                                                          container = self._binary_container,
-                                                          data_points = self._binary_data_points,
-                                                          header_fmt = self._binary_header_fmt)
-            return property(getter)
-            
-        # add all the properties
-        for i in self._readOnlyProps or {}:
-            setattr(self.__class__, i, make_read_only_instr_prop(i))
-        for i in self._readWriteProps or {}:
-            setattr(self.__class__, i, make_instr_prop(i))
-        for i in self._readBinaryTraces or {}:
-            setattr(self.__class__, i, make_read_binary_instr_data(i))
+        self._binary_expect_termination = True
+        self._transferFormat = None
+        self._transferScale = {}
+        self._pendingVerify = {}
+        self._cache = None
+        self._scaledBuffers = {}
+        if not lazy:
+            self.connect()
+    
+    @property
+    def _visa(self):
+        """The VISA resource; opened (and set up) on first use"""
+        if self._session is None:
+            self.connect()
+        return self._session
+    
+    @_visa.setter
+    def _visa(self,resource):
+        self._session = resource
+    
+    @property
+    def connected(self):
+        return self._session is not None
+    
+    @synchronized
+    def connect(self):
+        """Open the session and run _setup, unless already connected"""
+        if self._session is None:
+            self._session = self._rm.open_resource(self._address)
+            try:
+                self._setup()
+            except Exception:
+                self.disconnect()
+                raise
+            if self._ioStats is not None:
+                self._session = TracedResource(self._session,self._ioStats)
+    
+    @synchronized
+    def disconnect(self):
+        """Close the session; the next I/O opens and sets up a new one"""
+        session, self._session = self._session, None
+        if session is not None:
+            try:
+                session.close()
+            except Exception:
+                pass
+    
+    def _setup(self):
+        """Prepare the instrument after the session is opened (formats,
+        modes); drivers override it and send their setup commands with
+        _write_setup"""
+        pass
+    
+    def _write_setup(self,commands):
+        """Send setup commands as one compound message (one at a time
+        for instruments without compound commands)"""
+        commands = [command for command in commands if command]
+        if self._compoundCommands:
+            self._visa.write(self._join_commands(commands))
+        else:
+            for command in commands:
+                self._visa.write(command)
 
     def _process_read_values(self,string,value_type):
         """Usually we expect returning a float; inhereted classes can specify"""
@@ -187,17 +651,933 @@ class Instrument:
         else:
             return string
 
+    def _check_value(self,value,options):
+        """Raise an AttributeError if value violates allowed_values or
+        min/max of a property"""
+        
+        #first check if value is within allowed values
+        if not(options['allowed_values'] is None):
+            if not(value in options['allowed_values']):
+                msg = 'Tried to set: {}; allowed only: {}'.format(value,options['allowed_values'])
+                raise AttributeError(msg)
+        
+        #check if value is within min/max
+        if not(options['min_value'] is None):
+            if value <= options['min_value']:
+                msg = 'Tried to set: {}; allowed only values >= {}'.format(value,options['min_value'])
+                raise AttributeError(msg)
+        if not(options['max_value'] is None):
+            if value >= options['max_value']:
+                msg = 'Tried to set: {}; allowed only values <= {}'.format(value,options['max_value'])
+                raise AttributeError(msg)
+    
+    def _check_response(self):
+        """Read the acknowledge of instruments answering every set command"""
+        if self._expctResponse is not None:
+            response = self._visa.read()
+            if not response == self._expctResponse:
+                msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
+                raise AttributeError(msg)
+    
+    @property
+    def verify_mode(self):
+        """Default verification of set commands: 'always', 'never',
+        'deferred' or 'opc'; properties may override it in the yaml file
+        with the option verify"""
+        return self._verifyMode
+    
+    @verify_mode.setter
+    def verify_mode(self,mode):
+        if not mode in VERIFY_MODES:
+            msg = 'Tried to set: {}; allowed only: {}'.format(mode,VERIFY_MODES)
+            raise AttributeError(msg)
+        self._verifyMode = mode
+    
+    def _get_verify_mode(self,prop):
+        """Verification mode of a read write property"""
+        mode = self._rwCommands[prop][2]['verify']
+        if mode is None:
+            mode = self._verifyMode
+        if not mode in VERIFY_MODES:
+            msg = 'Unknown verify mode {} for property {}'.format(mode,prop)
+            raise AttributeError(msg)
+        return mode
+    
+    def _values_match(self,value,retvalue,options):
+        """Compare set and returned value, numbers within rel_tol/abs_tol
+        as the instruments round to their resolution"""
+        if isinstance(value,(int,float)) and isinstance(retvalue,(int,float)):
+            rel_tol = options['rel_tol'] if options['rel_tol'] is not None else self._verifyRelTol
+            abs_tol = options['abs_tol'] if options['abs_tol'] is not None else self._verifyAbsTol
+            return math.isclose(value,retvalue,rel_tol=rel_tol,abs_tol=abs_tol)
+        return value == retvalue
+    
+    @synchronized
+    def verify_pending(self):
+        """Read back all sets done in 'deferred' verify mode with a
+        single get_many and raise an AttributeError on mismatch"""
+        
+        pending = self._pendingVerify
+        self._pendingVerify = {}
+        if not pending:
+            return
+        
+        retvalues = self.get_many(pending,cached=False)
+        errors = ['{}: set {}; returned {}'.format(prop,pending[prop],retvalues[prop])
+                  for prop in pending
+                  if not self._values_match(pending[prop],retvalues[prop],self._rwCommands[prop][2])]
+        if errors:
+            raise AttributeError('; '.join(errors))
+    
+    def _get_command(self,prop):
+        """Returns query string and value type of a read write or read
+        only property"""
+        if prop in self._rwCommands:
+            return self._rwCommands[prop][0], self._rwCommands[prop][2]['value_type']
+        elif prop in self._roCommands:
+            return self._roCommands[prop], None
+        else:
+            raise AttributeError('Unknown property ' + prop)
+    
+    def _join_commands(self,commands):
+        """Join commands to one compound message"""
+        sep = self._compoundSeparator
+        return sep.join(command.strip().rstrip(sep) for command in commands)
+    
+    def _read_prop(self,prop):
+        """Query a property from the instrument, bypassing the cache"""
+        command, value_type = self._get_command(prop)
+        if value_type is None:
+            return self._visa.query(command)
+        return self._process_read_values(self._visa.query(command),value_type)
+    
+    @synchronized
+    def get_many(self,props,cached=True):
+        """Read several properties with a single query
+        
+        The query strings of the yaml tables are joined to one compound
+        message and the answer is split and converted with
+        _process_read_values. Instruments without compound commands are
+        queried one command at a time. Properties with the same query
+        string share one query. Values in the cache are not queried
+        unless cached is False. Returns a dict prop: value"""
+        
+        props = list(dict.fromkeys(props))
+        commands = dict((prop,self._get_command(prop)) for prop in props)
+        
+        values = {}
+        if cached:
+            for prop in props:
+                value = self._cache_lookup(prop)
+                if not value is _NOT_CACHED:
+                    values[prop] = value
+        missing = [prop for prop in props if not prop in values]
+        
+        queries = list(dict.fromkeys(commands[prop][0] for prop in missing))
+        if not self._compoundCommands and len(queries) > 1 and hasattr(self._visa,'query_many'):
+            # pipelined link (e.g. serial_link.SerialLink)
+            answers = dict(zip(queries,self._visa.query_many(queries)))
+        elif not self._compoundCommands or len(queries) < 2:
+            answers = dict((query,self._visa.query(query)) for query in queries)
+        else:
+            answer = self._visa.query(self._join_commands(queries))
+            replies = answer.strip().split(self._compoundSeparator)
+            if not len(replies) == len(queries):
+                msg = 'Expected {} values, got: {}'.format(len(queries),answer)
+                raise AttributeError(msg)
+            answers = dict(zip(queries,(reply.strip() for reply in replies)))
+        
+        for prop in missing:
+            query, value_type = commands[prop]
+            if value_type is None:
+                values[prop] = answers[query]
+            else:
+                values[prop] = self._process_read_values(answers[query],value_type)
+        
+        for prop in missing:
+            self._cache_store(prop,values[prop])
+        return dict((prop,values[prop]) for prop in props)
+    
+    @synchronized
+    def set_many(self,values):
+        """Set several read write properties with a single message
+        
+        values is a dict prop: value. All values are checked first, then
+        the set commands are sent as one compound message. Properties in
+        verify mode 'always' are read back with one get_many, 'deferred'
+        ones are added to the pending verifications and 'opc' causes a
+        single *OPC? query. Instruments without compound commands or with
+        an acknowledge per set command get all set commands with one write
+        if their resource is a pipelined link (write_many), otherwise they
+        are set one property at a time."""
+        
+        for prop in values:
+            if not prop in self._rwCommands:
+                raise AttributeError('Unknown property ' + prop)
+            self._check_value(values[prop],self._rwCommands[prop][2])
+        
+        commands = [self._rwCommands[prop][1].format(values[prop]) for prop in values]
+        if len(values) > 1 and self._compoundCommands and self._expctResponse is None:
+            self._visa.write(self._join_commands(commands))
+        elif len(values) > 1 and hasattr(self._visa,'write_many'):
+            responses = self._visa.write_many(commands,replies=0 if self._expctResponse is None else 1)
+            for response in responses:
+                if not response == self._expctResponse:
+                    msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
+                    raise AttributeError(msg)
+        else:
+            for prop in values:
+                setattr(self,prop,values[prop])
+            return
+        
+        for prop in values:
+            self._cache_after_set(prop)
+        
+        modes = {prop: self._get_verify_mode(prop) for prop in values}
+        for prop in values:
+            if modes[prop] == 'deferred':
+                self._pendingVerify[prop] = values[prop]
+        if 'opc' in modes.values():
+            self._visa.query('*OPC?')
+        
+        check = [prop for prop in values if modes[prop] == 'always']
+        retvalues = self.get_many(check,cached=False) if check else {}
+        errors = ['{}: set {}; returned {}'.format(prop,values[prop],retvalues[prop])
+                  for prop in check
+                  if not self._values_match(values[prop],retvalues[prop],self._rwCommands[prop][2])]
+        if errors:
+            raise AttributeError('; '.join(errors))
+        
+        for prop in values:
+            if not prop in retvalues:
+                self._cache_store(prop,values[prop])
+    
+    def _snapshot_props(self):
+        """Read write properties that are settings: not cache: volatile
+        and read with a pure query; queries with a set command in front
+        (':ACQuire:POINts:AUTO RECLength;:ACQuire:POINts?') would change
+        the instrument while it is read"""
+        return [prop for prop in self._rwCommands
+                if not self._rwCommands[prop][2]['cache'] == 'volatile' and
+                all('?' in part for part in self._rwCommands[prop][0].split(self._compoundSeparator) if part.strip())]
+    
+    @synchronized
+    def snapshot(self,path=None,props=None,cached=False):
+        """Read the settings (see _snapshot_props, or props) with one
+        get_many and return them as dict
+        prop: value in the order of the yaml file; with path the dict is
+        also written there as json, for apply in a later job"""
+        
+        values = self.get_many(self._snapshot_props() if props is None else props,cached=cached)
+        if path is not None:
+            with open(path,'w') as snapshotfile:
+                json.dump(values,snapshotfile,indent=1)
+        return values
+    
+    @synchronized
+    def apply(self,snapshot,cached=True):
+        """Restore a snapshot (dict or json file of snapshot): the
+        current values are read with one get_many (served from the cache
+        if enabled and cached) and only the settings that differ (within
+        the verify tolerances) are sent with one set_many. Returns the
+        dict of changed settings."""
+        
+        if isinstance(snapshot,str):
+            with open(snapshot) as snapshotfile:
+                snapshot = json.load(snapshotfile)
+        for prop in snapshot:
+            if not prop in self._rwCommands:
+                raise AttributeError('Unknown property ' + prop)
+        
+        current = self.get_many(list(snapshot),cached=cached)
+        changes = dict((prop,value) for prop,value in snapshot.items()
+                       if not self._values_match(value,current[prop],self._rwCommands[prop][2]))
+        if changes:
+            self.set_many(changes)
+        return changes
+    
+    @synchronized
+    def read_trace_into(self,trace,out=None,scale=None,offset=None):
+        """Read a binary trace without intermediate containers
+        
+        The data block and its termination are read with one read_bytes
+        and viewed with np.frombuffer in the wire dtype (_binary_datatype
+        and byte order), or copied once into out. With scale and/or offset
+        the returned values are data*scale + offset, computed into out
+        (which then has to be a float array) or into a reused float array.
+        
+        Without out and scaling the returned array is a read-only view of
+        the received block; with scaling it is overwritten by the next read
+        of the same trace. Traces in an ascii encoding (see
+        set_transfer_format) are parsed by query_ascii_values, as by the
+        plain getter."""
+        
+        if not trace in self._traceCommands:
+            raise AttributeError('Unknown trace ' + trace)
+        scaled = scale is not None or offset is not None
+        if scaled and out is not None and not out.dtype.kind == 'f':
+            msg = 'Tried to scale trace {} into out of dtype {}; allowed only float arrays'.format(trace,out.dtype)
+            raise AttributeError(msg)
+        if self._binary_datatype == 'ascii':
+            data = self._visa.query_ascii_values(self._traceCommands[trace],
+                                                 separator=self._asciiSeparator,
+                                                 container=np.array)
+            points = len(data)
+            if out is not None and len(out) < points:
+                msg = 'Trace {} has {} points; out has only {}'.format(trace,points,len(out))
+                raise AttributeError(msg)
+        else:
+            dtype = np.dtype(self._binary_datatype).newbyteorder('>' if self._binary_big_endian else '<')
+        
+            # blocks without header: the number of points is read first
+            points = self._block_points() if self._binary_header_fmt == 'empty' else 0
+            
+            self._visa.write(self._traceCommands[trace])
+            nbytes = self._read_block_header(dtype,points)
+            if nbytes is None:
+                # ieee block of indefinite length (#0): read up to the termination
+                block = self._visa.read_raw()
+                termination = (self._visa.read_termination or '').encode()
+                if termination and block.endswith(termination):
+                    block = block[:-len(termination)]
+                nbytes = len(block) - len(block) % dtype.itemsize
+            else:
+                block = self._read_block(nbytes)
+            points = nbytes // dtype.itemsize
+            data = np.frombuffer(block,dtype=dtype,count=points)
+            if out is not None and len(out) < points:
+                msg = 'Trace {} has {} points; out has only {}'.format(trace,points,len(out))
+                raise AttributeError(msg)
+        
+        if not scaled:
+            if out is None:
+                return data
+            np.copyto(out[:points],data,casting='unsafe')
+            return out[:points]
+        
+        if out is not None:
+            result = out[:points]
+        elif data.dtype.kind == 'f' and data.dtype.isnative and data.flags.writeable:
+            result = data
+        else:
+            buffer = self._scaledBuffers.get(trace)
+            if buffer is None or len(buffer) < points:
+                buffer = self._scaledBuffers[trace] = np.empty(points)
+            result = buffer[:points]
+        np.multiply(data,1.0 if scale is None else scale,out=result)
+        if offset:
+            np.add(result,offset,out=result,casting='unsafe')
+        return result
+    
+    def _axis_settings(self,trace,extra=()):
+        """Axis and scaling options of trace with all names of properties
+        replaced by their values (read with one get_many, together with
+        the properties extra, which are added by name)"""
+        
+        if not trace in self._traceAxes:
+            raise AttributeError('Unknown trace ' + trace)
+        options = self._traceAxes[trace]
+        props = [value for value in options.values()
+                 if isinstance(value,str) and (value in self._rwCommands or value in self._roCommands)]
+        props += list(extra)
+        values = self.get_many(props) if props else {}
+        settings = dict((option,values[value] if isinstance(value,str) and value in values else value)
+                        for option,value in options.items())
+        settings.update((prop,values[prop]) for prop in extra)
+        # fixed scaling of the wire format (e.g. integers in 0.01 dBm)
+        settings.update(self._transferScale)
+        return settings
+    
+    def trace_axis(self,trace,points=None):
+        """x axis of trace from the axis options in the yaml file; points
+        defaults to the x_points option"""
+        
+        settings = self._axis_settings(trace)
+        if points is None:
+            points = settings.get('x_points')
+        axis = axis_parameters(settings,points)
+        if axis is None:
+            raise AttributeError('No axis defined for trace ' + trace)
+        return make_axis(*axis)
+    
+    @synchronized
+    def get_trace(self,trace,out=None):
+        """Read trace and return it as Trace with scaled data, x axis and
+        units as defined by the axis options of the yaml file
+        
+        The axis and scaling settings are read with one get_many (from
+        the cache if enabled), the data with read_trace_into."""
+        
+        settings = self._axis_settings(trace)
+        scale, offset = self._trace_scaling(settings)
+        
+        data = self.read_trace_into(trace,out=out,scale=scale,offset=offset)
+        if out is None:
+            data = data.copy()
+        
+        return Trace(data,
+                     axis=axis_parameters(settings,data.shape[-1]),
+                     x_unit=str(settings.get('x_unit','')).strip('"'),
+                     y_unit=str(settings.get('y_unit','')).strip('"'),
+                     metadata=settings)
+    
+    @staticmethod
+    def _trace_scaling(settings):
+        """scale and offset of the data from the axis settings"""
+        return scaling_parameters(settings)
+    
+    @synchronized
+    def fetch_traces(self,traces):
+        """Read several traces (names of traces, or of sources of the
+        sources section) and return them as one Trace with 2-D data, one
+        row per trace, and the x axis and units of the first
+        
+        The axis and scaling settings of all traces are read first with
+        one message (sources: selecting each source in turn), then the
+        data is transferred without queries in between: sources with one
+        trace command after selecting all of them (e.g. DATA:SOURCE
+        CH1,CH2;CURVE?), traces with binary ieee blocks with one compound
+        message, other traces one after another. metadata holds the names
+        and the settings of every row."""
+        
+        traces = list(traces)
+        if not traces:
+            raise AttributeError('No traces to fetch')
+        names = self._sources['names']
+        if all(trace in names for trace in traces):
+            settings, raw = self._fetch_sources(traces)
+        elif all(trace in self._traceCommands for trace in traces):
+            settings, raw = self._fetch_traces(traces)
+        else:
+            unknown = [trace for trace in traces if not trace in self._traceCommands and not trace in names]
+            if unknown:
+                raise AttributeError('Unknown traces ' + ', '.join(unknown))
+            raise AttributeError('Traces and sources cannot be fetched together')
+        
+        scaling = [self._trace_scaling(row) for row in settings]
+        if all(scale is None and not offset for scale,offset in scaling):
+            data = raw
+        else:
+            data = np.empty(raw.shape)
+            for row, (scale, offset) in enumerate(scaling):
+                np.multiply(raw[row],1.0 if scale is None else scale,out=data[row],casting='unsafe')
+                if offset:
+                    data[row] += offset
+        
+        first = settings[0]
+        return Trace(data,
+                     axis=axis_parameters(first,data.shape[-1]),
+                     x_unit=str(first.get('x_unit','')).strip('"'),
+                     y_unit=str(first.get('y_unit','')).strip('"'),
+                     metadata={'traces':traces,'settings':settings})
+    
+    def _fetch_traces(self,traces):
+        """Settings and raw 2-D data of traces"""
+        
+        props = [value for trace in traces for value in self._traceAxes[trace].values()
+                 if isinstance(value,str) and (value in self._rwCommands or value in self._roCommands)]
+        values = self.get_many(props) if props else {}
+        settings = []
+        for trace in traces:
+            options = self._traceAxes[trace]
+            row = dict((option,values[value] if isinstance(value,str) and value in values else value)
+                       for option,value in options.items())
+            row.update(self._transferScale)
+            settings.append(row)
+        
+        if self._compoundCommands and self._binary_header_fmt == 'ieee' and not self._binary_datatype == 'ascii':
+            self._visa.write(self._join_commands([self._traceCommands[trace] for trace in traces]))
+            return settings, self._read_blocks(len(traces))
+        
+        rows = [np.array(self.read_trace_into(trace)) for trace in traces]
+        if not len(set(len(row) for row in rows)) == 1:
+            raise AttributeError('Traces have different lengths: {}'.format([len(row) for row in rows]))
+        return settings, np.stack(rows)
+    
+    def _fetch_sources(self,traces):
+        """Settings and raw 2-D data of sources of the sources section"""
+        
+        select, trace = self._sources['select'], self._sources['trace']
+        sources = [self._sources['names'][name] for name in traces]
+        options = self._traceAxes[trace]
+        props = [value for value in options.values()
+                 if isinstance(value,str) and (value in self._rwCommands or value in self._roCommands)]
+        props = list(dict.fromkeys(props))
+        set_select = self._rwCommands[select][1]
+        
+        if not self._compoundCommands or self._expctResponse is not None or self._binary_header_fmt == 'empty' or self._binary_datatype == 'ascii':
+            previous = getattr(self,select)
+            settings, rows = [], []
+            for source in sources:
+                setattr(self,select,source)
+                settings.append(self._axis_settings(trace))
+                rows.append(np.array(self.read_trace_into(trace)))
+            setattr(self,select,previous)
+            return settings, np.stack(rows)
+        
+        # the current selection, then select every source and query its
+        # settings, all in one message
+        parts = [self._get_command(select)[0]]
+        for source in sources:
+            parts.append(set_select.format(source))
+            parts.extend(self._get_command(prop)[0] for prop in props)
+        answer = self._visa.query(self._join_commands(parts))
+        replies = [reply.strip() for reply in answer.strip().split(self._compoundSeparator)]
+        if not len(replies) == 1 + len(props)*len(sources):
+            msg = 'Expected {} values, got: {}'.format(1 + len(props)*len(sources),answer)
+            raise AttributeError(msg)
+        previous = replies.pop(0)
+        settings = []
+        for number in range(len(sources)):
+            values = {}
+            for index, prop in enumerate(props):
+                reply = replies[number*len(props) + index]
+                value_type = self._get_command(prop)[1]
+                values[prop] = reply if value_type is None else self._process_read_values(reply,value_type)
+            row = dict((option,values[value] if isinstance(value,str) and value in values else value)
+                       for option,value in options.items())
+            row.update(self._transferScale)
+            settings.append(row)
+        
+        # all sources with one trace command; the previous selection is
+        # restored, otherwise the next single trace read gets all blocks
+        self._visa.write(self._join_commands([set_select.format(','.join(sources)),
+                                              self._traceCommands[trace],
+                                              set_select.format(previous)]))
+        self._cache_after_set(select)
+        return settings, self._read_blocks(len(sources))
+    
+    def _read_blocks(self,count):
+        """Read count binary ieee blocks of equal length (one after the
+        other in the answer) into a 2-D array"""
+        
+        dtype = np.dtype(self._binary_datatype).newbyteorder('>' if self._binary_big_endian else '<')
+        buffer = None
+        lengths = []
+        for row in range(count):
+            nbytes = self._read_block_header(dtype)
+            if nbytes is None:
+                raise AttributeError('Block {} of {} has no length'.format(row+1,count))
+            lengths.append(nbytes)
+            if buffer is None:
+                buffer = bytearray(count*nbytes)
+            if nbytes == lengths[0]:
+                self._read_block_into(memoryview(buffer)[row*nbytes:(row+1)*nbytes])
+            else:
+                # read on to keep the session in sync, then complain
+                self._read_block_into(memoryview(bytearray(nbytes)))
+        self._read_block_end()
+        if not len(set(lengths)) == 1:
+            raise AttributeError('Traces have different lengths: {} bytes'.format(lengths))
+        return np.frombuffer(buffer,dtype=dtype).reshape(count,lengths[0]//dtype.itemsize)
+    
+    @synchronized
+    def configure_segments(self,count,length=None):
+        """Switch on the segmented memory (segmented section of the yaml
+        file) and set the number of segments and the samples per segment"""
+        
+        segmented = self._segmented
+        if segmented['enable'] is None:
+            raise AttributeError('No segmented acquisition defined for ' + type(self).__name__)
+        values = {segmented['count']:count}
+        if length is not None:
+            if segmented['length'] is None:
+                raise AttributeError('No segment length defined for ' + type(self).__name__)
+            values[segmented['length']] = length
+        self._visa.write(segmented['enable'])
+        self.invalidate_cache()
+        self.set_many(values)
+    
+    @synchronized
+    def disable_segments(self):
+        if self._segmented['disable'] is not None:
+            self._visa.write(self._segmented['disable'])
+            self.invalidate_cache()
+    
+    @synchronized
+    def fetch_segments(self,trace=None,out=None):
+        """Read all segments of a segmented acquisition with one transfer
+        and return them as Trace with data of shape (segments, samples),
+        a reshaped view of the transferred buffer (of out if given: C
+        contiguous with segments*samples elements) and the time stamps of
+        the segments in s in metadata['timestamps'] (None if the yaml file
+        has no timestamps query)
+        
+        The segment count and the axis settings are read with one
+        get_many; the select command of the segmented section (with
+        {count}, {first} = 1 - count, for instruments numbering the
+        latest segment 0, and {length}, the samples per segment) is sent
+        before the trace is read."""
+        
+        segmented = self._segmented
+        if segmented['enable'] is None:
+            raise AttributeError('No segmented acquisition defined for ' + type(self).__name__)
+        trace = trace or segmented['trace']
+        extra = [segmented['count']] + ([segmented['length']] if segmented['length'] else [])
+        settings = self._axis_settings(trace,extra)
+        count = int(settings[segmented['count']])
+        if segmented['select']:
+            length = int(settings[segmented['length']]) if segmented['length'] else None
+            self._visa.write(segmented['select'].format(count=count,first=1-count,length=length))
+        
+        flat = None
+        if out is not None:
+            if not out.flags.c_contiguous:
+                raise AttributeError('out has to be C contiguous')
+            flat = out.reshape(-1)
+        scale, offset = self._trace_scaling(settings)
+        data = self.read_trace_into(trace,out=flat,scale=scale,offset=offset)
+        if out is None:
+            data = data.copy()
+        if not len(data) % count == 0:
+            msg = 'Trace {} has {} points; not a multiple of {} segments'.format(trace,len(data),count)
+            raise AttributeError(msg)
+        
+        timestamps = None
+        if segmented['timestamps']:
+            answer = self._visa.query(segmented['timestamps'].format(count=count,first=1-count))
+            timestamps = self._parse_timestamps(answer)
+        
+        segments = data.reshape(count,-1)
+        return Trace(segments,
+                     axis=axis_parameters(settings,segments.shape[1]),
+                     x_unit=str(settings.get('x_unit','')).strip('"'),
+                     y_unit=str(settings.get('y_unit','')).strip('"'),
+                     metadata=dict(settings,timestamps=timestamps))
+    
+    def _parse_timestamps(self,answer):
+        """Time stamps of the segments from the answer of the timestamps
+        query: numbers in s separated by ','; instruments with other
+        formats override it"""
+        return np.array([float(value) for value in answer.strip().split(',') if value.strip()])
+    
+    def _read_block_header(self,dtype,points=0):
+        """Read the header of a binary block; returns the number of data
+        bytes or None for an ieee block of indefinite length, which ends
+        with the termination (points: of blocks without header, default
+        _block_points)"""
+        
+        if self._binary_header_fmt == 'empty':
+            return (points or self._block_points())*dtype.itemsize
+        elif self._binary_header_fmt == 'ieee':
+            # IEEE 488.2 definite length block: #<digits><length><data>;
+            # '#' and digits are read together, anything before '#' (e.g.
+            # the separator between blocks) is skipped
+            start = self._visa.read_bytes(2)
+            while not start[:1] == b'#':
+                start = start[1:] + self._visa.read_bytes(1)
+            digits = int(start[1:])
+            if digits == 0:
+                return None
+            return int(self._visa.read_bytes(digits))
+        else:
+            msg = 'Tried to use header: {}; allowed only: ieee, empty'.format(self._binary_header_fmt)
+            raise AttributeError(msg)
+    
+    def _read_block(self,nbytes):
+        """The next nbytes of the instrument, read together with the
+        termination after the block with one read_bytes (the bytes
+        returned may include the termination)"""
+        
+        termination = self._visa.read_termination
+        if self._binary_expect_termination and termination:
+            return self._visa.read_bytes(nbytes + len(termination))
+        return self._visa.read_bytes(nbytes)
+    
+    def _read_block_into(self,view):
+        """Fill the memoryview with the next bytes of the instrument; one
+        read_bytes, which reads chunk_size of the resource at a time, is
+        faster than a loop over chunks"""
+        
+        view[:] = self._visa.read_bytes(len(view))
+    
+    def _read_block_end(self):
+        """Read the termination after a binary block"""
+        if self._binary_expect_termination and self._visa.read_termination:
+            self._visa.read_bytes(len(self._visa.read_termination))
+    
+    def _transfer_points(self):
+        """Number of points of blocks without header from the points
+        option of the transfer section (0: unknown)"""
+        points = self._transfer['points']
+        if isinstance(points,str):
+            points = getattr(self,points)
+        return int(points or 0)
+    
+    def _block_points(self):
+        """Number of points of blocks without header: _binary_data_points
+        or the points option of the transfer section. Raises an
+        AttributeError if neither is known, as binary data may contain the
+        termination and such a block cannot be read up to it."""
+        points = self._binary_data_points or self._transfer_points()
+        if not points:
+            msg = 'Blocks without header need the number of points (points of the transfer section or _binary_data_points)'
+            raise AttributeError(msg)
+        return points
+    
+    @property
+    def transfer_format(self):
+        """Name of the encoding set by set_transfer_format or None"""
+        return self._transferFormat
+    
+    @synchronized
+    def set_transfer_format(self,policy=None):
+        """Select the wire format of the traces from the encodings of the
+        transfer section and send its command; returns its name
+        
+        policy: name of an encoding, 'fastest', 'lossless' or the number
+        of significant bits needed (the smallest encoding with at least
+        these bits); None: _transferPolicy of the class or the default of
+        the yaml file"""
+        
+        command = self._select_transfer_format(policy)
+        self._visa.write(command)
+        # scaling settings of the instrument may follow the format
+        self.invalidate_cache()
+        return self._transferFormat
+    
+    def _select_transfer_format(self,policy=None):
+        """Choose the encoding for policy and set the _binary_ attributes;
+        returns the command selecting it on the instrument (for _setup)"""
+        
+        if policy is None:
+            policy = self._transferPolicy if self._transferPolicy is not None else self._transfer['default']
+        encodings = self._transfer['encodings']
+        name = choose_encoding(encodings,policy)
+        encoding = encodings[name]
+        
+        self._binary_datatype = encoding['datatype']
+        self._binary_big_endian = encoding['big_endian']
+        self._binary_header_fmt = encoding['header']
+        self._transferFormat = name
+        self._transferScale = dict((option,encoding[option]) for option in ('y_scale','y_offset')
+                                   if encoding[option] is not None)
+        self._scaledBuffers = {}
+        return encoding['command']
+    
+    def enable_cache(self,ttl=None):
+        """Keep the values of read write properties that were read or set
+        and answer further reads from memory
+        
+        ttl: seconds after which a value is queried again (None: never).
+        Properties with the yaml option cache: volatile are never cached,
+        cache: static ones do not expire and survive invalidate_cache()"""
+        self._cache = {}
+        self._cacheTTL = ttl
+        
+    def disable_cache(self):
+        """Stop caching and forget all values"""
+        self._cache = None
+        
+    def invalidate_cache(self,static=False):
+        """Forget cached values, e.g. after the instrument settings were
+        changed by hand or by a command not known to the cache"""
+        if self._cache is None:
+            return
+        if static:
+            self._cache.clear()
+        else:
+            for prop in list(self._cache):
+                if not self._rwCommands[prop][2]['cache'] == 'static':
+                    del self._cache[prop]
+    
+    def _cache_lookup(self,prop):
+        """Cached value of prop or _NOT_CACHED"""
+        if self._cache is None or not prop in self._cache:
+            return _NOT_CACHED
+        value, stamp = self._cache[prop]
+        if self._cacheTTL is not None and not self._rwCommands[prop][2]['cache'] == 'static':
+            if time.monotonic() - stamp > self._cacheTTL:
+                del self._cache[prop]
+                return _NOT_CACHED
+        return value
+        
+    def _cache_store(self,prop,value):
+        if self._cache is None or not prop in self._rwCommands:
+            return
+        if self._rwCommands[prop][2]['cache'] == 'volatile':
+            return
+        self._cache[prop] = (value,time.monotonic())
+        
+    def _cache_after_set(self,prop):
+        """Drop the entries a set of prop may have changed"""
+        if self._cache is None:
+            return
+        if self._cacheInvalidateOnSet:
+            self.invalidate_cache()
+        self._cache.pop(prop,None)
+    
+    @contextlib.contextmanager
+    def transaction(self,timeout=None):
+        """Exclusive use of the instrument in a with block, for sequences
+        of commands that must not be interleaved with other threads:
+        
+            with osa.transaction():
+                osa.centerwl = 1550e-9
+                osa.start_sweep()
+                osa.wait_until_ready()
+                data = osa.data
+        
+        Single properties and methods take the same (reentrant) lock on
+        their own. timeout in s (None: wait forever) raises an
+        AttributeError if another thread keeps the instrument longer."""
+        
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            raise AttributeError('Instrument busy in another thread for {} s'.format(timeout))
+        try:
+            yield self
+        finally:
+            self._lock.release()
+    
+    @synchronized
+    def enable_io_stats(self,stats=None,log_size=0):
+        """Record count, bytes and latency of every command sent to the
+        instrument; returns the IOStats (give one IOStats to several
+        instruments to collect them together); recording goes on after
+        disconnect()/connect(). Without io stats the resource is used
+        directly, so there is no cost when disabled."""
+        if stats is None:
+            stats = IOStats(log_size)
+        if isinstance(self._visa,TracedResource):
+            self._visa = self._visa._resource
+        self._visa = TracedResource(self._visa,stats)
+        self._ioStats = stats
+        return stats
+    
+    @synchronized
+    def disable_io_stats(self):
+        """Stop recording; returns the IOStats recorded so far or None"""
+        if not isinstance(self._visa,TracedResource):
+            return None
+        stats = self._visa._stats
+        self._visa = self._visa._resource
+        self._ioStats = None
+        return stats
+    
+    @property
+    def io_stats(self):
+        """The IOStats of enable_io_stats or None"""
+        if isinstance(self._visa,TracedResource):
+            return self._visa._stats
+        return None
+    
+    @synchronized
+    def ping(self):
+        """Send _pingCommand; returns False if the instrument does not
+        answer (e.g. switched off behind an open session)"""
+        try:
+            self._visa.query(self._pingCommand)
+            return True
+        except Exception:
+            return False
+    
+    @synchronized
+    def reset(self):
+        """Reset the instrument to its default settings (*RST)"""
+        self._visa.write('*RST')
+        self.invalidate_cache(static=True)
+        
     def is_ready(self):
         """ Query the instrument whether it has succesfully completed
         all operations"""
         
         return True
+    
+    def wait_until_ready(self,timeout=10.0,strategy=None):
+        """Wait until the instrument has completed all operations
+        
+        timeout in s (None: wait forever); strategy 'poll', 'opc' or 'srq'
+        overrides the one of the completion section in the yaml file.
+        Returns False if the timeout passed."""
+        
+        if strategy is None:
+            strategy = self._completion['strategy']
+        if strategy == 'poll':
+            return self._wait_poll(timeout)
+        elif strategy == 'opc':
+            return self._wait_opc(timeout)
+        elif strategy == 'srq':
+            return self._wait_srq(timeout)
+        else:
+            msg = 'Tried to use: {}; allowed only: {}'.format(strategy,COMPLETION_STRATEGIES)
+            raise AttributeError(msg)
+    
+    def _wait_poll(self,timeout):
+        """Poll is_ready, doubling the interval from poll_interval up to
+        max_interval so short operations are seen fast and long ones do not
+        flood the bus"""
+        
+        start = time.monotonic()
+        interval = self._completion['poll_interval']
+        while not self.is_ready():
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    return False
+                time.sleep(min(interval,remaining))
+            else:
+                time.sleep(interval)
+            interval = min(2*interval,self._completion['max_interval'])
+        return True
+    
+    @synchronized
+    def _wait_opc(self,timeout):
+        """*OPC? answers when all pending operations are complete; on a
+        timeout the device is cleared, which drops the pending query"""
+        
+        import pyvisa as visa
+        old_timeout = self._visa.timeout
+        self._visa.timeout = None if timeout is None else timeout*1000
+        try:
+            self._visa.query('*OPC?')
+            return True
+        except visa.errors.VisaIOError as error:
+            if error.error_code == visa.constants.StatusCode.error_timeout:
+                # the late answer of *OPC? would be read as the answer of
+                # the next query
+                self._visa.clear()
+                return False
+            raise
+        finally:
+            self._visa.timeout = old_timeout
+    
+    @synchronized
+    def _wait_srq(self,timeout):
+        """*OPC sets bit 0 of the event status register which raises a
+        service request (*ESE 1, *SRE 32) that is waited for as VISA event"""
+        
+        import pyvisa as visa
+        event = visa.constants.EventType.service_request
+        mechanism = visa.constants.EventMechanism.queue
+        self._visa.enable_event(event,mechanism)
+        try:
+            self._visa.write('*CLS;*ESE 1;*SRE 32;*OPC')
+            start = time.monotonic()
+            while True:
+                if timeout is None:
+                    remaining = visa.constants.VI_TMO_INFINITE
+                else:
+                    remaining = max(int((timeout - (time.monotonic() - start))*1000),0)
+                try:
+                    self._visa.wait_on_event(event,remaining)
+                except visa.errors.VisaIOError as error:
+                    if error.error_code == visa.constants.StatusCode.error_timeout:
+                        return False
+                    raise
+                if self._visa.stb & 0x40:
+                    break
+            self._visa.query('*ESR?')
+            return True
+        finally:
+            self._visa.discard_events(event,mechanism)
+            self._visa.disable_event(event,mechanism)
                 
     def __del__(self):
-        if self._visa is not None:
-            self._visa.close()
+        if self._session is not None:
+            self._session.close()
                     
 if __name__ == "__main__":
+    import pyvisa as visa
     b = Instrument(visa.ResourceManager('@sim'),'ASRL2::INSTR')
     
     print(b.name)
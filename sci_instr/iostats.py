@@ -0,0 +1,279 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+per command statistics (count, bytes, latency histogram) and a bounded
+trace log of the VISA traffic of instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import bisect
+import collections
+import json
+import struct
+import threading
+import time
+
+
+
+# upper bounds of the latency histogram in s: 4 per decade, 1 us to 100 s
+BUCKETS = tuple(10**(k/4) for k in range(-24,9))
+
+
+def command_key(message):
+    """Commands without their arguments, e.g. ':SENS:WAV:CENT 1.55e-06;*OPC?'
+    -> ':SENS:WAV:CENT;*OPC?', so all sets of a property share one entry"""
+    return ';'.join(part.split(None,1)[0] for part in message.split(';') if part.strip())
+
+
+
+class CommandStats():
+    """Count, bytes and latency histogram of one command"""
+
+    __slots__ = ('count','bytes_out','bytes_in','seconds','max_seconds','buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0]*(len(BUCKETS) + 1)
+
+    def add(self,bytes_out,bytes_in,seconds):
+        self.count += 1
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.seconds += seconds
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+        self.buckets[bisect.bisect_left(BUCKETS,seconds)] += 1
+
+    def percentile(self,q):
+        """Latency below which q percent of the calls were, interpolated
+        within the histogram bucket (the error is below a bucket width)"""
+        if not self.count:
+            return None
+        rank = q/100*self.count
+        seen = 0
+        for index, number in enumerate(self.buckets):
+            if number and seen + number >= rank:
+                low = BUCKETS[index-1] if index > 0 else 0.0
+                high = BUCKETS[index] if index < len(BUCKETS) else self.max_seconds
+                return min(low + (high - low)*(rank - seen)/number,self.max_seconds)
+            seen += number
+        return self.max_seconds
+
+    def as_dict(self):
+        return {'count':self.count,
+                'bytes_out':self.bytes_out,
+                'bytes_in':self.bytes_in,
+                'total_s':self.seconds,
+                'mean_s':self.seconds/self.count if self.count else None,
+                'p50_s':self.percentile(50),
+                'p99_s':self.percentile(99),
+                'max_s':self.max_seconds}
+
+
+
+class IOStats():
+    """Statistics of the VISA traffic per resource and command, filled by
+    the TracedResource of instruments (see Instrument.enable_io_stats)
+
+    log_size: number of (time, resource, operation, command, bytes out,
+    bytes in, seconds) entries kept in log (0: no trace log)
+    """
+
+    def __init__(self,log_size=0):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.log = collections.deque(maxlen=log_size) if log_size else None
+
+    def record(self,resource,command,operation,bytes_out,bytes_in,seconds):
+        key = command_key(command) if command else ''
+        with self._lock:
+            commands = self._stats.get(resource)
+            if commands is None:
+                commands = self._stats[resource] = {}
+            stats = commands.get((key,operation))
+            if stats is None:
+                stats = commands[(key,operation)] = CommandStats()
+            stats.add(bytes_out,bytes_in,seconds)
+            if self.log is not None:
+                self.log.append((time.time(),resource,operation,command,bytes_out,bytes_in,seconds))
+
+    def stats(self,resource,command,operation='query'):
+        """CommandStats of command (with or without arguments) and
+        operation ('write', 'query' or 'read': reads after the command was
+        written) or None"""
+        return self._stats.get(resource,{}).get((command_key(command),operation))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            if self.log is not None:
+                self.log.clear()
+
+    def as_dict(self):
+        """{resource: {command: {operation: {count, bytes_out, bytes_in,
+        total_s, mean_s, p50_s, p99_s, max_s}}}}"""
+        result = {}
+        with self._lock:
+            for resource, commands in self._stats.items():
+                for (command,operation), stats in commands.items():
+                    result.setdefault(resource,{}).setdefault(command,{})[operation] = stats.as_dict()
+        return result
+
+    def slowest(self,number=10):
+        """The number commands with the largest total time (all
+        operations) as (total_s, resource, command)"""
+        entries = [(sum(stats['total_s'] for stats in operations.values()),resource,command)
+                   for resource,commands in self.as_dict().items() for command,operations in commands.items()]
+        return sorted(entries,reverse=True)[:number]
+
+    def to_json(self,**kwargs):
+        return json.dumps(self.as_dict(),**kwargs)
+
+    def to_prometheus(self,prefix='sci_instr'):
+        """The statistics in the Prometheus text exposition format"""
+
+        def label(value):
+            return value.replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+        lines = ['# HELP {}_command_seconds VISA command latency'.format(prefix),
+                 '# TYPE {}_command_seconds histogram'.format(prefix)]
+        totals = []
+        with self._lock:
+            for resource, commands in sorted(self._stats.items()):
+                for (command,operation), stats in sorted(commands.items()):
+                    labels = 'resource="{}",command="{}",operation="{}"'.format(label(resource),label(command),operation)
+                    cumulative = 0
+                    for bound, number in zip(BUCKETS,stats.buckets):
+                        cumulative += number
+                        lines.append('{}_command_seconds_bucket{{{},le="{:.6g}"}} {}'.format(prefix,labels,bound,cumulative))
+                    lines.append('{}_command_seconds_bucket{{{},le="+Inf"}} {}'.format(prefix,labels,stats.count))
+                    lines.append('{}_command_seconds_sum{{{}}} {!r}'.format(prefix,labels,stats.seconds))
+                    lines.append('{}_command_seconds_count{{{}}} {}'.format(prefix,labels,stats.count))
+                    totals.append((labels,stats))
+
+        for name, attribute in (('bytes_out','bytes_out'),('bytes_in','bytes_in')):
+            lines.append('# HELP {}_command_{}_total bytes transferred'.format(prefix,name))
+            lines.append('# TYPE {}_command_{}_total counter'.format(prefix,name))
+            for labels, stats in totals:
+                lines.append('{}_command_{}_total{{{}}} {}'.format(prefix,name,labels,getattr(stats,attribute)))
+        return '\n'.join(lines) + '\n'
+
+
+
+def _size(value,datatype='f'):
+    """Bytes of an answer of the resource"""
+    if isinstance(value,(str,bytes,bytearray)):
+        return len(value)
+    nbytes = getattr(value,'nbytes',None)
+    if nbytes is not None:
+        return nbytes
+    try:
+        return len(value)*struct.calcsize(datatype)
+    except (TypeError,struct.error):
+        return 0
+
+
+
+class TracedResource():
+    """Wraps a pyvisa resource and records the time and bytes of every
+    operation in an IOStats; reads are counted for the command written
+    last. The batched calls of a pipelined link (write_raw, write_many,
+    query_many, see serial_link.SerialLink) are recorded if the resource
+    has them. Everything else is passed to the resource."""
+
+    # batched calls, only present if the resource has them
+    _batched = ('write_raw','write_many','query_many')
+
+    def __init__(self,resource,stats):
+        object.__setattr__(self,'_resource',resource)
+        object.__setattr__(self,'_stats',stats)
+        object.__setattr__(self,'_name',str(getattr(resource,'resource_name',None) or id(resource)))
+        object.__setattr__(self,'_lastCommand','')
+
+    def __getattr__(self,name):
+        attribute = getattr(self._resource,name)
+        if name in self._batched:
+            return getattr(self,'_'+name)
+        return attribute
+
+    def __setattr__(self,name,value):
+        setattr(self._resource,name,value)
+
+    def _record(self,operation,command,bytes_out,bytes_in,start):
+        self._stats.record(self._name,command,operation,bytes_out,bytes_in,time.perf_counter() - start)
+
+    def write(self,message,*args,**kwargs):
+        object.__setattr__(self,'_lastCommand',message)
+        start = time.perf_counter()
+        result = self._resource.write(message,*args,**kwargs)
+        self._record('write',message,len(message),0,start)
+        return result
+
+    def query(self,message,*args,**kwargs):
+        object.__setattr__(self,'_lastCommand',message)
+        start = time.perf_counter()
+        result = self._resource.query(message,*args,**kwargs)
+        self._record('query',message,len(message),_size(result),start)
+        return result
+
+    def query_binary_values(self,message,*args,**kwargs):
+        object.__setattr__(self,'_lastCommand',message)
+        start = time.perf_counter()
+        result = self._resource.query_binary_values(message,*args,**kwargs)
+        self._record('query',message,len(message),_size(result,kwargs.get('datatype','f')),start)
+        return result
+
+    def query_ascii_values(self,message,*args,**kwargs):
+        object.__setattr__(self,'_lastCommand',message)
+        start = time.perf_counter()
+        result = self._resource.query_ascii_values(message,*args,**kwargs)
+        self._record('query',message,len(message),_size(result,'d'),start)
+        return result
+
+    def _write_raw(self,data,*args,**kwargs):
+        object.__setattr__(self,'_lastCommand',bytes(data).decode('ascii','replace').strip())
+        start = time.perf_counter()
+        result = self._resource.write_raw(data,*args,**kwargs)
+        self._record('write',self._lastCommand,len(data),0,start)
+        return result
+
+    def _write_many(self,messages,replies=0):
+        command = ';'.join(messages)
+        object.__setattr__(self,'_lastCommand',command)
+        start = time.perf_counter()
+        result = self._resource.write_many(messages,replies)
+        answers = [answer for reply in result for answer in (reply if isinstance(reply,list) else [reply])]
+        self._record('query' if replies else 'write',command,sum(len(message) for message in messages),
+                     sum(_size(answer) for answer in answers),start)
+        return result
+
+    def _query_many(self,messages):
+        return self._write_many(messages,replies=1)
+
+    def _read(self,method,*args,**kwargs):
+        start = time.perf_counter()
+        result = getattr(self._resource,method)(*args,**kwargs)
+        self._record('read',self._lastCommand,0,_size(result,kwargs.get('datatype','f')),start)
+        return result
+
+    def read(self,*args,**kwargs):
+        return self._read('read',*args,**kwargs)
+
+    def read_raw(self,*args,**kwargs):
+        return self._read('read_raw',*args,**kwargs)
+
+    def read_bytes(self,*args,**kwargs):
+        return self._read('read_bytes',*args,**kwargs)
+
+    def read_binary_values(self,*args,**kwargs):
+        return self._read('read_binary_values',*args,**kwargs)
+
+    def read_ascii_values(self,*args,**kwargs):
+        return self._read('read_ascii_values',*args,**kwargs)
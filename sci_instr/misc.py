@@ -11,8 +11,8 @@ __author__ = 'Tim Hellwig'
 import sci_instr.generic
 import os
 import re
-import visa
-import numpy as np
+
+from sci_instr.serial_link import SerialLink
 
 
 
@@ -27,17 +27,23 @@ class Katana(sci_instr.generic.Instrument):
     
     """  
     
+    _conffile = os.path.join('Misc','Katana.yaml')
+    
     _getString = ''
     _setString = '='
     _expctResponse = 'OK'
     _formatString = '{:d}'
+    _compoundCommands = False
+    _pingCommand = 'ld'
     
+    # number in the answers, compiled once
+    _number = re.compile(r"[-+]?\d*\.\d+|\d+")
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(Katana, self).__init__(visa_rm,address,conffile=os.path.join('Misc','Katana.yaml'))
+    
+    def _setup(self):
+        """Serial settings of the session; the session is used through a
+        SerialLink, so get_many/set_many send all commands at once"""
+        import pyvisa as visa
         
         self._visa.baud_rate = 19200
         self._visa.encoding='windows-1252'
@@ -45,29 +51,28 @@ class Katana(sci_instr.generic.Instrument):
         # flush the read buffer as the katana seems to be stuck in a
         # debug output sometimes
         self._visa.flush(visa.constants.VI_READ_BUF_DISCARD)
+        self._visa = SerialLink(self._visa)
 
 
-    def _process_read_values(self,msg):
+    def _process_read_values(self,msg,value_type='float'):
         """Find the numbers in Katanas long msg and parse on/off as 1/0 for
         laser status"""
         
         #print(msg)
-        out = re.findall(r"[-+]?\d*\.\d+|\d+",msg)
+        out = self._number.search(msg)
         if out:
-            return float(out[0])
+            return float(out.group())
         else:
             if not msg.find(' on\r\n')==-1:
                 return 1
             elif not msg.find(' off\r\n')==-1:
                 return 0
                 
+    @sci_instr.generic.synchronized
     def debug(self):
-        out = ''
-        self._visa.write('debug?')
-        for i in range(0,27):
-            out = out + self._visa.read()
-                                   #join them to one byte String
-        print(out)  #decode the byte String into something printable
+        # the 27 lines of the answer are read in bulk
+        out = ''.join(self._visa.write_many(['debug?'],replies=27)[0])
+        print(out)
         
         
 
@@ -85,12 +90,20 @@ class Manson_HSC3202():
     _expctResponse = 'OK'
     _formatString = '{:d}'
     
+    # query of every property; volt and current share the answer of GETS
+    _getCommands = {'volt':'GETS','current':'GETS','max_volt':'GOVP','max_current':'GOCP'}
+    
     
     def __init__(self,visa_rm,address):
         
         
-        """Call generic init to connect and prepare instrument"""
+        """Connect and prepare instrument; the session is used through a
+        SerialLink, so get_many sends all queries at once"""
+        import pyvisa as visa
+        
         self._visa = visa_rm.open_resource(address)
+        self._resourceKey = sci_instr.generic.resource_key(address)
+        self._lock = sci_instr.generic.resource_lock(self._resourceKey)
         
         self._visa.baud_rate = 9600
         self._visa.read_termination='\r'
@@ -99,13 +112,12 @@ class Manson_HSC3202():
         # flush the read buffer as the katana seems to be stuck in a
         # debug output sometimes
         self._visa.flush(visa.constants.VI_READ_BUF_DISCARD)
+        self._visa = SerialLink(self._visa)
 
     
     @property
     def current(self):
-        temp = self._read_value('GETS')
-        curr = float(temp[3:6])/10
-        return curr
+        return self._parse_value('current',self._read_value('GETS'))
 
     @current.setter
     def current(self, value):
@@ -117,9 +129,7 @@ class Manson_HSC3202():
             
     @property
     def volt(self):
-        temp = self._read_value('GETS')
-        volt = float(temp[1:3])/10
-        return volt
+        return self._parse_value('volt',self._read_value('GETS'))
     @volt.setter
     def volt(self, value):
         if value>36.0 or value<0.0:
@@ -130,9 +140,7 @@ class Manson_HSC3202():
             
     @property
     def max_volt(self):
-        max_volt = self._read_value('GOVP')
-        max_volt = float(max_volt)/10
-        return max_volt
+        return self._parse_value('max_volt',self._read_value('GOVP'))
     @max_volt.setter
     def max_volt(self, value):
         if value>36.0 or value<0.0:
@@ -143,9 +151,7 @@ class Manson_HSC3202():
             
     @property
     def max_current(self):
-        max_curr = self._read_value('GOCP')
-        max_curr = float(max_curr)/10
-        return max_curr
+        return self._parse_value('max_current',self._read_value('GOCP'))
     @max_current.setter
     def max_current(self, value):
         if value>10.0 or value<0.0:
@@ -162,17 +168,54 @@ class Manson_HSC3202():
             
             
     
+    @staticmethod
+    def _parse_value(prop,answer):
+        """Value of prop in the answer of its query"""
+        if prop == 'current':
+            return float(answer[3:6])/10
+        elif prop == 'volt':
+            return float(answer[1:3])/10
+        else:
+            return float(answer)/10
+    
+    @sci_instr.generic.synchronized
+    def get_many(self,props,cached=True):
+        """Read several properties sending every query once (volt and
+        current with one GETS) in one write; returns a dict prop: value"""
+        for prop in props:
+            if not prop in self._getCommands:
+                raise AttributeError('Unknown property ' + prop)
+        commands = list(dict.fromkeys(self._getCommands[prop] for prop in props))
+        answers = dict(zip(commands,self._read_values(commands)))
+        return dict((prop,self._parse_value(prop,answers[self._getCommands[prop]])) for prop in props)
+    
+    @sci_instr.generic.synchronized
+    def _read_values(self,commands):
+        """Answers of commands (each followed by OK), written at once"""
+        answers = []
+        for out, response in self._visa.write_many(commands,replies=2):
+            if not response == self._expctResponse:
+                msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
+                raise AttributeError(msg)
+            answers.append(out)
+        return answers
+    
     def _read_value(self,command):
-        out = self._visa.query(command)
-        response = self._visa.read()
-        if not response == self._expctResponse:
-            msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
-            raise AttributeError(msg)
-        return out
+        return self._read_values([command])[0]
+    
+    @sci_instr.generic.synchronized
+    def ping(self):
+        """Query the output (GETS); returns False if there is no answer"""
+        try:
+            self._read_value('GETS')
+            return True
+        except Exception:
+            return False
     
+    @sci_instr.generic.synchronized
     def _write_value(self,command,value):
         out = self._visa.write(command+' '+value)
-        response = self._visa.read() 
+        response = self._visa.read()
         if not response == self._expctResponse:
             msg = 'Response was: {}; expected: {}'.format(response,self._expctResponse)
             raise AttributeError(msg)
@@ -187,13 +230,8 @@ class TL_PM100(sci_instr.generic.Instrument):
     """Allows easy communication with Thorlabs Powermeters PM100
     
     """  
-
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(TL_PM100, self).__init__(visa_rm,address,conffile=os.path.join('Misc','TL_PM100.yaml'))
-        
+    
+    _conffile = os.path.join('Misc','TL_PM100.yaml')
         
         
 
@@ -201,12 +239,8 @@ class TL_TSP01(sci_instr.generic.Instrument):
     """Allows easy communication with Thorlabs temperature monitor TL_TSP01
     
     """  
-
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(TL_TSP01, self).__init__(visa_rm,address,conffile=os.path.join('Misc','TL_TSP01.yaml'))
+    
+    _conffile = os.path.join('Misc','TL_TSP01.yaml')
                 
         
         
@@ -219,13 +253,12 @@ class APE_PulseCheck_LR(sci_instr.generic.Instrument):
     
     """  
     
-
+    _conffile = os.path.join('Misc','APE_PulseCheck_LR.yaml')
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(APE_PulseCheck_LR, self).__init__(visa_rm,address,conffile=os.path.join('Misc','APE_PulseCheck_LR.yaml'))
+    _compoundCommands = False
+    
+    def _setup(self):
+        """Serial settings of the session and default scan range"""
         self._visa.encoding='windows-1252'
         self._visa.baud_rate = 9600
         # self._visa.stop_bits = visa.constants.StopBits.one
@@ -18,33 +18,32 @@ class AQ6370C(sci_instr.generic.Instrument):
     Note: Does only work when active trace is TRA
     """  
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(AQ6370C, self).__init__(visa_rm,address,conffile=os.path.join('Osa','Yokogawa_AQ6370C.yaml'))
-        
-        self._visa.write(':init:smode 0;*CLS;:init')
-        self._visa.write(':FORMat:DATA REAL,64')
-        self._binary_datatype = 'd'
-        self._binary_big_endian = False
-        self._binary_container = np.array
+    _conffile = os.path.join('OSA','Yokogawa_AQ6370C.yaml')
+    
+    def _setup(self):
+        """Single sweep mode, clear status, start a sweep and set the
+        transfer format in one message"""
+        self._write_setup([':init:smode 0','*CLS',':init',self._select_transfer_format()])
 
         
+    @sci_instr.generic.synchronized
     def start_sweep(self):
         """Sends the trigger to start a sweep"""
         self._visa.write('*CLS;:init')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def is_ready(self):
         """ Query the instrument whether it has succesfully completed
         all operations"""
         out = self._visa.query('STAT:OPER:COND?')
         
-        return bool(int(out[0]))
+        return bool(int(out) & 1)
         
+    @sci_instr.generic.synchronized
     def get_bw_cwl(self):
         """ Query the current cwl and bw (anaylsis mode has to be on"""
-        temp = np.fromstring(self._visa.query('CALC:DATA?'),sep = ',')
+        temp = self._visa.query_ascii_values('CALC:DATA?',container=np.array)
         fwhm=temp[1]
         cwl=temp[0]
         return fwhm,cwl
@@ -55,19 +54,19 @@ class HP71451B(sci_instr.generic.Instrument):
     
     Note: Does only work when active trace is TRA
     """  
+    
+    _conffile = os.path.join('OSA','HP71451B.yaml')
     _getString = '?;'
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(HP71451B, self).__init__(visa_rm,address,conffile=os.path.join('Osa','HP71451B.yaml'))
-        
-        self._visa.write('TDF P')
-        self._visa.values_format.use_ascii('f', ',', np.array)
+    _compoundCommands = False   # answers every query on its own line
+    def _setup(self):
+        """ascii trace (TDF P), see transfer section of the yaml file"""
+        self._write_setup([self._select_transfer_format()])
         
+    @sci_instr.generic.synchronized
     def start_sweep(self):
         """Sends the trigger to start a sweep"""
         self._visa.write('TS;')
+        self.invalidate_cache()
         
     # def is_ready(self):
         """ Query the instrument whether it has succesfully completed
@@ -87,6 +86,5 @@ class HP71451B(sci_instr.generic.Instrument):
             return string
             
     def get_wavelength(self):
-        center = self.centerwl
-        span = self.span
-        return np.linspace(center-span/2,center+span/2,num=self.points,endpoint=True)    
+        """Wavelength axis in nm of the current settings (read only array)"""
+        return self.trace_axis('data')    
@@ -9,26 +9,30 @@ __author__ = 'Tim Hellwig'
 
 import sci_instr.generic
 import os
+import re
 import numpy as np
 
 
 class RS_RTO1044(sci_instr.generic.Instrument):
     """Allows easy communication with R&S Oscilloscope RTO1044"""  
     
-    def __init__(self,visa_rm,address):
-        """Call generic init to connect and prepare instrument"""
-        super(RS_RTO1044, self).__init__(visa_rm,address,conffile=os.path.join('Oscilloscopes','RS_RTO1044.yaml'))
-        
-        self._visa.write('FORM REAL,32;')
+    _conffile = os.path.join('Oscilloscopes','RS_RTO1044.yaml')
+    
+    def _setup(self):
+        """Set the transfer format"""
+        self._write_setup([self._select_transfer_format()])
      
         
+    @sci_instr.generic.synchronized
     def is_ready(self):
         """ Query the instrument whether it has succesfully completed
-        all operations"""
-        out = self._visa.query(':stat:oper:even?')
-        
-        return bool(out[0])
+        all operations: no bit of the operation condition register is set
+        (alignment, self test, autoset, waiting for trigger). Unlike the
+        event register it is not cleared by reading."""
+        out = self._visa.query(':STAT:OPER:COND?')
+        return not int(out)
     
+    @sci_instr.generic.synchronized
     def reset_stat(self,meas_number):
         """ Resets the statistics of active measurement meas_number"""
         self._visa.write("MEASurement{}:STATistics:RESet".format(int(meas_number)))
@@ -39,42 +43,50 @@ class RS_RTO1044(sci_instr.generic.Instrument):
 class Tktx_DP7254(sci_instr.generic.Instrument):
     """Allows easy communication with Tektronix Oscilloscope DPO7254"""  
     
-    def __init__(self,visa_rm,address):
-        """Call generic init to connect and prepare instrument"""
-        super(Tktx_DP7254, self).__init__(visa_rm,address,conffile=os.path.join('Oscilloscopes','Tktx_DP7254.yaml'))
-        self._visa.write('DATA:ENC RPB')
-        self._visa.write('WFMOutpre:BYT_NR 1')
-        self._visa.write('DATA:START 1')
-        length = self._visa.query('HORIZONTAL:ACQLENGTH?')
-        self._visa.write('DATA:STOP ' + length)
-        
-        self._visa.values_format.use_binary('B', False, np.array)
+    _conffile = os.path.join('Oscilloscopes','Tktx_DP7254.yaml')
+    
+    def _setup(self):
+        """Transfer format and the whole record (one query, one message)"""
+        length = self._visa.query('HORIZONTAL:ACQLENGTH?').strip()
+        self._write_setup([self._select_transfer_format(),'DATA:START 1','DATA:STOP ' + length])
         
+    @sci_instr.generic.synchronized
     def is_ready(self):
         """ Query the instrument whether it has succesfully completed
         all operations"""
         out = self._visa.query('BUSY?')
-        return bool(out[0])
+        return not int(out)
     
+    @sci_instr.generic.synchronized
     def reset_stat(self):
         """ Resets the statistics of existing measurements"""
         self._visa.write("MEASUREMENT:STATISTICS:COUNT RESET")
+    
+    # time of day in the FastFrame time stamps: 18:06:23.785 012 345
+    _timestamp = re.compile(r'(\d+):(\d+):(\d+)\.(\d{3})\s?(\d{3})?\s?(\d{3})?')
+    
+    def _parse_timestamps(self,answer):
+        """Seconds of the FastFrame time stamps relative to the first
+        frame (a day is added at midnight)"""
+        matches = self._timestamp.findall(answer)
+        if not matches:
+            return super(Tktx_DP7254, self)._parse_timestamps(answer)
+        seconds = np.array([3600*int(h) + 60*int(m) + int(s) + int(ms)*1e-3 + int(us or 0)*1e-6 + int(ns or 0)*1e-9
+                            for h,m,s,ms,us,ns in matches])
+        days = np.concatenate(([0],np.cumsum(np.diff(seconds) < 0)))
+        seconds = seconds + 86400*days
+        return seconds - seconds[0]
         
-    def getTrace(self, trace='next'): #todo: does not work!!!
-        # get scaling parameters
-        ymult = self.yscale
-        yzero = self.yoffset
-        yoff = self.doffset
-        xincr = self.xincrement
-        # query values
+    def getTrace(self, trace='next', out=None):
+        """Returns time and volt array of the current or next waveform;
+        the volts are written into out if given"""
         if trace=='current':
-            val = self.curve
+            name = 'curve'
         elif trace=='next':
-            val = self.nextcurve
+            name = 'nextcurve'
         else:
-            print('Trace is not specified as current or next!')
-        # calculate the correct axes
-        volts = (val - yoff) * ymult  + yzero
-        time = np.arange(0, xincr * len(volts), xincr)
+            raise AttributeError('Trace is not specified as current or next!')
+        # scaling and time axis as defined in the axis section of the yaml
+        result = self.get_trace(name, out=out)
         # return time and volt array
-        return time, volts
\ No newline at end of file
+        return result.x, result.data
\ No newline at end of file
@@ -0,0 +1,198 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+pool of open instrument sessions for long running programs
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import contextlib
+import threading
+import time
+
+from sci_instr.generic import resource_key
+
+
+
+class _PoolEntry():
+    """Address, class, options, lock and (once connected) instrument of
+    one VISA resource"""
+
+    def __init__(self,address,cls,kwargs):
+        self.address = address
+        self.cls = cls
+        self.kwargs = kwargs
+        self.instrument = None
+        self.lock = threading.RLock()
+        self.last_check = 0.0
+
+
+
+class InstrumentPool():
+    """Owns a ResourceManager and keeps one open instrument per VISA
+    address
+
+    Instruments are connected on first use and then reused, so the
+    connection setup (serial baud rates, buffer flushes, init commands)
+    is paid once per process. A lease gives exclusive access to an
+    instrument for the duration of a with block:
+
+        pool = InstrumentPool()
+        pool.register('TCPIP0::192.168.0.11::inst0::INSTR',RS_RTO1044)
+        with pool.lease('TCPIP0::192.168.0.11::inst0::INSTR') as osc:
+            osc.ch1_position = 0
+
+    Addresses are compared by their canonical resource name, so
+    'GPIB::23' and 'GPIB0::23::INSTR' share one session.
+
+    health_interval: seconds after which a lease checks the instrument
+    again (None: never); check: function instrument -> bool, default
+    the ping of the instrument (a query under its resource lock, *IDN?
+    for most drivers), which also detects a switched off instrument
+    behind an open session
+    """
+
+    def __init__(self,visa_rm=None,backend='',health_interval=60.0,check=None):
+        self._rm = visa_rm
+        self._ownRM = visa_rm is None
+        self._backend = backend
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._healthInterval = health_interval
+        self._check = check if check is not None else self._ping
+
+    @property
+    def resource_manager(self):
+        """The ResourceManager of the pool (created on first use)"""
+        with self._lock:
+            if self._rm is None:
+                import pyvisa as visa
+                self._rm = visa.ResourceManager(self._backend)
+            return self._rm
+
+    def register(self,address,cls,**kwargs):
+        """Declare the instrument class for address without connecting;
+        kwargs are passed to cls(visa_rm,address,**kwargs). Registering
+        an address again with another class or other kwargs raises an
+        AttributeError."""
+        with self._lock:
+            entry = self._entries.get(resource_key(address))
+            if entry is None:
+                self._entries[resource_key(address)] = _PoolEntry(address,cls,kwargs)
+            elif not entry.cls is cls or not entry.kwargs == kwargs:
+                msg = 'Address {} is registered for {} with {}'.format(address,entry.cls.__name__,entry.kwargs)
+                raise AttributeError(msg)
+
+    def _entry(self,address,cls):
+        """Entry of address; registered with cls (without kwargs) if cls
+        is given and the address is unknown"""
+        with self._lock:
+            entry = self._entries.get(resource_key(address))
+        if entry is None and cls is not None:
+            self.register(address,cls)
+            return self._entry(address,None)
+        if entry is None:
+            raise AttributeError('Unknown address ' + address)
+        if cls is not None and not entry.cls is cls:
+            msg = 'Address {} is registered for {}'.format(address,entry.cls.__name__)
+            raise AttributeError(msg)
+        return entry
+
+    def get(self,address,cls=None):
+        """Returns the connected instrument at address (connecting and
+        checking it if needed) without locking it; use lease() when the
+        instrument is shared between threads"""
+        entry = self._entry(address,cls)
+        with entry.lock:
+            return self._connect(entry)
+
+    @contextlib.contextmanager
+    def lease(self,address,cls=None):
+        """Exclusive access to the instrument at address in a with block;
+        holds the pool entry and the resource lock of the instrument (see
+        Instrument.transaction), so threads using the instrument directly
+        wait as well"""
+        entry = self._entry(address,cls)
+        with entry.lock:
+            instrument = self._connect(entry)
+            lock = getattr(instrument,'_lock',None)
+            if lock is None:
+                yield instrument
+            else:
+                with lock:
+                    yield instrument
+
+    def lock(self,address):
+        """The per-resource lock used by lease()"""
+        return self._entry(address,None).lock
+
+    def _connect(self,entry):
+        """Connect lazily and reconnect when the health check fails;
+        called with entry.lock held"""
+        now = time.monotonic()
+        if entry.instrument is not None and self._healthInterval is not None:
+            if now - entry.last_check > self._healthInterval:
+                entry.last_check = now
+                if not self._check(entry.instrument):
+                    self._close_entry(entry)
+
+        if entry.instrument is None:
+            entry.instrument = entry.cls(self.resource_manager,entry.address,**entry.kwargs)
+            entry.last_check = now
+        return entry.instrument
+
+    @classmethod
+    def _ping(cls,instrument):
+        """Default health check: ping() of the instrument, for objects
+        without ping whether the VISA session is still open"""
+        ping = getattr(instrument,'ping',None)
+        if ping is None:
+            return cls._session_open(instrument)
+        return ping()
+
+    @staticmethod
+    def _session_open(instrument):
+        try:
+            instrument._visa.session
+            return True
+        except Exception:
+            return False
+
+    def _close_entry(self,entry):
+        instrument, entry.instrument = entry.instrument, None
+        if instrument is not None and hasattr(instrument,'disconnect'):
+            instrument.disconnect()
+        elif instrument is not None and instrument._visa is not None:
+            try:
+                instrument._visa.close()
+            except Exception:
+                pass
+            instrument._visa = None
+
+    def close(self,address=None):
+        """Close the session at address or all sessions (and the
+        ResourceManager if the pool created it)"""
+        with self._lock:
+            if address is None:
+                entries = list(self._entries.values())
+            else:
+                entry = self._entries.get(resource_key(address))
+                entries = [] if entry is None else [entry]
+        for entry in entries:
+            with entry.lock:
+                self._close_entry(entry)
+
+        if address is None and self._ownRM and self._rm is not None:
+            self._rm.close()
+            self._rm = None
+
+    def __contains__(self,address):
+        return resource_key(address) in self._entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
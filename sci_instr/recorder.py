@@ -0,0 +1,311 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+recording of binary traces to chunked memory mapped .npy files with a
+metadata index, and lazy reading of the recordings
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+
+from sci_instr.trace import Trace, axis_parameters, scaling_parameters
+
+
+
+_META = 'meta.json'
+_INDEX = 'index.jsonl'
+_SETTINGS = 'settings.jsonl'
+
+
+def _chunk_file(path,number):
+    return os.path.join(path,'chunk_{:05d}.npy'.format(number))
+
+
+
+class TraceRecorder():
+    """Appends traces of an instrument to a folder of .npy chunks of
+    chunk_size traces each, in the binary dtype of the instrument (no
+    conversion, scaling is stored in the settings)
+
+        with TraceRecorder(rfsa,'data1','capture') as recorder:
+            for _ in range(100000):
+                recorder.record()
+
+    The traces are read into a pool of depth buffers and written by a
+    background thread to memory mapped chunk files, so the memory use
+    does not grow with the recording; record() waits when all buffers
+    are waiting to be written. Every trace gets a line in index.jsonl
+    (timestamp and number of the settings); settings.jsonl holds the
+    snapshots of the settings (as for Instrument.snapshot) and the axis
+    settings, taken at the first trace, every settings_interval s (None:
+    only by update_settings()) and after update_settings().
+    """
+
+    def __init__(self,instrument,trace,path,chunk_size=1024,depth=16,settings_interval=None):
+
+        if not trace in instrument._traceCommands:
+            raise AttributeError('Unknown trace ' + trace)
+        if os.path.exists(os.path.join(path,_META)):
+            raise AttributeError('There is already a recording in ' + path)
+        os.makedirs(path,exist_ok=True)
+
+        self.instrument = instrument
+        self.trace = trace
+        self.path = path
+        self.chunk_size = chunk_size
+        self.depth = depth
+        self.settings_interval = settings_interval
+        self.count = 0
+
+        self._buffer = None
+        self._free = queue.Queue()
+        self._queue = queue.Queue()
+        self._chunk = None
+        self._chunkNumber = -1
+        self._index = None
+        self._settingsFile = None
+        self._settingsNumber = -1
+        self._settingsTime = None
+        self._written = 0
+        self._error = None
+        self._thread = None
+
+    def _start(self,data):
+        """Allocate the buffers and start the writer for traces like data"""
+
+        self.dtype = data.dtype
+        self.points = len(data)
+        self._buffer = np.empty((self.depth,self.points),dtype=self.dtype)
+        for slot in range(self.depth):
+            self._free.put(slot)
+
+        meta = {'instrument':type(self.instrument).__name__,
+                'trace':self.trace,
+                'dtype':self.dtype.str,
+                'points':self.points,
+                'chunk_size':self.chunk_size,
+                'created':time.time()}
+        with open(os.path.join(self.path,_META),'w') as metafile:
+            json.dump(meta,metafile,indent=1)
+        self._index = open(os.path.join(self.path,_INDEX),'w')
+        self._settingsFile = open(os.path.join(self.path,_SETTINGS),'w')
+
+        self._thread = threading.Thread(target=self._write,name='TraceRecorder {}'.format(self.path),daemon=True)
+        self._thread.start()
+
+    def update_settings(self):
+        """Take a new snapshot of the settings for the following traces"""
+        self._settingsTime = None
+
+    def _snapshot(self):
+        instrument = self.instrument
+        settings = {'props':instrument.get_many(instrument._snapshot_props())}
+        if instrument._traceAxes.get(self.trace):
+            settings['axis'] = instrument._axis_settings(self.trace)
+        return settings
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _settings(self,timestamp):
+        """Number of the settings snapshot for a trace at timestamp; the
+        snapshot is taken in the calling thread and queued for writing"""
+        interval = self.settings_interval
+        if self._settingsTime is None or (interval is not None and timestamp - self._settingsTime >= interval):
+            self._settingsTime = timestamp
+            self._settingsNumber += 1
+            self._queue.put(('settings',self._snapshot()))
+        return self._settingsNumber
+
+    def record(self):
+        """Read the trace from the instrument and queue it for writing"""
+
+        self._check_error()
+        if self._buffer is None:
+            data = self.instrument.read_trace_into(self.trace)
+            self._start(data)
+            slot = self._free.get()
+            self._buffer[slot] = data
+        else:
+            slot = self._free.get()
+            self.instrument.read_trace_into(self.trace,out=self._buffer[slot])
+        timestamp = time.time()
+        self._queue.put(('trace',(slot,timestamp,self._settings(timestamp))))
+        self.count += 1
+
+    def append(self,data,timestamp=None,settings=None):
+        """Queue data acquired elsewhere (e.g. by a TraceStream); settings:
+        dict stored as new snapshot for this and the following traces"""
+
+        self._check_error()
+        data = np.asarray(data)
+        if self._buffer is None:
+            self._start(data)
+        if not data.shape == (self.points,):
+            raise AttributeError('Trace has shape {}; expected: {}'.format(data.shape,(self.points,)))
+        slot = self._free.get()
+        self._buffer[slot] = data
+        timestamp = time.time() if timestamp is None else timestamp
+        if settings is not None:
+            self._settingsTime = timestamp
+            self._settingsNumber += 1
+            self._queue.put(('settings',settings))
+        elif self._settingsNumber < 0:
+            self._settings(timestamp)
+        self._queue.put(('trace',(slot,timestamp,self._settingsNumber)))
+        self.count += 1
+
+    def _write(self):
+        try:
+            while True:
+                kind, item = self._queue.get()
+                if kind == 'stop':
+                    break
+                if kind == 'settings':
+                    self._settingsFile.write(json.dumps(item,default=str) + '\n')
+                    continue
+                slot, timestamp, settings = item
+                number, row = divmod(self._written,self.chunk_size)
+                if not number == self._chunkNumber:
+                    self._next_chunk(number)
+                self._chunk[row] = self._buffer[slot]
+                self._free.put(slot)
+                self._index.write('{{"timestamp": {!r}, "settings": {}}}\n'.format(timestamp,settings))
+                self._written += 1
+        except BaseException as error:
+            self._error = error
+            # keep the producer from waiting for buffers forever
+            for slot in range(self.depth):
+                self._free.put(slot)
+        finally:
+            self._flush()
+
+    def _next_chunk(self,number):
+        self._flush()
+        self._chunk = np.lib.format.open_memmap(_chunk_file(self.path,number),mode='w+',
+                                                dtype=self.dtype,shape=(self.chunk_size,self.points))
+        self._chunkNumber = number
+
+    def _flush(self):
+        if self._chunk is not None:
+            self._chunk.flush()
+        if self._index is not None:
+            self._index.flush()
+            self._settingsFile.flush()
+
+    def close(self):
+        """Write all queued traces and close the files"""
+        if self._thread is not None:
+            self._queue.put(('stop',None))
+            self._thread.join()
+            self._thread = None
+            self._chunk = None
+            self._index.close()
+            self._settingsFile.close()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+
+class TraceStore():
+    """Lazy access to a recording of TraceRecorder; the chunk files are
+    memory mapped when first needed
+
+        store = TraceStore('capture')
+        store[1000:2000]            # raw data, shape (1000, points)
+        store.trace(1000)           # Trace with scaled data and x axis
+    """
+
+    def __init__(self,path,cached_chunks=4):
+        self.path = path
+        with open(os.path.join(path,_META)) as metafile:
+            self.meta = json.load(metafile)
+        self.dtype = np.dtype(self.meta['dtype'])
+        self.points = self.meta['points']
+        self.chunk_size = self.meta['chunk_size']
+
+        timestamps, settings = [], []
+        with open(os.path.join(path,_INDEX)) as index:
+            for line in index:
+                if line.strip():
+                    entry = json.loads(line)
+                    timestamps.append(entry['timestamp'])
+                    settings.append(entry['settings'])
+        self.timestamps = np.array(timestamps)
+        self.settings_index = np.array(settings,dtype=int)
+        with open(os.path.join(path,_SETTINGS)) as settingsfile:
+            self.settings = [json.loads(line) for line in settingsfile if line.strip()]
+
+        self._cachedChunks = cached_chunks
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def chunk(self,number):
+        """Memory map of chunk number (read only)"""
+        chunk = self._chunks.pop(number,None)
+        if chunk is None:
+            chunk = np.load(_chunk_file(self.path,number),mmap_mode='r')
+        self._chunks[number] = chunk
+        while len(self._chunks) > self._cachedChunks:
+            del self._chunks[next(iter(self._chunks))]
+        return chunk
+
+    def __getitem__(self,key):
+        """Raw data of one trace (int) or of several (slice or indices)"""
+
+        if isinstance(key,(int,np.integer)):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('Trace {} of {}'.format(key,len(self)))
+            number, row = divmod(int(key),self.chunk_size)
+            return self.chunk(number)[row]
+
+        indices = np.arange(len(self))[key]
+        result = np.empty((len(indices),self.points),dtype=self.dtype)
+        if not len(indices):
+            return result
+        numbers, rows = np.divmod(indices,self.chunk_size)
+        for number in np.unique(numbers):
+            selected = numbers == number
+            result[selected] = self.chunk(number)[rows[selected]]
+        return result
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def trace_settings(self,index):
+        """Settings snapshot of trace index"""
+        return self.settings[self.settings_index[index]]
+
+    def trace(self,index):
+        """Trace index with y scaling and x axis of its settings"""
+
+        settings = self.trace_settings(index).get('axis',{})
+        data = np.array(self[index])
+        scale, offset = scaling_parameters(settings)
+        if scale is not None or offset:
+            data = data*(1.0 if scale is None else scale) + (offset or 0)
+        return Trace(data,
+                     axis=axis_parameters(settings,self.points),
+                     x_unit=str(settings.get('x_unit','')).strip('"'),
+                     y_unit=str(settings.get('y_unit','')).strip('"'),
+                     metadata=dict(settings,timestamp=self.timestamps[index]))
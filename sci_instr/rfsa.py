@@ -18,34 +18,33 @@ class N9000A(sci_instr.generic.Instrument):
     
     """  
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(N9000A, self).__init__(visa_rm,address,conffile=os.path.join('RFSA','Agilent_N9000A.yaml'))
-        
+    _conffile = os.path.join('RFSA','Agilent_N9000A.yaml')
+    
+    def _setup(self):
+        """Set the transfer format"""
         # self._visa.write(':init:smode 0;*CLS;:init')
-        self._visa.write(':FORMat:TRACe:DATA REAL,64')
-        self._visa.write(':FORMat:BORDer SWAPped')
-        
-        self._binary_datatype = 'd'
-        self._binary_big_endian = False
-        self._binary_container = np.array
+        self._write_setup([self._select_transfer_format()])
 
         
+    @sci_instr.generic.synchronized
     def mark2cent(self):
         """Sets the center freq to current marker X"""
         self._visa.write(':CALC:MARK:CENT')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark2ref(self):
         """Sets the ref lvl to current marker Y"""
         self._visa.write(':CALC:MARK:RLEV')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark_findMax(self):
         """Sets the marker to maximum"""
         self._visa.write(':CALC:MARK:MAX')  
      
     
+    @sci_instr.generic.synchronized
     def average_clear(self):
         """Clears the average acquisition when in average or max hold mode"""
         self._visa.write(':AVER:CLE')
@@ -61,29 +60,28 @@ class SSA3000X(sci_instr.generic.Instrument):
     
     """  
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(SSA3000X, self).__init__(visa_rm,address,conffile=os.path.join('RFSA','Siglent_SSA3000X.yaml'))
-        
+    _conffile = os.path.join('RFSA','Siglent_SSA3000X.yaml')
+    
+    def _setup(self):
+        """Set the transfer format; its blocks have no header, the number
+        of points is read from the points property (transfer section of
+        the yaml file)"""
         # self._visa.write(':init:smode 0;*CLS;:init')
-        self._visa.write(':FORMat:DATA REAL')
-        
-        self._binary_datatype = 'f'
-        self._binary_big_endian = False
-        self._binary_container = np.array
-        self._binary_data_points = 751
-        self._binary_header_fmt = 'empty'
+        self._write_setup([self._select_transfer_format()])
         
+    @sci_instr.generic.synchronized
     def mark2cent(self):
         """Sets the center freq to current marker X"""
         self._visa.write(':CALC:MARK:CENT')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark2ref(self):
         """Sets the ref lvl to current marker Y"""
         self._visa.write(':CALC:MARK:RLEV')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark_findMax(self):
         """Sets the marker to maximum"""
         self._visa.write(':CALC:MARK:MAX')  
@@ -98,25 +96,26 @@ class MS2721(sci_instr.generic.Instrument):
     
     """  
     
-    def __init__(self,visa_rm,address):
-        
-        
-        """Call generic init to connect and prepare instrument"""
-        super(MS2721, self).__init__(visa_rm,address,conffile=os.path.join('RFSA','Anritsu_MS2721.yaml'))
-        
+    _conffile = os.path.join('RFSA','Anritsu_MS2721.yaml')
+    
+    def _setup(self):
+        """Set the transfer format"""
         # self._visa.write(':init:smode 0;*CLS;:init')
-        self._visa.write(':FORMat:DATA REAL,32')
-        
-        self._visa.values_format.use_binary('f', False, np.array)
+        self._write_setup([self._select_transfer_format()])
         
+    @sci_instr.generic.synchronized
     def mark2cent(self):
         """Sets the center freq to current marker X"""
         self._visa.write(':CALC:MARK:CENT')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark2ref(self):
         """Sets the ref lvl to current marker Y"""
         self._visa.write(':CALC:MARK:RLEV')
+        self.invalidate_cache()
         
+    @sci_instr.generic.synchronized
     def mark_findMax(self):
         """Sets the marker to maximum"""
         self._visa.write(':CALC:MARK:MAX')  
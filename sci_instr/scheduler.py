@@ -0,0 +1,290 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+deadline scheduler for measurement campaigns: periodic and one shot
+jobs on several instruments running concurrently, with a report of the
+achieved rates and jitter
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import threading
+import time
+
+
+
+class _Job():
+    """Schedule and statistics of one job"""
+
+    def __init__(self,label,function,period,duration,priority,tolerance,release,count,callback):
+        self.label = label
+        self.function = function
+        self.period = period
+        self.duration = duration
+        self.priority = priority
+        self.tolerance = tolerance
+        self.release = release
+        self.remaining = count
+        self.callback = callback
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.lateness = 0.0
+        self.max_lateness = 0.0
+        self.first_start = None
+        self.last_start = None
+
+    @property
+    def deadline(self):
+        """Latest start that keeps the rate: the next release (one shot
+        jobs: release + tolerance)"""
+        return self.release + (self.period if self.period else self.tolerance)
+
+
+
+class _Worker():
+    """Jobs of one instrument (VISA resource), run one after another"""
+
+    def __init__(self,name):
+        self.name = name
+        self.jobs = []
+        self.thread = None
+        self.busy = 0.0
+        self.wake = threading.Event()
+
+
+
+class Scheduler():
+    """Runs jobs on instruments: every instrument (VISA resource) has a
+    worker thread, so a sweep of one instrument overlaps with the reads of
+    the others, and the jobs of one instrument are ordered by deadline
+
+        scheduler = Scheduler()
+        scheduler.add(osa,lambda: osa.get_trace('data') if osa.wait_until_ready(30) else None,
+                      period=60,duration=20,label='spectrum',start_call=osa.start_sweep)
+        scheduler.add(pm,lambda: pm.power,period=0.1,duration=0.005,priority=1,label='power')
+        scheduler.add(tsp,lambda: tsp.get_many(['temperature_int','humidity']),period=10,label='climate')
+        scheduler.run(8*3600)
+        print(scheduler.report())
+
+    period: s between the releases of a periodic job (None: one shot);
+    releases follow a fixed grid start + k*period, so there is no drift,
+    and releases more than a period late are skipped and counted as
+    missed. duration: expected run time of the job; a job is not started
+    if it would delay a due job of higher priority on the same worker by
+    more than its tolerance (default a tenth of the period), shorter jobs
+    that fit are run instead. Among the due jobs the one with the
+    earliest deadline (next release) runs first, then the one with higher
+    priority. Results are kept in results as (timestamp, value) and passed
+    to callback(label, timestamp, value); errors are kept in errors and
+    the job goes on.
+    """
+
+    def __init__(self):
+        self.results = {}
+        self.errors = {}
+        self._jobs = {}
+        self._workers = {}
+        self._stop = threading.Event()
+        self._start = None
+        self._stopped = None
+
+    @staticmethod
+    def _worker_name(instrument):
+        if instrument is None:
+            return 'host'
+        return getattr(instrument,'_resourceKey',None) or str(id(instrument))
+
+    def add(self,instrument,function,period=None,duration=0.0,priority=0,label=None,
+            tolerance=None,start=0.0,count=None,callback=None,start_call=None):
+        """Add a job calling function() on the worker of instrument (None:
+        host jobs, which share one host worker); start: s after the start of
+        the scheduler of the first release; count: number of runs (None:
+        unlimited for periodic jobs); start_call: called (on the worker)
+        right before function, e.g. the trigger of a sweep. Returns the
+        label (default: the name of the function)."""
+
+        if period is not None and period <= 0:
+            raise AttributeError('Tried to set period: {}; allowed only values > 0'.format(period))
+        if label is None:
+            label = getattr(function,'__name__','job')
+        if label in self._jobs:
+            raise AttributeError('Job {} already exists'.format(label))
+        if tolerance is None:
+            tolerance = period/10 if period else 0.0
+        if period is None and count is None:
+            count = 1
+        if start_call is not None:
+            job_function = function
+            def function():
+                start_call()
+                return job_function()
+
+        job = _Job(label,function,period,duration,priority,tolerance,start,count,callback)
+        name = self._worker_name(instrument)
+        worker = self._workers.get(name)
+        if worker is None:
+            worker = self._workers[name] = _Worker(name)
+        worker.jobs.append(job)
+        self._jobs[label] = job
+        if self._start is not None:
+            job.release += time.monotonic()
+            if worker.thread is None:
+                self._start_worker(worker)
+        worker.wake.set()
+        return label
+
+    @property
+    def jobs(self):
+        return list(self._jobs)
+
+    def _next(self,worker,now):
+        """(job to run now, None) or (None, time of the next release; None
+        without active jobs)"""
+
+        jobs = [job for job in worker.jobs if job.remaining is None or job.remaining > 0]
+        due = [job for job in jobs if job.release <= now]
+        for job in sorted(due,key=lambda job: (job.deadline,-job.priority)):
+            # would the job delay a more important one beyond its tolerance?
+            finish = now + job.duration
+            blocking = [other for other in jobs
+                        if other is not job and other.priority > job.priority and
+                        other.release + other.tolerance < finish]
+            if not blocking:
+                return job, None
+        # the most important due job is never blocked, so there is a
+        # later release whenever no job was found
+        future = [job.release for job in jobs if job.release > now]
+        return None, min(future) if future else None
+
+    def _run_worker(self,worker):
+        while not self._stop.is_set():
+            # cleared before looking at the jobs, so no add() is missed
+            worker.wake.clear()
+            now = time.monotonic()
+            job, wake = self._next(worker,now)
+            if job is None:
+                worker.wake.wait(None if wake is None else wake - now)
+            else:
+                self._execute(worker,job,now)
+
+    def _execute(self,worker,job,now):
+        lateness = now - job.release
+        job.lateness += lateness
+        job.max_lateness = max(job.max_lateness,lateness)
+        start = time.monotonic()
+        if job.first_start is None:
+            job.first_start = start
+        job.last_start = start
+        try:
+            value = job.function()
+        except Exception as error:
+            job.errors += 1
+            self.errors[job.label] = (time.time(),error)
+        else:
+            timestamp = time.time()
+            self.results[job.label] = (timestamp,value)
+            if job.callback is not None:
+                try:
+                    job.callback(job.label,timestamp,value)
+                except Exception as error:
+                    self.errors[job.label] = (timestamp,error)
+        elapsed = time.monotonic() - start
+        job.busy += elapsed
+        worker.busy += elapsed
+        job.runs += 1
+        if job.remaining is not None:
+            job.remaining -= 1
+
+        if job.period:
+            job.release += job.period
+            now = time.monotonic()
+            if job.release + job.tolerance < now:
+                skipped = int((now - job.release)/job.period)
+                if skipped:
+                    job.missed += skipped
+                    job.release += skipped*job.period
+
+    def _finished(self):
+        """All jobs have run their count"""
+        return all(job.remaining is not None and job.remaining <= 0 for job in self._jobs.values())
+
+    def start(self):
+        """Start the worker threads; the releases count from now"""
+        if self._start is not None:
+            return
+        self._stop.clear()
+        self._start = time.monotonic()
+        self._stopped = None
+        for job in self._jobs.values():
+            job.release += self._start
+        for worker in self._workers.values():
+            self._start_worker(worker)
+
+    def _start_worker(self,worker):
+        worker.thread = threading.Thread(target=self._run_worker,args=(worker,),daemon=True,
+                                         name='Scheduler {}'.format(worker.name))
+        worker.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for worker in self._workers.values():
+            worker.wake.set()
+            if worker.thread is not None:
+                worker.thread.join()
+                worker.thread = None
+        if self._start is not None and self._stopped is None:
+            self._stopped = time.monotonic()
+
+    def run(self,duration=None):
+        """Run the jobs for duration s (None: until all jobs with a count
+        are done; runs forever with unlimited periodic jobs)"""
+        self.start()
+        try:
+            end = None if duration is None else self._start + duration
+            while not self._stop.is_set():
+                if end is not None and time.monotonic() >= end:
+                    break
+                if self._finished():
+                    break
+                self._stop.wait(0.05 if end is None else min(0.05,max(end - time.monotonic(),0)))
+        finally:
+            self.stop()
+        return self.report()
+
+    def report(self):
+        """Per job: requested and achieved rate (intervals between the
+        first and the last start), runs, missed releases, errors, mean and max lateness of
+        the starts (jitter) and mean run time against the declared
+        duration; per worker: the fraction of time busy"""
+
+        if self._start is None:
+            return {'jobs':{},'workers':{}}
+        end = self._stopped if self._stopped is not None else time.monotonic()
+        jobs = {}
+        for label, job in self._jobs.items():
+            interval = job.last_start - job.first_start if job.runs > 1 else 0.0
+            jobs[label] = {'requested_hz':1.0/job.period if job.period else None,
+                           'achieved_hz':(job.runs - 1)/interval if job.period and interval > 0 else None,
+                           'runs':job.runs,
+                           'missed':job.missed,
+                           'errors':job.errors,
+                           'jitter_mean_s':job.lateness/job.runs if job.runs else None,
+                           'jitter_max_s':job.max_lateness if job.runs else None,
+                           'duration_mean_s':job.busy/job.runs if job.runs else None,
+                           'duration_declared_s':job.duration}
+        elapsed = end - self._start
+        workers = dict((name,{'jobs':[job.label for job in worker.jobs],
+                              'utilization':worker.busy/elapsed if elapsed > 0 else 0.0})
+                       for name,worker in self._workers.items())
+        return {'jobs':jobs,'workers':workers,'elapsed_s':elapsed}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
@@ -0,0 +1,153 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+buffered protocol engine for serial (ASRL) instruments: pipelined
+writes, bulk reads framed on the terminator and link statistics
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import time
+
+
+
+class SerialLink():
+    """Wraps the pyvisa resource of a serial instrument and is used in its
+    place (write, read and query behave as for the resource)
+
+        link = SerialLink(resource)
+        answers = link.query_many(['ldc','f','ld'])     # one write
+        replies = link.write_many(['ldc=100','f=10'],replies=1)
+
+    Several messages are written with one write_raw before their replies
+    are collected, so the line turnaround is paid once instead of once
+    per command. Reads take all bytes waiting in the receive buffer at
+    once and split them on the terminator (read_termination of the
+    resource, stripped like pyvisa does; without read_termination on
+    '\\n', kept); frames not asked for yet stay in the buffer for the
+    next read. stats() reports bytes, time spent in I/O and the
+    utilization of the link. Everything else is passed to the resource.
+    """
+
+    def __init__(self,resource):
+        object.__setattr__(self,'_resource',resource)
+        object.__setattr__(self,'_buffer',bytearray())
+        object.__setattr__(self,'_frames',[])
+        self.reset_stats()
+
+    def __getattr__(self,name):
+        return getattr(self._resource,name)
+
+    def __setattr__(self,name,value):
+        setattr(self._resource,name,value)
+
+    def reset_stats(self):
+        object.__setattr__(self,'_stats',{'messages':0,'writes':0,'frames':0,'reads':0,
+                                          'bytes_out':0,'bytes_in':0,'busy_s':0.0})
+        object.__setattr__(self,'_start',time.perf_counter())
+
+    def stats(self):
+        """Counters of the link since creation or reset_stats: messages
+        and frames, writes and reads (calls of the resource), bytes, time
+        spent in I/O (busy_s), its fraction of the elapsed time
+        (utilization) and the fraction of the baud rate used by the bytes
+        (wire_utilization, 10 bits per byte)"""
+        stats = dict(self._stats)
+        stats['elapsed_s'] = time.perf_counter() - self._start
+        stats['utilization'] = stats['busy_s']/stats['elapsed_s'] if stats['elapsed_s'] else 0.0
+        baud_rate = getattr(self._resource,'baud_rate',None)
+        if baud_rate and stats['elapsed_s']:
+            stats['wire_utilization'] = 10*(stats['bytes_out'] + stats['bytes_in'])/baud_rate/stats['elapsed_s']
+        else:
+            stats['wire_utilization'] = None
+        return stats
+
+    def _terminator(self):
+        """Terminator the replies are split on and whether it is kept"""
+        termination = self._resource.read_termination
+        if termination:
+            return termination.encode(self._resource.encoding), False
+        return b'\n', True
+
+    def write_raw(self,data):
+        start = time.perf_counter()
+        result = self._resource.write_raw(data)
+        self._stats['writes'] += 1
+        self._stats['bytes_out'] += len(data)
+        self._stats['busy_s'] += time.perf_counter() - start
+        return result
+
+    def _send(self,messages):
+        """Write messages with their write termination as one write_raw"""
+        termination = self._resource.write_termination or ''
+        data = ''.join(message + termination for message in messages).encode(self._resource.encoding)
+        self._stats['messages'] += len(messages)
+        return self.write_raw(data)
+
+    def _fill(self):
+        """Read everything waiting in the receive buffer (at least one
+        message, waiting up to the timeout of the resource)"""
+        start = time.perf_counter()
+        waiting = getattr(self._resource,'bytes_in_buffer',0) or 0
+        if waiting > 0:
+            data = self._resource.read_bytes(waiting)
+        else:
+            data = self._resource.read_raw()
+        self._stats['reads'] += 1
+        self._stats['bytes_in'] += len(data)
+        self._stats['busy_s'] += time.perf_counter() - start
+
+        self._buffer.extend(data)
+        terminator, keep = self._terminator()
+        while True:
+            end = self._buffer.find(terminator)
+            if end < 0:
+                break
+            frame = bytes(self._buffer[:end + len(terminator) if keep else end])
+            del self._buffer[:end + len(terminator)]
+            self._frames.append(frame.decode(self._resource.encoding))
+
+    def read_frames(self,count):
+        """The next count replies"""
+        while len(self._frames) < count:
+            self._fill()
+        frames = self._frames[:count]
+        del self._frames[:count]
+        self._stats['frames'] += count
+        return frames
+
+    def write(self,message,*args,**kwargs):
+        return self._send([message])
+
+    def read(self,*args,**kwargs):
+        return self.read_frames(1)[0]
+
+    def query(self,message,*args,**kwargs):
+        self._send([message])
+        return self.read()
+
+    def write_many(self,messages,replies=0):
+        """Write messages at once, then read replies frames per message;
+        returns the list of replies (per message a list if replies > 1)"""
+        self._send(messages)
+        frames = self.read_frames(replies*len(messages))
+        if replies <= 1:
+            return frames
+        return [frames[index:index + replies] for index in range(0,len(frames),replies)]
+
+    def query_many(self,messages):
+        """Write the queries at once and return their answers"""
+        return self.write_many(messages,replies=1)
+
+    def flush(self,*args,**kwargs):
+        """Drop the buffered replies and flush the resource"""
+        self._buffer.clear()
+        del self._frames[:]
+        return self._resource.flush(*args,**kwargs)
+
+    def clear(self):
+        self._buffer.clear()
+        del self._frames[:]
+        return self._resource.clear()
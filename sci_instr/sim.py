@@ -0,0 +1,510 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+simulated instruments driven by the yaml definitions, for running and
+timing the drivers without hardware
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import random
+import re
+import threading
+import time
+import zlib
+import numpy as np
+import pyvisa as visa
+
+import sci_instr.generic
+
+
+
+# answers of status queries while the instrument is ready / busy
+# (STAT:OPER:COND? of the AQ6370C: bit 0 sweep complete; :STAT:OPER:COND?
+# of the RTO: bits of the running operations)
+_READY_REPLIES = {'*OPC?':('1','1'),
+                  'STAT:OPER:COND?':('1','0'),
+                  ':STAT:OPER:COND?':('0','8'),
+                  ':STAT:OPER:EVEN?':('1','0'),
+                  'BUSY?':('0','1')}
+
+# format commands of the drivers: (pattern, datatype or byte order)
+_FORMAT_COMMANDS = ((re.compile(r'REAL,?\s*64',re.I),'d'),
+                    (re.compile(r'REAL,?\s*32',re.I),'f'),
+                    (re.compile(r'FORM(AT)?(:DATA)?\s+REAL\s*$',re.I),'f'),
+                    (re.compile(r'FORM\w*(:TRAC\w*)?(:DATA)?\s+ASC',re.I),'ascii'),
+                    (re.compile(r'ENC\w*\s+ASCI',re.I),'ascii'),
+                    (re.compile(r'^TDF\s+P',re.I),'ascii'),
+                    (re.compile(r'ENC\w*\s+RPB',re.I),'B'),
+                    (re.compile(r'ENC\w*\s+RPB',re.I),'>'),
+                    (re.compile(r'ENC\w*\s+RIB',re.I),'b'),
+                    (re.compile(r'ENC\w*\s+RIB',re.I),'>'),
+                    (re.compile(r'BYT_NR\s+2',re.I),'H'),
+                    (re.compile(r'BORD\w*\s+SWAP',re.I),'<'),
+                    (re.compile(r'BORD\w*\s+NORM',re.I),'>'))
+
+
+def _normalize(command):
+    return ' '.join(command.split())
+
+
+
+class SimInstrument():
+    """State and behaviour of one simulated instrument, built from the
+    compiled definition of an Instrument class
+
+    values: initial answers {prop: value}; points: trace length;
+    datatype/big_endian: binary format (default: follows the format
+    commands the driver sends); header: 'ieee' or 'empty'; latency and
+    jitter: seconds per I/O operation (jitter: uniform extra delay);
+    command_latency: {command prefix: extra seconds}; bandwidth: bytes/s
+    of the link (None: unlimited); operations: {command prefix: seconds
+    the instrument is busy after it, e.g. a sweep}; units: {prop: factor
+    of the answer to the set value} for instruments answering in other
+    units than they are set in
+    """
+
+    def __init__(self,cls,conffile=None,values=None,points=1001,datatype=None,big_endian=False,
+                 header='ieee',latency=0.0,jitter=0.0,command_latency=None,bandwidth=None,
+                 operations=None,units=None,seed=None):
+
+        definition = sci_instr.generic.compile_instrument(cls,conffile or cls._conffile)
+        self.definition = definition
+        self.points = points
+        self.datatype = datatype or 'f'
+        self.big_endian = big_endian
+        self._fixedFormat = datatype is not None
+        self.header = header
+        self.latency = latency
+        self.jitter = jitter
+        self.command_latency = dict(command_latency or {})
+        self.bandwidth = bandwidth
+        self.operations = dict(operations or {})
+        self.units = dict(units or {})
+        self.busy_until = 0.0
+        self.lock = threading.RLock()
+
+        # IEEE 488.2 status: *OPC sets bit 0 of the event status register
+        # when the operations are complete
+        self.esr = 0
+        self.ese = 0
+        self.sre = 0
+        self._opcArmed = False
+        self._random = random.Random(seed)
+        self._traceData = {}
+
+        self.separator = definition._compoundSeparator
+        self.response = definition._expctResponse
+
+        # query string -> prop, set template -> prop
+        self._gets = {}
+        self._sets = []
+        self.state = {}
+        for prop, (get, set_template, options) in definition._rwCommands.items():
+            self._gets[self._last_command(get)] = prop
+            prefix, _, rest = self._last_command(set_template,normalize=False).partition('{')
+            suffix = rest.partition('}')[2]
+            self._sets.append((_normalize(prefix),prefix[-1:].isspace(),_normalize(suffix),prop,options))
+            self.state[prop] = self._initial_value(options)
+        self._sets.sort(key=lambda entry: -len(entry[0]))
+
+        self._readOnly = {}
+        for prop, get in definition._roCommands.items():
+            self._readOnly[self._last_command(get)] = prop
+            self.state[prop] = '0'
+        if 'name' in self.state:
+            self.state['name'] = 'sci_instr,Simulated {},0,0.0'.format(cls.__name__)
+
+        self._traces = dict((self._last_command(get),prop) for prop,get in definition._traceCommands.items())
+
+        # segmented memory: switched by the enable/disable commands
+        self.segmented = False
+        segmented = definition._segmented
+        self._segmentCommands = {}
+        if segmented['enable']:
+            self._segmentCommands[self._last_command(segmented['enable'])] = True
+            if segmented['disable']:
+                self._segmentCommands[self._last_command(segmented['disable'])] = False
+        self._timestamps = None
+        if segmented['timestamps']:
+            self._timestamps = _normalize(segmented['timestamps'].partition('{')[0]).split()[0]
+        self.state.update(values or {})
+
+    def _last_command(self,command,normalize=True):
+        """Commands like ':ACQ:POIN:AUTO RECL;:ACQ:POIN?' are keyed by
+        their last part"""
+        parts = [part for part in command.split(self.separator) if part.strip()]
+        last = parts[-1] if parts else command
+        return _normalize(last) if normalize else last.strip()
+
+    @staticmethod
+    def _initial_value(options):
+        if options['allowed_values']:
+            return options['allowed_values'][0]
+        if options['min_value'] is not None:
+            return options['min_value']
+        if options['value_type'] == 'string':
+            return ''
+        return 0
+
+    def wait(self,command='',nbytes=0):
+        """Delay of one I/O operation"""
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0,self.jitter)
+        for prefix, extra in self.command_latency.items():
+            if command.startswith(prefix):
+                delay += extra
+        if self.bandwidth:
+            delay += nbytes/self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    @property
+    def busy(self):
+        return time.monotonic() < self.busy_until
+
+    def event_status(self):
+        if self._opcArmed and not self.busy:
+            self.esr |= 1
+            self._opcArmed = False
+        return self.esr
+
+    def status_byte(self):
+        """Bit 5: enabled events (*ESE), bit 6: service request (*SRE)"""
+        stb = 0x20 if self.event_status() & self.ese else 0
+        if stb & self.sre:
+            stb |= 0x40
+        return stb
+
+    def execute(self,message):
+        """Process one message; returns the list of answers (str or bytes)"""
+
+        replies = []
+        with self.lock:
+            for part in message.split(self.separator):
+                command = _normalize(part)
+                if not command:
+                    continue
+                reply = self._execute(command)
+                if reply is not None:
+                    replies.append(reply)
+        return replies
+
+    def _execute(self,command):
+        if command.startswith('*'):
+            reply = self._execute_common(command.upper())
+            if reply is not False:
+                return reply
+        if command in self._segmentCommands:
+            self.segmented = self._segmentCommands[command]
+            return None
+        if self._timestamps and self.segmented and command.startswith(self._timestamps):
+            return ','.join(repr(1e-6*segment) for segment in range(self._segment_count()))
+        if command in self._traces:
+            trace = self._traces[command]
+            sources = self.definition._sources
+            if trace == sources['trace']:
+                # one block per selected source
+                count = len(str(self.state[sources['select']]).split(','))
+                block = self._trace_block(trace)
+                if count > 1 and isinstance(block,bytes):
+                    return b';'.join([block]*count)
+                return block
+            return self._trace_block(trace)
+        if command in self._gets:
+            return str(self.state[self._gets[command]])
+        if command in self._readOnly:
+            return str(self.state[self._readOnly[command]])
+
+        status = _READY_REPLIES.get(command.upper())
+        if status is not None:
+            # *OPC? is answered when the operations are complete (see
+            # SimResource.write)
+            return status[1] if self.busy else status[0]
+
+        for prefix, separated, suffix, prop, options in self._sets:
+            if command.startswith(prefix):
+                rest = command[len(prefix):]
+                if separated and rest and not rest[0].isspace():
+                    continue
+                if suffix and rest.endswith(suffix):
+                    rest = rest[:-len(suffix)]
+                self.state[prop] = rest.strip()
+                if prop in self.units:
+                    self.state[prop] = repr(float(self.state[prop])*self.units[prop])
+                return self.response
+
+        if command.endswith('?'):
+            return '0'
+
+        for pattern, value in _FORMAT_COMMANDS:
+            if pattern.search(command) and not self._fixedFormat:
+                if value in ('<','>'):
+                    self.big_endian = value == '>'
+                else:
+                    self.datatype = value
+        for prefix, duration in self.operations.items():
+            if command.lower().startswith(prefix.lower()):
+                self.busy_until = time.monotonic() + duration
+        return None
+
+    def _execute_common(self,command):
+        """Status commands of IEEE 488.2; False for other commands"""
+        if command == '*CLS':
+            self.esr = 0
+            self._opcArmed = False
+        elif command == '*OPC':
+            self._opcArmed = True
+        elif command == '*ESR?':
+            esr = self.event_status()
+            self.esr = 0
+            return str(esr)
+        elif command.startswith('*ESE '):
+            self.ese = int(float(command[5:]))
+        elif command.startswith('*SRE '):
+            self.sre = int(float(command[5:]))
+        else:
+            return False
+        return None
+
+    def _trace_points(self,trace=None):
+        points = self.state.get('points')
+        try:
+            points = int(float(points))
+        except (TypeError,ValueError):
+            points = 0
+        points = points if points > 0 else self.points
+        if self.segmented and trace == self.definition._segmented['trace']:
+            points *= self._segment_count()
+        return points
+
+    def _segment_count(self):
+        try:
+            return max(int(float(self.state[self.definition._segmented['count']])),1)
+        except (TypeError,ValueError):
+            return 1
+
+    def _trace_block(self,trace):
+        """Binary block of a trace: a peak on a noisy background"""
+        points = self._trace_points(trace)
+        key = (trace,points,self.datatype,self.big_endian)
+        if not key in self._traceData:
+            x = np.linspace(-1,1,points)
+            # crc32: hash() of str is salted per process
+            rng = np.random.default_rng(zlib.crc32(trace.encode()))
+            values = np.exp(-(x/0.05)**2) + 0.01*rng.standard_normal(points)
+            if self.datatype == 'ascii':
+                self._traceData[key] = ','.join('{:.6e}'.format(value) for value in values)
+                return self._traceData[key]
+            dtype = np.dtype(self.datatype).newbyteorder('>' if self.big_endian else '<')
+            if dtype.kind in 'ui':
+                info = np.iinfo(dtype)
+                values = np.clip(values*info.max*0.8,info.min,info.max)
+            data = values.astype(dtype).tobytes()
+            if self.header == 'ieee':
+                length = str(len(data)).encode()
+                data = b'#' + str(len(length)).encode() + length + data
+            self._traceData[key] = data
+        return self._traceData[key]
+
+
+
+class SimResource():
+    """Stand-in for a pyvisa message based resource of a SimInstrument"""
+
+    def __init__(self,instrument,address):
+        self.instrument = instrument
+        self.resource_name = address
+        self.session = id(self)
+        self.timeout = 2000
+        self.read_termination = '\n'
+        self.write_termination = '\n'
+        self.chunk_size = 20*1024
+        self.encoding = 'ascii'
+        self.baud_rate = 9600
+        self._events = set()
+        self._output = bytearray()
+        self._pending = []
+        self._messages = 0
+
+    def write(self,message,delay=True):
+        if delay:
+            self.instrument.wait(message,len(message))
+        replies = self.instrument.execute(message)
+        if replies:
+            termination = self.read_termination.encode()
+            output = bytearray()
+            if self.instrument.separator and all(isinstance(reply,str) for reply in replies):
+                output += self.instrument.separator.join(replies).encode(self.encoding) + termination
+            else:
+                for reply in replies:
+                    if isinstance(reply,str):
+                        reply = reply.encode(self.encoding)
+                    output += reply + termination
+            # answers with *OPC? arrive when the operations are complete
+            ready = self.instrument.busy_until if '*OPC?' in message.upper() else 0.0
+            if self._pending or ready > time.monotonic():
+                self._pending.append((ready,output))
+            else:
+                self._output += output
+        return len(message)
+
+    def write_raw(self,data):
+        """Several terminated messages at once (one I/O delay)"""
+        self.instrument.wait(nbytes=len(data))
+        termination = self.write_termination.encode() or b'\n'
+        for message in bytes(data).split(termination):
+            if message:
+                self.write(message.decode(self.encoding),delay=False)
+        return len(data)
+
+    @property
+    def bytes_in_buffer(self):
+        return len(self._output)
+
+    def _timeout(self):
+        raise visa.errors.VisaIOError(visa.constants.StatusCode.error_timeout)
+
+    def _arrive(self,count=1):
+        """Wait for delayed answers until count bytes are in the output;
+        raises a timeout error if they take longer than timeout"""
+        while self._pending and len(self._output) < count:
+            ready, output = self._pending[0]
+            remaining = ready - time.monotonic()
+            if remaining > 0:
+                if self.timeout is not None and remaining > self.timeout/1000:
+                    time.sleep(self.timeout/1000)
+                    self._timeout()
+                time.sleep(remaining)
+            self._output += output
+            del self._pending[0]
+
+    def read_raw(self,size=None):
+        termination = self.read_termination.encode()
+        self._arrive()
+        if not self._output:
+            self._timeout()
+        end = self._output.find(termination) if termination else -1
+        end = len(self._output) if end < 0 else end + len(termination)
+        data = bytes(self._output[:end])
+        del self._output[:end]
+        self.instrument.wait(nbytes=len(data))
+        return data
+
+    def read(self,termination=None,encoding=None):
+        data = self.read_raw().decode(encoding or self.encoding)
+        if self.read_termination and data.endswith(self.read_termination):
+            data = data[:-len(self.read_termination)]
+        return data
+
+    def read_bytes(self,count,chunk_size=None,break_on_termchar=False):
+        self._arrive(count)
+        if len(self._output) < count:
+            self._timeout()
+        data = bytes(self._output[:count])
+        del self._output[:count]
+        self.instrument.wait(nbytes=count)
+        return data
+
+    def query(self,message,delay=None):
+        self.write(message)
+        return self.read()
+
+    def read_binary_values(self,datatype='f',is_big_endian=False,container=list,header_fmt='ieee',
+                           expect_termination=True,data_points=0,chunk_size=None):
+        # the block may contain the termination, so its length is taken
+        # from the header (or data_points)
+        self._arrive()
+        if header_fmt == 'ieee':
+            offset, length = visa.util.parse_ieee_block_header(bytes(self._output[:32]))
+        else:
+            offset, length = 0, data_points*np.dtype(datatype).itemsize or len(self._output)
+        block = self.read_bytes(min(offset+length,len(self._output)))
+        termination = self.read_termination.encode()
+        if expect_termination and termination and self._output.startswith(termination):
+            del self._output[:len(termination)]
+        return visa.util.from_binary_block(block,offset,length,datatype,is_big_endian,container)
+
+    def query_binary_values(self,message,datatype='f',is_big_endian=False,container=list,delay=None,
+                            header_fmt='ieee',expect_termination=True,data_points=0,chunk_size=None):
+        self.write(message)
+        return self.read_binary_values(datatype,is_big_endian,container,header_fmt,
+                                       expect_termination,data_points,chunk_size)
+
+    def read_ascii_values(self,converter='f',separator=',',container=list):
+        return visa.util.from_ascii_block(self.read(),converter,separator,container)
+
+    def query_ascii_values(self,message,converter='f',separator=',',container=list,delay=None):
+        self.write(message)
+        return self.read_ascii_values(converter,separator,container)
+
+    @property
+    def stb(self):
+        return self.instrument.status_byte()
+
+    def enable_event(self,event,mechanism):
+        self._events.add(event)
+
+    def disable_event(self,event,mechanism):
+        self._events.discard(event)
+
+    def discard_events(self,event,mechanism):
+        pass
+
+    def wait_on_event(self,event,timeout):
+        """Service requests (the only events simulated): waits until bit
+        6 of the status byte is set, timeout in ms"""
+        if not event in self._events:
+            raise visa.errors.VisaIOError(visa.constants.StatusCode.error_not_enabled)
+        start = time.monotonic()
+        while not self.stb & 0x40:
+            if not timeout == visa.constants.VI_TMO_INFINITE and time.monotonic() - start >= timeout/1000:
+                self._timeout()
+            time.sleep(0.001)
+
+    def flush(self,mask=None):
+        self._output.clear()
+
+    def clear(self):
+        """Device clear: drops the output and the answers not sent yet"""
+        self._output.clear()
+        del self._pending[:]
+
+    def close(self):
+        self.clear()
+
+
+
+class SimResourceManager():
+    """ResourceManager handing out simulated resources
+
+        rm = SimResourceManager()
+        rm.add('TCPIP::osa::INSTR',AQ6370C,latency=0.001,datatype='d')
+        osa = AQ6370C(rm,'TCPIP::osa::INSTR')
+    """
+
+    def __init__(self):
+        self.instruments = {}
+
+    def add(self,address,cls,conffile=None,**options):
+        """Simulate an instrument of class cls at address; options see
+        SimInstrument"""
+        self.instruments[address] = SimInstrument(cls,conffile,**options)
+        return self.instruments[address]
+
+    def list_resources(self,query='?*::INSTR'):
+        return tuple(self.instruments)
+
+    def open_resource(self,address,**kwargs):
+        if not address in self.instruments:
+            raise visa.errors.VisaIOError(visa.constants.StatusCode.error_resource_not_found)
+        resource = SimResource(self.instruments[address],address)
+        for name, value in kwargs.items():
+            setattr(resource,name,value)
+        return resource
+
+    def close(self):
+        pass
@@ -0,0 +1,216 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+continuous acquisition of binary traces into a preallocated ring buffer
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import collections
+import threading
+import time
+import numpy as np
+
+
+
+class TraceStream():
+    """Acquires a trace of an instrument continuously in a background
+    thread (trigger, wait until ready, fetch) and hands the traces to
+    the consumer through a ring buffer of depth preallocated arrays
+
+        stream = TraceStream(osa,'data',trigger=osa.start_sweep)
+        with stream:
+            for data in stream:
+                ...
+
+    The arrays handed out are views into the ring buffer and stay valid
+    until the next trace is requested (copy=True hands out copies).
+
+    trigger: function called before every acquisition (None: the fetch
+    itself waits for new data, e.g. CURVENEXT); wait: call
+    wait_until_ready(timeout) after the trigger; block: when the buffer is
+    full the acquisition waits for the consumer, otherwise the oldest
+    unread trace is overwritten and counted in dropped; count: stop after
+    this many acquisitions (None: run until stop()); points, dtype: of
+    the ring buffer, allocated at start() if both are given, otherwise
+    at the first trace with its length and dtype
+    """
+
+    def __init__(self,instrument,trace,depth=16,points=None,dtype=None,
+                 trigger=None,wait=True,timeout=10.0,block=True,copy=False,count=None):
+
+        if depth < 2:
+            raise AttributeError('Tried to set depth: {}; allowed only values >= 2'.format(depth))
+
+        self.instrument = instrument
+        self.trace = trace
+        self.depth = depth
+        self.trigger = trigger
+        self.wait = wait
+        self.timeout = timeout
+        self.block = block
+        self.copy = copy
+        self.count = count
+
+        self.acquired = 0
+        self.dropped = 0
+        self.timestamp = None
+
+        self._points = points
+        self._dtype = dtype
+        self._buffer = None
+        self._timestamps = np.zeros(depth)
+        self._free = collections.deque(range(depth))
+        self._filled = collections.deque()
+        self._held = None
+        self._error = None
+        self._running = False
+        self._thread = None
+        self._condition = threading.Condition()
+
+    @property
+    def buffer(self):
+        """The ring buffer, shape (depth, points)"""
+        return self._buffer
+
+    def _allocate(self,points,dtype):
+        self._buffer = np.empty((self.depth,points),dtype=dtype)
+
+    def _acquire(self,slot):
+        """Trigger, wait and fetch one trace into slot of the ring buffer"""
+
+        if self.trigger is not None:
+            self.trigger()
+            if self.wait and not self.instrument.wait_until_ready(self.timeout):
+                raise AttributeError('Instrument not ready after {} s'.format(self.timeout))
+
+        if self._buffer is not None and hasattr(self.instrument,'read_trace_into'):
+            # read straight into the ring buffer
+            data = self.instrument.read_trace_into(self.trace,out=self._buffer[slot])
+        else:
+            data = np.asarray(getattr(self.instrument,self.trace))
+            if self._buffer is None:
+                self._allocate(self._points or len(data),self._dtype or data.dtype)
+            if data.shape == self._buffer.shape[1:]:
+                self._buffer[slot] = data
+        if not data.shape == self._buffer.shape[1:]:
+            msg = 'Trace {} has shape {}; expected: {}'.format(self.trace,data.shape,self._buffer.shape[1:])
+            raise AttributeError(msg)
+        self._timestamps[slot] = time.time()
+
+    def start(self):
+        """Start the background acquisition"""
+
+        if self._running:
+            return
+        if self._buffer is None and self._points is not None and self._dtype is not None:
+            self._allocate(self._points,self._dtype)
+        self._error = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run,name='TraceStream {}'.format(self.trace),daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background acquisition; unread traces stay readable"""
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None and not self._thread is threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        try:
+            while self.count is None or self.acquired < self.count:
+                with self._condition:
+                    while self.block and not self._free and self._running:
+                        self._condition.wait()
+                    if not self._running:
+                        break
+                    if self._free:
+                        slot = self._free.popleft()
+                    else:
+                        slot = self._filled.popleft()
+                        self.dropped += 1
+
+                try:
+                    self._acquire(slot)
+                except BaseException:
+                    with self._condition:
+                        self._free.append(slot)
+                    raise
+
+                with self._condition:
+                    self._filled.append(slot)
+                    self.acquired += 1
+                    self._condition.notify_all()
+        except BaseException as error:
+            self._error = error
+        finally:
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+
+    def _release(self):
+        """Give the slot handed out last back to the acquisition; called
+        with the condition held"""
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+            self._condition.notify_all()
+
+    def read(self,timeout=None):
+        """Returns (timestamp, data) of the oldest unread trace; raises
+        StopIteration when the acquisition ended and everything was read"""
+
+        with self._condition:
+            self._release()
+            start = time.monotonic()
+            while not self._filled:
+                if self._error is not None:
+                    error, self._error = self._error, None
+                    raise error
+                if not self._running:
+                    raise StopIteration
+                if timeout is not None:
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        raise AttributeError('No trace within {} s'.format(timeout))
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+
+            slot = self._filled.popleft()
+            self.timestamp = self._timestamps[slot]
+            if self.copy:
+                self._free.append(slot)
+                self._condition.notify_all()
+                return self.timestamp, self._buffer[slot].copy()
+            self._held = slot
+            return self.timestamp, self._buffer[slot]
+
+    def items(self):
+        """Generator of (timestamp, data)"""
+        while True:
+            try:
+                yield self.read()
+            except StopIteration:
+                return
+
+    def __iter__(self):
+        for _, data in self.items():
+            yield data
+
+    def __len__(self):
+        """Number of unread traces"""
+        return len(self._filled)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
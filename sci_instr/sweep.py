@@ -0,0 +1,232 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+declarative sweeps of instrument properties with acquisitions per step
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import time
+import numpy as np
+
+from sci_instr.asynchronous import resource_executor
+
+
+
+def snake_order(shape):
+    """Indices of all points of a grid of shape where every axis runs back
+    and forth instead of jumping back to its start, so from one point to
+    the next only one index changes by one"""
+
+    directions = [1]*len(shape)
+
+    def walk(axis):
+        if axis == len(shape):
+            yield ()
+            return
+        indices = range(shape[axis]) if directions[axis] > 0 else range(shape[axis]-1,-1,-1)
+        for index in indices:
+            for rest in walk(axis+1):
+                yield (index,) + rest
+        directions[axis] = -directions[axis]
+
+    return walk(0)
+
+
+
+class Sweep():
+    """Sets the properties of axes to all combinations of their values and
+    acquires properties or traces at every point into preallocated arrays
+
+        sweep = Sweep([(laser,'wavelength',np.linspace(1540,1560,21)),
+                       (laser,'power',[1,2,5],0.5)],
+                      [(osa,'data','start_sweep'),(pm,'power')])
+        data = sweep.run()          # data['data'].shape == (21,3,points)
+
+    axes: (instrument, property, values[, settle s]), the first axis is
+    the outermost; acquisitions: (instrument, property or trace[,
+    trigger]) or a dict label: (...) (default label: the name); trigger
+    is a method (or its name) that starts a measurement, after which the
+    instrument is waited for with wait_until_ready(timeout).
+
+    Commands are ordered to save settling and round trips: snake
+    ordering (only one axis value changes per step), sets of unchanged
+    values are skipped, several changed properties of one instrument are
+    set with one set_many, untriggered properties of one instrument are
+    read with one get_many, and triggers of all instruments are sent
+    before waiting for any. With overlap the data of triggered
+    acquisitions is fetched on the worker thread of the instrument (see
+    asynchronous.resource_executor) while the next point is set and
+    settles; commands to that instrument wait for the fetch.
+    """
+
+    def __init__(self,axes,acquisitions,settle=0.0,snake=True,skip_unchanged=True,
+                 overlap=True,wait=True,timeout=10.0):
+
+        self.axes = []
+        for axis in axes:
+            instrument, prop, values = axis[:3]
+            if not prop in instrument._rwCommands:
+                raise AttributeError('{} has no read write property {}'.format(type(instrument).__name__,prop))
+            self.axes.append((instrument,prop,list(values),axis[3] if len(axis) > 3 else 0.0))
+
+        if not isinstance(acquisitions,dict):
+            labels = [acquisition[1] for acquisition in acquisitions]
+            if not len(set(labels)) == len(labels):
+                raise AttributeError('Acquisitions with the same name need labels (use a dict)')
+            acquisitions = dict(zip(labels,acquisitions))
+        self.acquisitions = {}
+        for label, acquisition in acquisitions.items():
+            instrument, name = acquisition[:2]
+            trigger = acquisition[2] if len(acquisition) > 2 else None
+            if isinstance(trigger,str):
+                trigger = getattr(instrument,trigger)
+            self.acquisitions[label] = (instrument,name,trigger)
+
+        self.settle = settle
+        self.snake = snake
+        self.skip_unchanged = skip_unchanged
+        self.overlap = overlap
+        self.wait = wait
+        self.timeout = timeout
+
+        self.shape = tuple(len(values) for _,_,values,_ in self.axes)
+        self.data = {}
+        self.x = {}
+        self.timestamps = None
+        self._last = {}
+        self._pending = {}
+
+    @property
+    def values(self):
+        """The values of the axes"""
+        return [values for _,_,values,_ in self.axes]
+
+    def order(self):
+        """Indices of the points in the order they are measured"""
+        if self.snake:
+            return snake_order(self.shape)
+        return np.ndindex(*self.shape)
+
+    def _join(self,instrument):
+        """Wait for the fetches running on the worker thread of instrument"""
+        for future in self._pending.pop(id(instrument),()):
+            future.result()
+
+    def _join_all(self):
+        while self._pending:
+            futures = self._pending.popitem()[1]
+            for future in futures:
+                future.result()
+
+    def _set_point(self,index):
+        """Set the changed axis values of index; returns the settle time"""
+
+        changes = {}
+        settle = 0.0
+        for axis, (instrument, prop, values, axis_settle) in zip(index,self.axes):
+            key = (id(instrument),prop)
+            value = values[axis]
+            if self.skip_unchanged and key in self._last and self._last[key] == value:
+                continue
+            self._last[key] = value
+            changes.setdefault(id(instrument),(instrument,{}))[1][prop] = value
+            settle = max(settle,axis_settle)
+
+        for instrument, values in changes.values():
+            self._join(instrument)
+            if len(values) > 1:
+                instrument.set_many(values)
+            else:
+                for prop, value in values.items():
+                    setattr(instrument,prop,value)
+        return max(settle,self.settle) if changes else 0.0
+
+    def _store(self,label,index,value):
+        if not label in self.data:
+            if isinstance(value,(int,float)):
+                self.data[label] = np.full(self.shape,np.nan)
+            else:
+                self.data[label] = np.empty(self.shape,dtype=object)
+        self.data[label][index] = value
+
+    def _fetch(self,label,index):
+        """Read a trace or property of an acquisition into the results"""
+
+        instrument, name, _ = self.acquisitions[label]
+        if not name in instrument._traceCommands:
+            self._store(label,index,getattr(instrument,name))
+        elif label in self.data:
+            instrument.get_trace(name,out=self.data[label][index])
+        else:
+            trace = instrument.get_trace(name)
+            # unscaled integer traces are stored as float, for the nan of missing points
+            dtype = trace.data.dtype if trace.data.dtype.kind in 'fc' else np.float64
+            self.data[label] = np.full(self.shape + trace.data.shape,np.nan,dtype=dtype)
+            self.data[label][index] = trace.data
+            self.x[label] = trace.x
+
+    def _acquire(self,index):
+        # read untriggered properties, grouped per instrument
+        groups = {}
+        for label, (instrument, name, trigger) in self.acquisitions.items():
+            if trigger is None and not name in instrument._traceCommands:
+                groups.setdefault(id(instrument),(instrument,[]))[1].append(label)
+        for instrument, labels in groups.values():
+            self._join(instrument)
+            names = [self.acquisitions[label][1] for label in labels]
+            if len(names) > 1 and all(name in instrument._rwCommands for name in names):
+                values = instrument.get_many(names,cached=False)
+                for label, name in zip(labels,names):
+                    self._store(label,index,values[name])
+            else:
+                for label in labels:
+                    self._fetch(label,index)
+
+        # start all triggered measurements, then wait for them
+        triggered = []
+        for instrument, name, trigger in self.acquisitions.values():
+            if trigger is not None and not any(trigger == other for _,other in triggered):
+                self._join(instrument)
+                trigger()
+                triggered.append((instrument,trigger))
+        if self.wait:
+            for instrument in dict((id(instrument),instrument) for instrument,_ in triggered).values():
+                if not instrument.wait_until_ready(self.timeout):
+                    raise AttributeError('{} not ready after {} s'.format(type(instrument).__name__,self.timeout))
+
+        for label, (instrument, name, trigger) in self.acquisitions.items():
+            if trigger is None and not name in instrument._traceCommands:
+                continue
+            if trigger is not None and self.overlap:
+                future = resource_executor(instrument).submit(self._fetch,label,index)
+                self._pending.setdefault(id(instrument),[]).append(future)
+            else:
+                self._join(instrument)
+                self._fetch(label,index)
+
+    def run(self,callback=None):
+        """Measure all points; returns the dict label: array of shape
+        (axes shape) for properties or (axes shape, points) for traces
+
+        callback(sweep, index) is called after every point (fetches of
+        triggered acquisitions may still be running)."""
+
+        self.data = {}
+        self.x = {}
+        self.timestamps = np.full(self.shape,np.nan)
+        self._last = {}
+        try:
+            for index in self.order():
+                settle = self._set_point(index)
+                if settle:
+                    time.sleep(settle)
+                self._acquire(index)
+                self.timestamps[index] = time.time()
+                if callback is not None:
+                    callback(self,index)
+        finally:
+            self._join_all()
+        return self.data
@@ -0,0 +1,176 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+background polling of slow scalar instruments (power meters, sensors,
+supplies) into a store of the latest values
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import collections
+import threading
+import time
+
+
+
+class _Channel():
+    """Schedule and history of one polled property"""
+
+    def __init__(self,name,instrument,prop,period,history):
+        self.name = name
+        self.instrument = instrument
+        self.prop = prop
+        self.period = period
+        self.due = 0.0
+        self.missed = 0
+        self.history = collections.deque(maxlen=history) if history else None
+
+
+
+class TelemetryPoller():
+    """Polls properties of instruments at their own rates in background
+    threads (one per instrument, so instruments are read concurrently)
+    and keeps the latest value of every channel with its timestamp
+
+        poller = TelemetryPoller()
+        poller.add(pm,'power',rate=10,label='pm1')
+        poller.add(tsp,['temperature','humidity'],rate=1,label='tsp')
+        poller.add(psu,['volt','current'],rate=2,label='psu',history=3600)
+        with poller:
+            timestamp, power = poller.latest('pm1.power')
+
+    The properties of an instrument that are due within window s of
+    each other are read together with one get_many(cached=False), which
+    joins them to one compound query and queries properties sharing a
+    command only once. Readers never wait for bus I/O: the latest values
+    are a dict of (timestamp, value) tuples that is replaced entry by
+    entry. Polls that are more than a period late are skipped and
+    counted in missed; errors are kept in errors and polling goes on.
+    """
+
+    def __init__(self,window=0.01):
+        self.window = window
+        self.values = {}
+        self.errors = {}
+        self._channels = {}
+        self._instruments = {}
+        self._historyLock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def add(self,instrument,props,rate=1.0,label=None,history=0):
+        """Poll props (name or list) of instrument rate times per second;
+        the channels are named label.prop (label defaults to the VISA
+        resource name); history: number of (timestamp, value) kept per
+        channel. Returns the channel names."""
+
+        if rate <= 0:
+            raise AttributeError('Tried to set rate: {}; allowed only values > 0'.format(rate))
+        if isinstance(props,str):
+            props = [props]
+        if label is None:
+            label = getattr(instrument,'_resourceKey',None) or str(id(instrument))
+
+        names = []
+        for prop in props:
+            name = '{}.{}'.format(label,prop)
+            if name in self._channels:
+                raise AttributeError('Channel {} already exists'.format(name))
+            channel = _Channel(name,instrument,prop,1.0/rate,history)
+            self._channels[name] = channel
+            self._instruments.setdefault(id(instrument),(instrument,[]))[1].append(channel)
+            names.append(name)
+        return names
+
+    @property
+    def channels(self):
+        return list(self._channels)
+
+    def latest(self,name):
+        """(timestamp, value) of the last poll of channel name, or (None,
+        None) before the first"""
+        return self.values.get(name,(None,None))
+
+    def value(self,name):
+        """Last value of channel name"""
+        return self.latest(name)[1]
+
+    def history(self,name):
+        """List of (timestamp, value) of channel name"""
+        channel = self._channels[name]
+        if channel.history is None:
+            raise AttributeError('No history kept for channel ' + name)
+        with self._historyLock:
+            return list(channel.history)
+
+    def missed(self,name):
+        return self._channels[name].missed
+
+    def poll(self,instrument,channels):
+        """Read channels of instrument now and store the values"""
+
+        props = list(dict.fromkeys(channel.prop for channel in channels))
+        try:
+            if hasattr(instrument,'get_many'):
+                values = instrument.get_many(props,cached=False)
+            else:
+                values = dict((prop,getattr(instrument,prop)) for prop in props)
+        except Exception as error:
+            for channel in channels:
+                self.errors[channel.name] = (time.time(),error)
+            return
+        timestamp = time.time()
+        for channel in channels:
+            entry = (timestamp,values[channel.prop])
+            self.values[channel.name] = entry
+            if channel.history is not None:
+                with self._historyLock:
+                    channel.history.append(entry)
+
+    def _run(self,instrument,channels):
+        now = time.monotonic()
+        for channel in channels:
+            channel.due = now
+        while not self._stop.is_set():
+            now = time.monotonic()
+            first = min(channel.due for channel in channels)
+            if first > now:
+                self._stop.wait(first - now)
+                continue
+
+            due = [channel for channel in channels if channel.due <= now + self.window]
+            self.poll(instrument,due)
+
+            now = time.monotonic()
+            for channel in due:
+                channel.due += channel.period
+                if channel.due < now:
+                    skipped = int((now - channel.due)/channel.period) + 1
+                    channel.missed += skipped
+                    channel.due += skipped*channel.period
+
+    def start(self):
+        """Start one polling thread per instrument"""
+        if self._threads:
+            return
+        self._stop.clear()
+        for instrument, channels in self._instruments.values():
+            thread = threading.Thread(target=self._run,args=(instrument,channels),daemon=True,
+                                      name='TelemetryPoller {}'.format(channels[0].name))
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self,*exc):
+        self.stop()
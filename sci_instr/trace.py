@@ -0,0 +1,115 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+trace data with its x axis, units and settings
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import functools
+import numpy as np
+
+
+
+@functools.lru_cache(maxsize=64)
+def make_axis(start,step,points):
+    """Returns the read only axis start + step*i for i < points; axes are
+    kept per (start, step, points) so repeated captures with the same
+    settings share one array. Computed from the index, so there is no
+    accumulated error as with np.arange(start,stop,step)."""
+
+    axis = start + step*np.arange(points)
+    axis.flags.writeable = False
+    return axis
+
+
+
+def axis_parameters(settings,points):
+    """(start, step, points) of the axis described by the x_ options in
+    settings, or None if they do not define an axis
+
+    x_step (with x_start or 0), x_start and x_stop, x_start and x_span,
+    or x_position at x_reference percent (default 50) of x_span;
+    x_endpoint (default True) tells whether stop is the last point"""
+
+    if points is None:
+        return None
+    points = int(points)
+    intervals = max(points - 1 if settings.get('x_endpoint',True) else points,1)
+
+    start = settings.get('x_start')
+    span = settings.get('x_span')
+    if start is None and settings.get('x_position') is not None and span is not None:
+        start = settings['x_position'] - settings.get('x_reference',50)/100*span
+
+    if settings.get('x_step') is not None:
+        step = settings['x_step']
+        start = 0 if start is None else start
+    elif settings.get('x_stop') is not None and start is not None:
+        step = (settings['x_stop'] - start)/intervals
+    elif span is not None and start is not None:
+        step = span/intervals
+    else:
+        return None
+    return (float(start),float(step),points)
+
+
+
+def scaling_parameters(settings):
+    """(scale, offset) of the y_ options in settings, the values being
+    data*scale + offset; either is None if not given
+
+    y_position (in digitizing levels, as the raw data) is subtracted
+    before scaling, so it is folded into the offset"""
+
+    scale = settings.get('y_scale')
+    offset = settings.get('y_offset')
+    if settings.get('y_position'):
+        offset = (offset or 0) - settings['y_position']*(1 if scale is None else scale)
+    return scale, offset
+
+
+
+class Trace():
+    """Data of a trace together with its x axis, units and the settings
+    it was acquired with
+
+    data: numpy array (one trace or 2-D: one trace per row); axis:
+    (start, step, points) the x axis is computed from on first use of x
+    """
+
+    def __init__(self,data,axis=None,x=None,x_unit='',y_unit='',metadata=None):
+        self.data = data
+        self.axis = axis
+        self._x = x
+        self.x_unit = x_unit
+        self.y_unit = y_unit
+        self.metadata = metadata if metadata is not None else {}
+
+    @property
+    def x(self):
+        """x axis (shared by all rows of 2-D data)"""
+        if self._x is None and self.axis is not None:
+            self._x = make_axis(*self.axis)
+        return self._x
+
+    @property
+    def y(self):
+        return self.data
+
+    def __len__(self):
+        return self.data.shape[-1]
+
+    def __array__(self,dtype=None,copy=None):
+        if dtype is None:
+            return np.asarray(self.data)
+        return np.asarray(self.data,dtype=dtype)
+
+    def __iter__(self):
+        """Allows x, y = trace"""
+        return iter((self.x,self.data))
+
+    def __repr__(self):
+        return 'Trace(shape={}, x_unit={!r}, y_unit={!r})'.format(self.data.shape,self.x_unit,self.y_unit)
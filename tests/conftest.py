@@ -0,0 +1,35 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+fixtures of the tests: simulated instruments (sci_instr.sim)
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import pytest
+
+from sci_instr.sim import SimResourceManager
+
+
+
+@pytest.fixture
+def rm():
+    return SimResourceManager()
+
+
+@pytest.fixture
+def messages():
+    """messages(sim) returns the list the messages received by the
+    simulated instrument sim are appended to"""
+
+    def record(sim):
+        received = []
+        execute = sim.execute
+        def recording(message):
+            received.append(message)
+            return execute(message)
+        sim.execute = recording
+        return received
+    return record
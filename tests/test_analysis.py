@@ -0,0 +1,90 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the spectrum analysis on synthetic spectra
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import numpy as np
+import pytest
+
+from sci_instr import analysis
+from sci_instr.trace import Trace
+
+
+
+# gaussian modes in dBm on a -60 dBm floor: main mode of width 0.2 nm
+# (FWHM of the linear power) and a side mode 30 dB below it
+X = np.linspace(1540e-9,1560e-9,4001)
+CENTERS = np.array([1549e-9,1550e-9,1551.2e-9])
+WIDTH = 0.2e-9
+
+
+def spectrum(center):
+    power = (np.exp(-4*np.log(2)*((X - center)/WIDTH)**2)
+             + 1e-3*np.exp(-4*np.log(2)*((X - center - 2e-9)/WIDTH)**2) + 1e-6)
+    return 10*np.log10(power)
+
+
+@pytest.fixture
+def spectra():
+    return np.array([spectrum(center) for center in CENTERS])
+
+
+def test_peak_and_centroid(spectra):
+    x, level = analysis.peak(spectra,X,interpolate=True)
+    assert x == pytest.approx(CENTERS,abs=1e-13) and level == pytest.approx(0,abs=1e-3)
+    x, level = analysis.peak(spectra[1],X)
+    assert x == pytest.approx(1550e-9) and level == pytest.approx(0,abs=1e-4)
+    assert analysis.centroid(spectra,X,threshold=20) == pytest.approx(CENTERS,abs=1e-12)
+
+
+def test_fwhm(spectra):
+    # width of a gaussian at 3 dB below its maximum
+    expected = WIDTH*np.sqrt(0.3*np.log(10)/np.log(2))
+    width, center = analysis.fwhm(spectra,X,fast=False)
+    assert width == pytest.approx(expected,rel=1e-3) and center == pytest.approx(CENTERS,abs=1e-13)
+    width, center = analysis.fwhm(Trace(spectra[0],x=X,y_unit='dBm'),fast=False)
+    assert width == pytest.approx(expected,rel=1e-3) and center == pytest.approx(CENTERS[0],abs=1e-13)
+    # linear traces: half of the maximum
+    width, _ = analysis.fwhm(10**(spectra/10),X,level=10*np.log10(2),db=False,fast=False)
+    assert width == pytest.approx(WIDTH,rel=1e-3)
+    # edge outside the trace
+    assert np.isnan(analysis.fwhm(spectra[1][:2000],X[:2000],fast=False)[0])
+
+
+def test_fast_edge_search(spectra):
+    peaks = spectra.argmax(axis=1)
+    thresholds = spectra.max(axis=1) - 3
+    left, right = np.empty(3), np.empty(3)
+    # the loop compiled by numba, run as python
+    analysis._edges_loop(spectra,peaks,thresholds,left,right)
+    expected = analysis._edges_numpy(spectra,peaks,thresholds)
+    assert np.allclose(left,expected[0]) and np.allclose(right,expected[1])
+
+    try:
+        import numba
+    except ImportError:
+        with pytest.raises(AttributeError):
+            analysis.fwhm(spectra,X,fast=True)
+        assert np.allclose(analysis.fwhm(spectra,X)[0],analysis.fwhm(spectra,X,fast=False)[0])
+        return
+    assert np.allclose(analysis.fwhm(spectra,X,fast=True),analysis.fwhm(spectra,X,fast=False))
+
+
+def test_smsr_band_power_noise_floor(spectra):
+    assert analysis.smsr(spectra,X) == pytest.approx(30,abs=0.01)
+    assert analysis.smsr(spectra,X,exclude=1e-9) == pytest.approx(30,abs=0.01)
+    assert np.isnan(analysis.smsr(spectrum(1550e-9)[:2100],X[:2100]))
+
+    total = analysis.band_power(spectra,X)
+    assert total == pytest.approx(10*np.log10((10**(spectra/10)).sum(axis=1)))
+    main = analysis.band_power(spectra[1],X,start=1549e-9,stop=1551e-9)
+    assert main < total[1] and main == pytest.approx(total[1],abs=0.01)
+    assert analysis.noise_floor(spectra,X) == pytest.approx(-60,abs=0.01)
+
+    with pytest.raises(AttributeError):
+        analysis.peak(spectra,X[:10])
@@ -0,0 +1,61 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the asyncio front-end on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import asyncio
+import time
+
+from sci_instr.asynchronous import AsyncInstrument, snapshot
+from sci_instr.misc import TL_PM100
+from sci_instr.osa import AQ6370C
+
+
+
+def test_commands_in_order_per_resource(rm,messages):
+    sim = rm.add('SIM::pm::INSTR',TL_PM100,latency=0.001)
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    pm.verify_mode = 'never'
+    received = messages(sim)
+    first, second = AsyncInstrument(pm), AsyncInstrument(pm)
+    assert first._executor is second._executor
+
+    async def sweep():
+        await asyncio.gather(*[(first if wavelength % 2 else second).set('wavelength',wavelength)
+                               for wavelength in range(1300,1310)])
+        return await first.get('wavelength')
+    assert asyncio.run(sweep()) == 1309.0
+    sets = [message.split()[-1] for message in received if message.startswith('CORR:WAV ')]
+    assert sets == [str(wavelength) for wavelength in range(1300,1310)]
+
+
+def test_instruments_run_concurrently(rm):
+    rack = {}
+    for name in ('pm1','pm2','pm3'):
+        rm.add('SIM::{}::INSTR'.format(name),TL_PM100,latency=0.05)
+        rack[name] = (TL_PM100(rm,'SIM::{}::INSTR'.format(name)),['power','wavelength'])
+
+    start = time.monotonic()
+    values = asyncio.run(snapshot(rack))
+    # one query (write and read: 0.1 s) per instrument, not three in a row
+    assert time.monotonic() - start < 0.25
+    assert values['pm2'] == {'power':0.0,'wavelength':0.0}
+    assert values['_time'][0] <= values['_time'][1]
+
+
+def test_async_twins(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.05})
+    osa = AsyncInstrument(AQ6370C(rm,'SIM::osa::INSTR'))
+
+    async def measure():
+        await osa.set_many({'centerwl':1.55e-6,'span':10e-9})
+        await osa.async_start_sweep()
+        await osa.call('wait_until_ready',2)
+        return await osa.async_data, await osa.get_many(['centerwl'])
+    data, values = asyncio.run(measure())
+    assert len(data) == 1001 and values == {'centerwl':1.55e-6}
@@ -0,0 +1,78 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the multi-process fleet on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import numpy as np
+import pytest
+
+from sci_instr.fleet import Fleet
+from sci_instr.misc import TL_PM100
+from sci_instr.osa import AQ6370C
+from sci_instr.sim import SimResourceManager
+
+
+
+def simulated_rack():
+    """ResourceManager of the worker processes (picklable by name)"""
+    rm = SimResourceManager()
+    rm.add('SIM::osa::INSTR',AQ6370C)
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    return rm
+
+
+@pytest.fixture(scope='module')
+def fleet():
+    with Fleet(workers=2,resource_manager=simulated_rack) as fleet:
+        fleet.add('osa','SIM::osa::INSTR',AQ6370C)
+        fleet.add('pm','SIM::pm::INSTR',TL_PM100)
+        yield fleet
+
+
+def test_proxies(fleet):
+    osa, pm = fleet['osa'], fleet['pm']
+    assert 'osa' in fleet and not 'scope' in fleet
+    with pytest.raises(AttributeError):
+        fleet.add('osa','SIM::osa::INSTR',AQ6370C)
+
+    osa.centerwl = 1.55e-6
+    assert osa.centerwl == 1.55e-6
+    assert pm.get_many(['wavelength','range']) == {'wavelength':0.0,'range':0.0}
+    with pytest.raises(AttributeError):
+        osa.startwl = 100e-9
+    with pytest.raises(AttributeError):
+        osa.name = 'read only'
+    with pytest.raises(AttributeError):
+        osa.unknown
+
+
+def test_traces_through_shared_memory(fleet):
+    osa = fleet['osa']
+    data = osa.data
+    assert isinstance(data,np.ndarray) and data.shape == (1001,)
+    trace = osa.get_trace('data')
+    assert np.array_equal(trace.data,data) and len(trace.x) == 1001
+    spectra = fleet.gather([lambda: osa.data,lambda: fleet['pm'].power])
+    assert np.array_equal(spectra[0],data)
+
+
+def test_traces_match_the_parent_process(fleet):
+    osa = fleet['osa']
+    osa.points = 1001
+    local = AQ6370C(simulated_rack(),'SIM::osa::INSTR')
+    assert np.array_equal(osa.data,local.data)
+
+
+def test_replaced_blocks_are_released(fleet):
+    osa = fleet['osa']
+    handle = fleet._workers[[number for number,worker in enumerate(fleet._workers)
+                             if worker is not None and 'osa' in worker.names][0]]
+    for points in (1001,5001,20001):
+        osa.points = points
+        assert osa.data.shape == (points,)
+        assert len(handle.shared) == 1
@@ -0,0 +1,369 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the generic Instrument on simulated instruments: batched
+access, verification, cache, snapshots, transfer formats and traces
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import os
+import threading
+import time
+import numpy as np
+import pytest
+
+import sci_instr.generic
+from sci_instr.generic import choose_encoding, compile_instrument, load_definition, set_definition_cache
+from sci_instr.misc import TL_PM100
+from sci_instr.osa import AQ6370C
+from sci_instr.oscilloscope import RS_RTO1044, Tktx_DP7254
+from sci_instr.rfsa import SSA3000X
+
+
+
+@pytest.fixture
+def osa(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C)
+    return AQ6370C(rm,'SIM::osa::INSTR')
+
+
+def test_get_many_one_message(rm,osa,messages):
+    received = messages(rm.instruments['SIM::osa::INSTR'])
+    osa.set_many({'centerwl':1.55e-6,'span':10e-9})
+    del received[:]
+    values = osa.get_many(['centerwl','span','bandwidth'])
+    assert values == {'centerwl':1.55e-6,'span':10e-9,'bandwidth':0.0}
+    assert len(received) == 1
+
+
+def test_set_many_one_message(rm,osa,messages):
+    received = messages(rm.instruments['SIM::osa::INSTR'])
+    osa.verify_mode = 'never'
+    osa.set_many({'centerwl':1.55e-6,'span':10e-9})
+    assert len(received) == 1
+    assert rm.instruments['SIM::osa::INSTR'].state['span'] == '1e-08'
+
+
+def test_set_checks_limits(osa):
+    with pytest.raises(AttributeError):
+        osa.startwl = 100e-9
+    with pytest.raises(AttributeError):
+        osa.set_many({'centerwl':1.55e-6,'sweepmode':5})
+
+
+def test_deferred_verification(rm,osa):
+    osa.verify_mode = 'deferred'
+    osa.centerwl = 1.55e-6
+    rm.instruments['SIM::osa::INSTR'].state['centerwl'] = '1.5e-06'
+    with pytest.raises(AttributeError):
+        osa.verify_pending()
+    osa.verify_pending()
+
+
+def test_cache_and_invalidation(rm,osa,messages):
+    received = messages(rm.instruments['SIM::osa::INSTR'])
+    osa.enable_cache()
+    osa.centerwl = 1.55e-6
+    del received[:]
+    assert osa.centerwl == 1.55e-6
+    assert osa.get_many(['centerwl']) == {'centerwl':1.55e-6}
+    assert received == []
+
+    # a set drops the other entries (span and center are coupled)
+    osa.span = 5e-9
+    del received[:]
+    osa.get_many(['centerwl','span'])
+    assert len(received) == 1 and 'CENT?' in received[0] and not 'SPAN?' in received[0]
+
+    # commands unknown to the cache
+    osa.start_sweep()
+    del received[:]
+    osa.span
+    assert len(received) == 1
+
+
+def test_cache_ttl_and_volatile(rm):
+    rm.add('SIM::ssa::INSTR',SSA3000X,header='empty',values={'points':101})
+    ssa = SSA3000X(rm,'SIM::ssa::INSTR')
+    ssa.enable_cache(ttl=0)
+    ssa.center
+    rm.instruments['SIM::ssa::INSTR'].state['center'] = '1000'
+    assert ssa.center == 1000.0
+    ssa.enable_cache()
+    ssa.markerX
+    rm.instruments['SIM::ssa::INSTR'].state['markerX'] = '5'
+    assert ssa.markerX == 5.0
+
+
+def test_definitions_compiled_once_per_class(rm):
+    rm.add('SIM::pm1::INSTR',TL_PM100)
+    rm.add('SIM::pm2::INSTR',TL_PM100)
+    first = TL_PM100(rm,'SIM::pm1::INSTR')
+    second = TL_PM100(rm,'SIM::pm2::INSTR')
+    assert type(first) is type(second) is compile_instrument(TL_PM100,TL_PM100._conffile)
+    assert isinstance(first,TL_PM100) and type(first).__name__ == 'TL_PM100'
+    # the properties live on the compiled subclass, not on the driver
+    assert 'power' in type(first).__dict__ and not 'power' in TL_PM100.__dict__
+
+
+def test_conffile_argument(rm):
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    # conffile as argument of the class instantiated
+    sensor = TL_PM100(rm,'SIM::pm::INSTR',conffile=os.path.join('Misc','TL_TSP01.yaml'))
+    assert 'humidity' in type(sensor).__dict__ and not 'power' in type(sensor).__dict__
+
+    # a subclass passing it on would get the properties of its _conffile
+    class Meter(sci_instr.generic.Instrument):
+        def __init__(self,visa_rm,address):
+            super(Meter,self).__init__(visa_rm,address,conffile=TL_PM100._conffile)
+    with pytest.raises(AttributeError):
+        Meter(rm,'SIM::pm::INSTR')
+
+
+def test_definition_cache_on_disk(tmp_path,monkeypatch):
+    conffile = tmp_path/'meter.yaml'
+    conffile.write_text("readWriteProps:\n    wavelength: 'CORR:WAV'\n")
+    monkeypatch.setattr(sci_instr.generic,'_definitionCache',None)
+    monkeypatch.setattr(sci_instr.generic,'_definitions',{})
+    set_definition_cache(str(tmp_path/'cache'))
+    definition = load_definition(str(conffile))
+    assert list(definition['readWriteProps']) == ['wavelength']
+    assert len(os.listdir(str(tmp_path/'cache'))) == 1
+
+    # a new process takes the pickle and does not check the yaml again
+    def check_definition(cfg,name=''):
+        raise AssertionError('parsed again')
+    monkeypatch.setattr(sci_instr.generic,'_definitions',{})
+    monkeypatch.setattr(sci_instr.generic,'check_definition',check_definition)
+    assert load_definition(str(conffile)) == definition
+
+    # a modified file is parsed again
+    monkeypatch.undo()
+    monkeypatch.setattr(sci_instr.generic,'_definitionCache',str(tmp_path/'cache'))
+    monkeypatch.setattr(sci_instr.generic,'_definitions',{})
+    conffile.write_text("readWriteProps:\n    range: 'SENS:POW:RANG:UPP'\n")
+    stat = os.stat(str(conffile))
+    os.utime(str(conffile),ns=(stat.st_atime_ns,stat.st_mtime_ns + 10**9))
+    assert list(load_definition(str(conffile))['readWriteProps']) == ['range']
+
+
+def test_wait_until_ready_poll(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.2})
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    osa.start_sweep()
+    assert not osa.is_ready()
+    assert not osa.wait_until_ready(timeout=0.05,strategy='poll')
+    assert osa.wait_until_ready(timeout=2,strategy='poll')
+    assert osa.is_ready()
+
+
+def test_wait_until_ready_opc(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.2})
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    osa.start_sweep()
+    start = time.monotonic()
+    assert osa.wait_until_ready(timeout=2,strategy='opc')
+    assert osa.is_ready() and time.monotonic() - start > 0.1
+    with pytest.raises(AttributeError):
+        osa.wait_until_ready(strategy='sleep')
+
+
+def test_wait_until_ready_opc_timeout(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.2})
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    osa.start_sweep()
+    start = time.monotonic()
+    assert not osa.wait_until_ready(timeout=0.05,strategy='opc')
+    assert time.monotonic() - start < 0.15
+    # the answer of the aborted *OPC? is not taken for the next query
+    time.sleep(0.2)
+    assert osa.get_many(['span','centerwl']) == {'span':0.0,'centerwl':0.0}
+    assert osa._visa.timeout == 2000
+
+
+def test_wait_until_ready_srq(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.2})
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    osa.start_sweep()
+    start = time.monotonic()
+    assert not osa.wait_until_ready(timeout=0.05,strategy='srq')
+    assert osa.wait_until_ready(timeout=2,strategy='srq')
+    assert osa.is_ready() and time.monotonic() - start > 0.15
+    # the event status register was read, the request is gone
+    assert osa._visa.stb == 0
+    assert osa.get_many(['span']) == {'span':0.0}
+
+
+def test_rto_is_ready_does_not_block(rm):
+    rm.add('SIM::rto::INSTR',RS_RTO1044,operations={'SINGle':1.0})
+    rto = RS_RTO1044(rm,'SIM::rto::INSTR')
+    rto._visa.write('SINGle')
+    start = time.monotonic()
+    assert not rto.is_ready()
+    assert not rto.wait_until_ready(timeout=0.1,strategy='poll')
+    assert time.monotonic() - start < 0.5
+    assert rto.wait_until_ready(timeout=2) and rto.is_ready()
+
+
+def test_snapshot_apply_sends_only_changes(rm,osa,messages,tmp_path):
+    osa.set_many({'centerwl':1.55e-6,'span':10e-9})
+    path = str(tmp_path/'job.json')
+    snapshot = osa.snapshot(path)
+    assert snapshot['centerwl'] == 1.55e-6
+
+    osa.centerwl = 1.31e-6
+    received = messages(rm.instruments['SIM::osa::INSTR'])
+    assert osa.apply(path) == {'centerwl':1.55e-6}
+    assert sum('CENT 1.55e-06' in message for message in received) == 1
+    assert not any('SPAN ' in message for message in received)
+    assert osa.apply(snapshot) == {}
+
+
+def test_snapshot_skips_queries_with_set_commands(rm,messages):
+    rm.add('SIM::rto::INSTR',RS_RTO1044)
+    rto = RS_RTO1044(rm,'SIM::rto::INSTR')
+    received = messages(rm.instruments['SIM::rto::INSTR'])
+    snapshot = rto.snapshot()
+    assert not 'points' in snapshot and not 'resolution' in snapshot
+    assert 'time_range' in snapshot
+    assert not any('AUTO' in message for message in received)
+
+
+def test_choose_encoding():
+    encodings = compile_instrument(AQ6370C,AQ6370C._conffile)._transfer['encodings']
+    assert choose_encoding(encodings,'fastest') == 'float32'
+    assert choose_encoding(encodings,'lossless') == 'float64'
+    assert choose_encoding(encodings,24) == 'float32'
+    assert choose_encoding(encodings,40) == 'float64'
+    assert choose_encoding(encodings,'ascii') == 'ascii'
+    with pytest.raises(AttributeError):
+        choose_encoding(encodings,60)
+    with pytest.raises(AttributeError):
+        choose_encoding(encodings,'int8')
+
+
+def test_set_transfer_format(osa):
+    assert osa.transfer_format == 'float64'
+    assert osa.read_trace_into('data').dtype == np.float64
+    assert osa.set_transfer_format('fastest') == 'float32'
+    assert osa.read_trace_into('data').dtype == np.float32
+    osa.set_transfer_format('ascii')
+    data = osa.read_trace_into('data')
+    assert data.dtype == np.float64 and len(data) == 1001
+
+
+def test_read_trace_into(osa):
+    data = osa.read_trace_into('data')
+    assert np.array_equal(data,osa.data)
+
+    out = np.zeros(1200)
+    result = osa.read_trace_into('data',out=out,scale=2.0,offset=1.0)
+    assert np.allclose(result,2*data + 1) and np.shares_memory(result,out)
+
+    with pytest.raises(AttributeError):
+        osa.read_trace_into('data',out=np.zeros(10))
+    # the block was read completely
+    assert osa.get_many(['span']) == {'span':0.0}
+
+
+def test_read_trace_into_rejects_integer_out_with_scaling(rm):
+    rm.add('SIM::tek::INSTR',Tktx_DP7254,values={'points':1000})
+    tek = Tktx_DP7254(rm,'SIM::tek::INSTR')
+    raw = tek.read_trace_into('curve')
+    out = np.empty(1000,dtype=raw.dtype)
+    assert np.array_equal(tek.read_trace_into('curve',out=out),raw)
+    with pytest.raises(AttributeError):
+        tek.read_trace_into('curve',out=out,scale=2.0)
+
+
+def test_headerless_block_containing_termination(rm):
+    sim = rm.add('SIM::ssa::INSTR',SSA3000X,header='empty',values={'points':102})
+    ssa = SSA3000X(rm,'SIM::ssa::INSTR')
+    # float32 data made of newline bytes
+    sim._traceData[('data1',102,'f',False)] = b'\n'*(4*102)
+    assert ssa.points == 102
+    assert len(ssa.get_trace('data1').data) == 102
+    assert len(ssa.data1) == 102
+    assert ssa.get_many(['center','span']) == {'center':0.0,'span':0.0}
+
+
+def test_headerless_block_of_unknown_length(rm):
+    rm.add('SIM::ssa::INSTR',SSA3000X,header='empty',values={'points':0})
+    ssa = SSA3000X(rm,'SIM::ssa::INSTR')
+    with pytest.raises(AttributeError):
+        ssa.read_trace_into('data1')
+    with pytest.raises(AttributeError):
+        ssa.data1
+    assert ssa.get_many(['center']) == {'center':0.0}
+
+
+def test_get_trace_axis(osa):
+    osa.set_many({'startwl':1500e-9,'stopwl':1600e-9,'points':101})
+    trace = osa.get_trace('data')
+    assert len(trace) == 101 and trace.x_unit == 'm'
+    assert trace.x[0] == pytest.approx(1500e-9) and trace.x[-1] == pytest.approx(1600e-9)
+
+
+def test_transaction_holds_resource_lock(osa):
+    acquired = []
+    def other():
+        acquired.append(osa._lock.acquire(timeout=0.05))
+    with osa.transaction():
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        osa.span
+    assert acquired == [False]
+    with osa.transaction(timeout=0.05):
+        pass
+
+
+def test_fetch_traces(rm):
+    rm.add('SIM::rto::INSTR',RS_RTO1044,points=500)
+    rto = RS_RTO1044(rm,'SIM::rto::INSTR')
+    traces = rto.fetch_traces(['ch1_data','ch2_data'])
+    assert traces.data.shape == (2,500)
+    assert np.array_equal(traces.data[0],rto.ch1_data)
+
+
+def test_fetch_sources(rm):
+    sim = rm.add('SIM::tek::INSTR',Tktx_DP7254,values={'points':400,'channel':'CH3','yscale':0.5})
+    tek = Tktx_DP7254(rm,'SIM::tek::INSTR')
+    assert tek.fetch_traces(['ch1','ch2']).data.shape == (2,400)
+    # the previous source is selected again, so single reads stay in sync
+    assert sim.state['channel'] == 'CH3'
+    assert tek.curve.shape == (400,)
+    assert tek.yscale == 0.5
+
+
+def test_segments(rm):
+    rm.add('SIM::rto::INSTR',RS_RTO1044)
+    rto = RS_RTO1044(rm,'SIM::rto::INSTR')
+    rto.configure_segments(4,100)
+    segments = rto.fetch_segments()
+    assert segments.data.shape == (4,100)
+    rto.disable_segments()
+    assert rto.ch1_data.shape == (100,)
+
+
+def test_segments_transfer_length(rm,messages):
+    sim = rm.add('SIM::tek::INSTR',Tktx_DP7254,values={'points':500})
+    tek = Tktx_DP7254(rm,'SIM::tek::INSTR')
+    received = messages(sim)
+    tek.configure_segments(4,200)
+    assert tek.fetch_segments().data.shape == (4,200)
+    # the transfer covers one segment of the new length, not the setup length
+    assert any('DATA:STOP 200' in message for message in received)
+
+
+def test_lazy_connection(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C)
+    osa = AQ6370C(rm,'SIM::osa::INSTR',lazy=True)
+    assert not osa.connected
+    osa.span
+    assert osa.connected
+    osa.disconnect()
+    assert not osa.connected and osa.ping()
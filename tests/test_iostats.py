@@ -0,0 +1,61 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the I/O statistics on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+from sci_instr.iostats import IOStats, command_key
+from sci_instr.misc import Katana
+from sci_instr.osa import AQ6370C
+
+
+
+def test_command_key():
+    assert command_key(':SENS:WAV:CENT 1.55e-06;*OPC?') == ':SENS:WAV:CENT;*OPC?'
+
+
+def test_queries_writes_and_binary_reads(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C)
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    stats = osa.enable_io_stats(log_size=10)
+    osa.centerwl = 1.55e-6
+    osa.get_many(['span','bandwidth'])
+    nbytes = osa.read_trace_into('data').nbytes
+
+    resource = 'SIM::osa::INSTR'
+    assert stats.stats(resource,':SENS:WAV:CENT 1e-6','write').count == 1
+    assert stats.stats(resource,':SENS:WAV:SPAN?;:SENS:BAND:RES?','query').count == 1
+    reads = stats.stats(resource,':TRAC:Y? TRA','read')
+    assert reads is not None and reads.bytes_in >= nbytes
+    assert 0 < len(stats.log) <= stats.log.maxlen == 10
+    assert 'sci_instr_command_seconds_count' in stats.to_prometheus()
+
+    assert osa.disable_io_stats() is stats and osa.io_stats is None
+    osa.span
+    assert stats.stats(resource,':SENS:WAV:SPAN?','query') is None
+
+
+def test_batched_serial_io(rm):
+    rm.add('SIM::katana::INSTR',Katana)
+    katana = Katana(rm,'SIM::katana::INSTR')
+    stats = katana.enable_io_stats()
+    assert katana.get_many(['frequency','laser']) == {'frequency':0.0,'laser':0.0}
+    katana.set_many({'frequency':10,'laser':1})
+    entries = stats.as_dict()['SIM::katana::INSTR']
+    assert entries['f;ld']['query']['count'] == 2
+    assert entries['f;ld']['query']['bytes_in'] > 0
+
+
+def test_stats_survive_reconnect(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C)
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    stats = IOStats()
+    assert osa.enable_io_stats(stats) is stats
+    osa.disconnect()
+    osa.span
+    assert osa.io_stats is stats
+    assert stats.stats('SIM::osa::INSTR',':SENS:WAV:SPAN?').count == 1
@@ -0,0 +1,80 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the instrument pool on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import threading
+
+import pytest
+
+from sci_instr.misc import TL_PM100
+from sci_instr.osa import AQ6370C
+from sci_instr.pool import InstrumentPool
+
+
+
+@pytest.fixture
+def pool(rm):
+    # both spellings of GPIB0::23::INSTR open the same simulated instrument
+    sim = rm.add('GPIB0::23::INSTR',AQ6370C)
+    rm.instruments['GPIB::23'] = sim
+    return InstrumentPool(rm,health_interval=0)
+
+
+def test_spellings_share_one_session(pool):
+    pool.register('GPIB::23',AQ6370C)
+    osa = pool.get('GPIB0::23::INSTR')
+    assert pool.get('GPIB::23') is osa
+    assert 'GPIB0::23::INSTR' in pool and 'GPIB::23' in pool
+    assert pool.lock('GPIB::23') is pool.lock('GPIB0::23::INSTR')
+
+
+def test_register_conflicts(pool):
+    pool.register('GPIB::23',AQ6370C)
+    pool.register('GPIB0::23::INSTR',AQ6370C)
+    with pytest.raises(AttributeError):
+        pool.register('GPIB0::23::INSTR',TL_PM100)
+    with pytest.raises(AttributeError):
+        pool.register('GPIB0::23::INSTR',AQ6370C,lazy=True)
+    with pytest.raises(AttributeError):
+        pool.get('GPIB::23',TL_PM100)
+    with pytest.raises(AttributeError):
+        pool.get('GPIB::24')
+
+
+def test_health_check_reconnects_silent_instrument(pool):
+    osa = pool.get('GPIB::23',AQ6370C)
+    with pool.lease('GPIB::23') as leased:
+        assert leased is osa
+    # the session stays open, but the instrument does not answer
+    osa._session.instrument.execute = lambda message: []
+    with pool.lease('GPIB::23') as leased:
+        assert not leased is osa
+    assert not osa.connected
+
+
+def test_lease_is_exclusive(pool):
+    osa = pool.get('GPIB::23',AQ6370C)
+    entered = threading.Event()
+    release = threading.Event()
+    def hold():
+        with pool.lease('GPIB::23'):
+            entered.set()
+            release.wait(1)
+    thread = threading.Thread(target=hold)
+    thread.start()
+    entered.wait(1)
+    assert not pool.lock('GPIB::23').acquire(timeout=0.05)
+    release.set()
+    thread.join()
+    assert pool.lock('GPIB::23').acquire(timeout=0.05)
+    pool.lock('GPIB::23').release()
+
+    pool.close()
+    assert not osa.connected
+    assert not pool.get('GPIB::23') is osa
@@ -0,0 +1,73 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the trace recorder and store on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import os
+import numpy as np
+import pytest
+
+from sci_instr.oscilloscope import RS_RTO1044, Tktx_DP7254
+from sci_instr.recorder import TraceRecorder, TraceStore
+
+
+
+@pytest.fixture
+def tek(rm):
+    values = {'points':500,'yscale':0.01,'yoffset':0.5,'doffset':10,'xincrement':1e-9,'yunit':'"V"','xunit':'"s"'}
+    rm.add('SIM::tek::INSTR',Tktx_DP7254,values=values)
+    return Tktx_DP7254(rm,'SIM::tek::INSTR')
+
+
+def test_record_and_read_back(tek,tmp_path):
+    path = str(tmp_path/'capture')
+    with TraceRecorder(tek,'curve',path,chunk_size=4,depth=2) as recorder:
+        for _ in range(10):
+            recorder.record()
+    with pytest.raises(AttributeError):
+        TraceRecorder(tek,'curve',path)
+
+    raw = tek.read_trace_into('curve')
+    store = TraceStore(path)
+    assert len(store) == 10 and store.dtype == raw.dtype
+    assert len([name for name in os.listdir(path) if name.endswith('.npy')]) == 3
+    assert np.array_equal(store[9],raw) and np.array_equal(store[-1],raw)
+    assert store[2:7].shape == (5,500) and np.array_equal(store[[0,5,9]][1],raw)
+    assert np.all(np.diff(store.timestamps) >= 0)
+
+    # the stored settings give the same scaling and axis as the instrument
+    trace = store.trace(3)
+    expected = tek.get_trace('curve')
+    assert np.allclose(trace.data,expected.data) and np.allclose(trace.x,expected.x)
+    assert trace.y_unit == 'V' and trace.x_unit == 's'
+    assert store.trace_settings(3)['props']['yscale'] == 0.01
+
+
+def test_append_with_settings(tek,tmp_path):
+    path = str(tmp_path/'capture')
+    data = np.arange(20,dtype='f').reshape(2,10)
+    with TraceRecorder(tek,'curve',path,chunk_size=8) as recorder:
+        recorder.append(data[0],timestamp=1.0,settings={'axis':{'x_step':0.5,'y_scale':2.0}})
+        recorder.append(data[1],timestamp=2.0)
+        with pytest.raises(AttributeError):
+            recorder.append(np.zeros(11,dtype='f'))
+
+    store = TraceStore(path)
+    assert np.array_equal(store[:],data) and list(store.timestamps) == [1.0,2.0]
+    trace = store.trace(1)
+    assert np.array_equal(trace.data,2*data[1]) and trace.x[-1] == 4.5
+
+
+def test_settings_without_set_commands(rm,messages,tmp_path):
+    sim = rm.add('SIM::rto::INSTR',RS_RTO1044,points=100)
+    rto = RS_RTO1044(rm,'SIM::rto::INSTR')
+    received = messages(sim)
+    with TraceRecorder(rto,'ch1_data',str(tmp_path/'capture')) as recorder:
+        recorder.record()
+    assert not any('AUTO' in message for message in received)
+    assert 'time_range' in TraceStore(str(tmp_path/'capture')).trace_settings(0)['props']
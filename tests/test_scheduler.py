@@ -0,0 +1,101 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the deadline scheduler on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import time
+
+import pytest
+
+from sci_instr.misc import TL_PM100, TL_TSP01
+from sci_instr.scheduler import Scheduler
+
+
+
+def test_periodic_rates_on_instruments(rm):
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    rm.add('SIM::tsp::INSTR',TL_TSP01)
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    tsp = TL_TSP01(rm,'SIM::tsp::INSTR')
+
+    scheduler = Scheduler()
+    scheduler.add(pm,lambda: pm.power,period=0.01,label='power')
+    scheduler.add(tsp,lambda: tsp.get_many(['temperature_int','humidity']),period=0.05,label='climate')
+    report = scheduler.run(0.5)
+
+    assert set(report['workers']) == {pm._resourceKey,tsp._resourceKey}
+    for label, rate in (('power',100),('climate',20)):
+        job = report['jobs'][label]
+        assert job['errors'] == 0
+        assert job['achieved_hz'] == pytest.approx(rate,rel=0.2)
+    assert scheduler.results['climate'][1] == {'temperature_int':0.0,'humidity':0.0}
+
+
+def test_one_shot_and_count():
+    scheduler = Scheduler()
+    calls = []
+    scheduler.add(None,lambda: calls.append('once'),label='once',start=0.01)
+    scheduler.add(None,lambda: calls.append('three'),period=0.01,count=3,label='three')
+    start = time.monotonic()
+    report = scheduler.run()
+    assert time.monotonic() - start < 1
+    assert calls.count('once') == 1 and calls.count('three') == 3
+    assert report['jobs']['once']['achieved_hz'] is None
+
+
+def test_errors_and_callback():
+    received = []
+    def failing():
+        raise ValueError('no answer')
+    scheduler = Scheduler()
+    scheduler.add(None,failing,period=0.01,count=3,label='failing')
+    scheduler.add(None,lambda: 42,count=1,label='answer',callback=lambda *args: received.append(args))
+    report = scheduler.run()
+    assert report['jobs']['failing']['errors'] == 3
+    assert isinstance(scheduler.errors['failing'][1],ValueError)
+    assert received[0][0] == 'answer' and received[0][2] == 42
+
+
+def test_edf_and_priority_blocking():
+    scheduler = Scheduler()
+    scheduler.add(None,lambda: None,period=1.0,duration=0.5,label='sweep')
+    scheduler.add(None,lambda: None,period=0.1,duration=0.01,priority=1,tolerance=0.05,label='power',start=0.2)
+    scheduler.add(None,lambda: None,period=0.5,duration=0.01,label='climate')
+    worker = scheduler._workers['host']
+    jobs = scheduler._jobs
+
+    # climate has the earlier deadline
+    job, _ = scheduler._next(worker,0.0)
+    assert job is jobs['climate']
+    jobs['climate'].release = 0.5
+    # the sweep would delay power (released at 0.2) beyond its tolerance
+    job, wake = scheduler._next(worker,0.0)
+    assert job is None and wake == pytest.approx(0.2)
+    job, _ = scheduler._next(worker,0.2)
+    assert job is jobs['power']
+
+
+def test_missed_releases_are_skipped():
+    scheduler = Scheduler()
+    scheduler.add(None,lambda: time.sleep(0.05),period=0.01,label='slow')
+    report = scheduler.run(0.3)
+    job = report['jobs']['slow']
+    assert job['missed'] > 0
+    assert job['runs'] + job['missed'] == pytest.approx(30,abs=6)
+
+
+def test_add_while_running():
+    scheduler = Scheduler()
+    with scheduler:
+        scheduler.add(None,lambda: None,period=0.01,label='late')
+        time.sleep(0.2)
+    assert scheduler.report()['jobs']['late']['runs'] >= 10
+    with pytest.raises(AttributeError):
+        scheduler.add(None,lambda: None,period=0.01,label='late')
+    with pytest.raises(AttributeError):
+        scheduler.add(None,lambda: None,period=0,label='zero')
@@ -0,0 +1,39 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the pipelined serial link on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+from sci_instr.misc import Katana
+from sci_instr.serial_link import SerialLink
+
+
+
+def test_katana_batches_one_write(rm):
+    sim = rm.add('SIM::katana::INSTR',Katana)
+    katana = Katana(rm,'SIM::katana::INSTR')
+    assert isinstance(katana._visa,SerialLink)
+    katana.verify_mode = 'never'
+    link = katana._visa
+    link.reset_stats()
+
+    katana.set_many({'frequency':10,'pumpCurrent':100})
+    assert sim.state['frequency'] == '10' and sim.state['pumpCurrent'] == '100'
+    assert katana.get_many(['frequency','pumpCurrent','laser']) == {'frequency':10.0,'pumpCurrent':100.0,'laser':0.0}
+    stats = link.stats()
+    assert stats['writes'] == 2 and stats['messages'] == 5 and stats['frames'] == 5
+
+
+def test_frames_split_on_terminator(rm):
+    rm.add('SIM::katana::INSTR',Katana)
+    link = Katana(rm,'SIM::katana::INSTR')._visa
+    assert link.query_many(['f','ld']) == ['0','0']
+    assert link.write_many(['f','ld'],replies=1) == ['0','0']
+    link.write('f')
+    link.write('ld')
+    assert link.read_frames(2) == ['0','0']
+    assert link.stats()['bytes_in'] > 0
@@ -0,0 +1,49 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the continuous acquisition into a ring buffer
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import numpy as np
+import pytest
+
+from sci_instr.osa import AQ6370C
+from sci_instr.stream import TraceStream
+
+
+
+@pytest.fixture
+def osa(rm):
+    rm.add('SIM::osa::INSTR',AQ6370C,operations={':init':0.001})
+    return AQ6370C(rm,'SIM::osa::INSTR')
+
+
+def test_stream_reads_into_ring_buffer(osa):
+    expected = np.array(osa.data)
+    stream = TraceStream(osa,'data',depth=4,trigger=osa.start_sweep,count=10)
+    with stream:
+        traces = [data.copy() for data in stream]
+    assert len(traces) == 10 and stream.dropped == 0
+    assert all(np.array_equal(data,expected) for data in traces)
+    assert stream.buffer.shape == (4,1001)
+
+
+@pytest.mark.parametrize('dtype,expected',[(None,np.float64),('f',np.float32)])
+def test_stream_dtype(osa,dtype,expected):
+    # without dtype the buffer takes the dtype of the first trace
+    stream = TraceStream(osa,'data',points=1001,dtype=dtype,count=2,copy=True)
+    with stream:
+        traces = list(stream)
+    assert stream.buffer.dtype == expected and traces[0].dtype == expected
+
+
+def test_stream_without_blocking_drops_oldest(osa):
+    stream = TraceStream(osa,'data',depth=2,block=False,count=6)
+    stream.start()
+    stream._thread.join()
+    assert stream.acquired == 6 and stream.dropped == 4
+    assert len(list(stream)) == 2
@@ -0,0 +1,79 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the sweep engine on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import os
+import numpy as np
+
+import sci_instr.generic
+from sci_instr.misc import TL_PM100
+from sci_instr.osa import AQ6370C
+from sci_instr.oscilloscope import Tktx_DP7254
+from sci_instr.sweep import Sweep, snake_order
+
+
+
+def test_snake_order():
+    assert list(snake_order((2,3))) == [(0,0),(0,1),(0,2),(1,2),(1,1),(1,0)]
+    order = list(snake_order((3,2,2)))
+    assert sorted(order) == sorted(np.ndindex(3,2,2))
+    # one index changes by one from point to point
+    for first, second in zip(order,order[1:]):
+        assert sum(abs(a - b) for a,b in zip(first,second)) == 1
+
+
+def test_sweep_order_and_results(rm,messages):
+    pm_sim = rm.add('SIM::pm::INSTR',TL_PM100)
+    rm.add('SIM::osa::INSTR',AQ6370C,values={'points':201},operations={':init':0.002})
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    osa = AQ6370C(rm,'SIM::osa::INSTR')
+    pm.verify_mode = 'never'
+    received = messages(pm_sim)
+
+    sweep = Sweep([(pm,'wavelength',[1300,1550]),(pm,'range',[1,2,3])],
+                  [(osa,'data','start_sweep'),(pm,'power')])
+    data = sweep.run()
+    assert data['data'].shape == (2,3,201)
+    assert data['power'].shape == (2,3) and not np.isnan(data['power']).any()
+    assert not np.isnan(sweep.timestamps).any()
+
+    sets = [message for message in received if not '?' in message]
+    commands = [command for message in sets for command in message.split(';')]
+    ranges = [command.split()[-1] for command in commands if 'RANG:UPP' in command]
+    wavelengths = [command.split()[-1] for command in commands if 'CORR:WAV' in command]
+    # snake order: the inner axis runs back, unchanged values are not sent
+    assert ranges == ['1','2','3','2','1']
+    assert wavelengths == ['1300','1550']
+    # the first point sets both properties with one message
+    assert 'CORR:WAV' in sets[0] and 'RANG:UPP' in sets[0]
+
+
+def test_sweep_without_snake(rm):
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    sweep = Sweep([(pm,'wavelength',[1300,1550]),(pm,'range',[1,2])],[(pm,'power')],snake=False,overlap=False)
+    assert list(sweep.order()) == [(0,0),(0,1),(1,0),(1,1)]
+    assert sweep.run()['power'].shape == (2,2)
+
+
+def test_sweep_of_integer_traces(rm,tmp_path):
+    # the scope without the scaling options returns digitizing levels
+    conffile = tmp_path/'scope.yaml'
+    lines = open(os.path.join(os.path.dirname(sci_instr.generic.__file__),'config',Tktx_DP7254._conffile)).read().splitlines()
+    conffile.write_text('\n'.join(line for line in lines if not line.strip().startswith('y_')))
+
+    class Scope(Tktx_DP7254):
+        _conffile = str(conffile)
+    rm.add('SIM::tek::INSTR',Scope,values={'points':100})
+    scope = Scope(rm,'SIM::tek::INSTR')
+    assert scope.get_trace('curve').data.dtype.kind in 'iu'
+
+    data = Sweep([(scope,'yscale',[1,2])],[(scope,'curve')]).run()
+    assert data['curve'].shape == (2,100) and data['curve'].dtype == np.float64
+    assert not np.isnan(data['curve']).any()
@@ -0,0 +1,60 @@
+""" Scientific - Instrumentation module based on pyvisa
+
+tests of the telemetry poller on simulated instruments
+
+"""
+
+__author__ = 'Tim Hellwig'
+
+
+
+import time
+
+import pytest
+
+from sci_instr.misc import TL_PM100, TL_TSP01
+from sci_instr.telemetry import TelemetryPoller
+
+
+
+def test_rates_and_history(rm,messages):
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    tsp_sim = rm.add('SIM::tsp::INSTR',TL_TSP01)
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    tsp = TL_TSP01(rm,'SIM::tsp::INSTR')
+    received = messages(tsp_sim)
+
+    poller = TelemetryPoller()
+    assert poller.add(pm,'power',rate=50,label='pm',history=1000) == ['pm.power']
+    poller.add(tsp,['temperature_int','humidity'],rate=20,label='tsp',history=3)
+    assert poller.latest('pm.power') == (None,None)
+    with poller:
+        time.sleep(0.5)
+
+    assert len(poller.history('pm.power')) == pytest.approx(25,abs=5)
+    assert len(poller.history('tsp.humidity')) == 3
+    timestamp, value = poller.latest('tsp.temperature_int')
+    assert value == 0.0 and timestamp == poller.history('tsp.humidity')[-1][0]
+    # properties due together are read with one message
+    assert len(received) == pytest.approx(10,abs=3)
+    assert all('SENSe1:DATA?' in message and 'SENSe2:DATA?' in message for message in received)
+    assert poller.errors == {}
+
+
+def test_errors_and_channels(rm):
+    rm.add('SIM::pm::INSTR',TL_PM100)
+    pm = TL_PM100(rm,'SIM::pm::INSTR')
+    poller = TelemetryPoller()
+    poller.add(pm,'power',rate=100)
+    with pytest.raises(AttributeError):
+        poller.add(pm,'power',rate=10)
+    with pytest.raises(AttributeError):
+        poller.add(pm,'wavelength',rate=0)
+    with pytest.raises(AttributeError):
+        poller.history(poller.channels[0])
+
+    pm._visa.instrument.execute = lambda message: []
+    with poller:
+        time.sleep(0.05)
+    assert poller.value(poller.channels[0]) is None
+    assert poller.channels[0] in poller.errors